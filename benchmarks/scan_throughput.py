@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Scan throughput benchmark.
+
+    Runs `scan.do_scan`, `gui.Scan.start` and the asyncio scan runner end to
+    end against a local stand-in for the SAM-FP plugin for every combination
+    of number of channels, sweeps and frames, and writes the results as JSON
+    so they can be compared between releases:
+
+        $ python benchmarks/scan_throughput.py --channels 5 49 --sweeps 1 3 \
+            --output bench.json
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import configparser
+import contextlib
+import datetime
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import samfp_gui
+from samfp_gui import journal, scan
+from samfp_gui.instrument import Recorder
+from samfp_gui.mock_server import MockPlugin
+
+ENGINES = ['do_scan', 'pipelined', 'gui', 'async']
+
+
+def run_do_scan(n_channels, n_sweeps, n_frames, exptime, pipelined=False):
+
+    cfg = configparser.RawConfigParser()
+
+    cfg.add_section('image')
+    cfg.set('image', 'basename', 'bench')
+    cfg.set('image', 'comment', 'benchmark')
+    cfg.set('image', 'dir', '/tmp')
+    cfg.set('image', 'type', 'OBJECT')
+    cfg.set('image', 'title', 'bench')
+
+    cfg.add_section('obs')
+    cfg.set('obs', 'exptime', exptime)
+    cfg.set('obs', 'nframes', n_frames)
+
+    cfg.add_section('scan')
+    cfg.set('scan', 'id', 'SCAN_BENCH')
+    cfg.set('scan', 'nsweeps', n_sweeps)
+    cfg.set('scan', 'nchannels', n_channels)
+    cfg.set('scan', 'stime', 0)
+    cfg.set('scan', 'zstart', 2000)
+    cfg.set('scan', 'zstep', -8)
+    cfg.set('scan', 'pipelined', str(pipelined))
+
+    scan.do_scan(cfg)
+
+
+def run_pipelined(n_channels, n_sweeps, n_frames, exptime):
+    run_do_scan(n_channels, n_sweeps, n_frames, exptime, pipelined=True)
+
+
+def run_async(n_channels, n_sweeps, n_frames, exptime):
+
+    import asyncio
+    from samfp_gui.aioclient import AsyncClient, AsyncScanRunner
+    from samfp_gui.plan import ScanPlan
+
+    async def _scan():
+        async with AsyncClient() as client:
+            await client.set_image_basename('bench')
+            await client.set_comment('benchmark')
+            await client.set_image_path('/tmp')
+            await client.set_image_type('OBJECT')
+            await client.set_target_name('bench')
+            await client.set_image_exposure_time(exptime)
+            await client.set_image_nframes(n_frames)
+            await client.set_scan_id('SCAN_BENCH')
+
+        runner = AsyncScanRunner(ScanPlan(2000, -8, n_channels, n_sweeps),
+                                 exptime, n_frames, settle=0)
+        await runner.run()
+
+    asyncio.run(_scan())
+
+
+def run_gui(n_channels, n_sweeps, n_frames, exptime):
+
+    from samfp_gui.config import ScanConfig
+    from samfp_gui.gui import Scan
+
+    cfg = configparser.RawConfigParser()
+
+    cfg.add_section('file')
+    cfg.set('file', 'basename', 'bench')
+    cfg.set('file', 'path', '/tmp')
+
+    cfg.add_section('obs')
+    cfg.set('obs', 'binning', 4)
+    cfg.set('obs', 'comment', 'benchmark')
+    cfg.set('obs', 'exptime', exptime)
+    cfg.set('obs', 'nframes', n_frames)
+    cfg.set('obs', 'title', 'bench')
+    cfg.set('obs', 'type', 'OBJECT')
+
+    # The same moves as the other engines, without intermediate ones
+    cfg.add_section('fp')
+    cfg.set('fp', 'maxjump', 0)
+
+    cfg.add_section('gui')
+    cfg.set('gui', 'active_page', 0)
+
+    cfg.add_section('scan')
+    cfg.set('scan', 'id', 'SCAN_BENCH')
+    cfg.set('scan', 'nchannels', n_channels)
+    cfg.set('scan', 'nsweeps', n_sweeps)
+    cfg.set('scan', 'zstart', 2000)
+    cfg.set('scan', 'zstep', -8)
+
+    s = Scan()
+    s.n_steps = n_channels * n_sweeps
+    s.config = ScanConfig.from_config(cfg)
+    s.start()
+
+
+def benchmark(engine, n_channels, n_sweeps, n_frames, exptime=0.01,
+              readout=0.01, move_delay=0., connect_delay=0.):
+    """
+    Run one scan against a fresh mock plugin and measure it.
+
+    Returns
+    -------
+    result (dict) : the scan parameters and the measured quantities.
+    """
+    result = dict(engine=engine, n_channels=n_channels, n_sweeps=n_sweeps,
+                  n_frames=n_frames, exptime=exptime, readout=readout,
+                  move_delay=move_delay, connect_delay=connect_delay)
+
+    runner = {'do_scan': run_do_scan, 'pipelined': run_pipelined,
+              'gui': run_gui, 'async': run_async}[engine]
+
+    with MockPlugin(port=0, readout_delay=readout, move_delay=move_delay,
+                    connect_delay=connect_delay) as server:
+
+        scan.close_connection()
+        scan.invalidate_remote_state()
+        scan.HOST, scan.PORT = server.host, server.port
+        recorder = Recorder()
+        previous_recorder = scan.set_recorder(recorder)
+
+        # The journals of the benchmark scans must never be offered for
+        # resuming on the instrument
+        journal_dir = journal.JOURNAL_DIR
+        journal.JOURNAL_DIR = tempfile.mkdtemp(prefix="samfp_bench_")
+
+        error = None
+        t0 = time.monotonic()
+        try:
+            with open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                runner(n_channels, n_sweeps, n_frames, exptime)
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        finally:
+            wall_time = time.monotonic() - t0
+            scan.set_recorder(previous_recorder)
+            shutil.rmtree(journal.JOURNAL_DIR, ignore_errors=True)
+            journal.JOURNAL_DIR = journal_dir
+
+        scan.close_lanes()
+        n_commands = server.state.n_commands
+        n_exposures = server.state.n_exposures
+        scan.close_connection()
+
+    exposure_time = n_exposures * n_frames * exptime
+    overhead = wall_time - exposure_time
+    n_steps = n_channels * n_sweeps
+
+    latencies = np.array([r.done - r.start for r in recorder.commands
+                          if r.verb != 'expose']) * 1e3
+    if latencies.size == 0:
+        latencies = np.array([np.nan])
+
+    result.update(
+        error=error,
+        n_commands=n_commands,
+        n_round_trips=len(set((r.thread, r.sent) for r in recorder.commands)),
+        n_exposures=n_exposures,
+        wall_time=wall_time,
+        exposure_time=exposure_time,
+        commands_per_second=n_commands / wall_time,
+        overhead_fraction=overhead / wall_time,
+        overhead_per_channel=overhead / n_steps,
+        overhead_per_sweep=overhead / n_sweeps,
+        latency_p50_ms=float(np.percentile(latencies, 50)),
+        latency_p95_ms=float(np.percentile(latencies, 95)),
+        latency_p99_ms=float(np.percentile(latencies, 99)),
+        commands=recorder.summary(),
+    )
+
+    return result
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Scan throughput benchmark.")
+    parser.add_argument('--engine', nargs='+', choices=ENGINES,
+                        default=ENGINES)
+    parser.add_argument('--channels', nargs='+', type=int, default=[5, 49])
+    parser.add_argument('--sweeps', nargs='+', type=int, default=[1, 3])
+    parser.add_argument('--frames', nargs='+', type=int, default=[1])
+    parser.add_argument('--exptime', type=float, default=0.01,
+                        help="exposure time per frame in seconds")
+    parser.add_argument('--readout', type=float, default=0.01,
+                        help="mock readout time per frame in seconds")
+    parser.add_argument('--move-delay', type=float, default=0.,
+                        help="mock time spent on each FP move in seconds")
+    parser.add_argument('--connect-delay', type=float, default=0.,
+                        help="mock time spent on each new connection")
+    parser.add_argument('-o', '--output', default=None,
+                        help="JSON file where the results will be written")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    results = []
+    header = "{:>8s} {:>5s} {:>5s} {:>5s} {:>8s} {:>8s} {:>9s} {:>8s} " \
+             "{:>9s} {:>7s} {:>7s} {:>7s}".format(
+                 "engine", "chan", "swp", "frm", "cmds", "trips", "wall[s]",
+                 "ovh[%]", "ovh/ch[s]", "p50[ms]", "p95[ms]", "p99[ms]")
+    print(header)
+
+    for engine, n_channels, n_sweeps, n_frames in itertools.product(
+            args.engine, args.channels, args.sweeps, args.frames):
+
+        r = benchmark(engine, n_channels, n_sweeps, n_frames,
+                      exptime=args.exptime, readout=args.readout,
+                      move_delay=args.move_delay,
+                      connect_delay=args.connect_delay)
+        results.append(r)
+
+        print("{engine:>8s} {n_channels:5d} {n_sweeps:5d} {n_frames:5d} "
+              "{n_commands:8d} {n_round_trips:8d} {wall_time:9.3f} {0:8.1f} "
+              "{overhead_per_channel:9.4f} {latency_p50_ms:7.2f} "
+              "{latency_p95_ms:7.2f} {latency_p99_ms:7.2f}".format(
+                  100 * r['overhead_fraction'], **r))
+        if r['error']:
+            print("         failed: {:s}".format(r['error']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(version=samfp_gui.__version__,
+                           date=datetime.datetime.utcnow().isoformat(),
+                           results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
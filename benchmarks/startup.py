@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Startup time benchmark.
+
+    Starts a new interpreter for every run, so every import is cold, and
+    measures how long it takes to import the package, to import the headless
+    scan runner, to import the GUI, to show the first window and to have
+    every page built and the configuration loaded. The GUI runs on the
+    offscreen Qt platform unless a display is given, with an empty home
+    directory, so no display and no saved configuration are needed:
+
+        $ python benchmarks/startup.py --repeat 10 --output startup.json
+        $ python benchmarks/startup.py --baseline startup.json
+
+    With --baseline, the exit status is 1 if any stage got slower than the
+    baseline by more than --tolerance.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+STAGES = ['import_package', 'import_runner', 'import_gui', 'first_window',
+          'ready']
+
+# Runs in the child interpreter and prints the time of every stage in
+# seconds since the child started
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+marks = {}
+import samfp_gui
+marks['import_package'] = time.perf_counter() - t0
+import samfp_gui.runner
+marks['import_runner'] = time.perf_counter() - t0
+import samfp_gui.gui
+from PyQt5 import QtWidgets
+marks['import_gui'] = time.perf_counter() - t0
+app = QtWidgets.QApplication(sys.argv)
+window = samfp_gui.gui.MainWindow()
+app.processEvents()
+marks['first_window'] = time.perf_counter() - t0
+window.finish_startup()
+app.processEvents()
+marks['ready'] = time.perf_counter() - t0
+print(json.dumps(marks))
+"""
+
+
+def run_once(home):
+    """
+    Returns
+    -------
+    marks (dict) : the time of every stage, plus `total`, the wall time of
+        the whole child process including the interpreter startup.
+    """
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    if not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    t0 = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD], env=env, stderr=subprocess.DEVNULL)
+    total = time.perf_counter() - t0
+
+    marks = json.loads(output.decode().strip().splitlines()[-1])
+    marks['total'] = total
+    return marks
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return (values[(n - 1) // 2] + values[n // 2]) / 2
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns
+    -------
+    regressions (list) : the stages whose median is slower than the
+        baseline by more than `tolerance`, a fraction.
+    """
+    regressions = []
+    for stage, r in results.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]['median']
+        if r['median'] > before * (1 + tolerance):
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Startup time benchmark.")
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help="number of cold starts")
+    parser.add_argument('-o', '--output', default=None,
+                        help="JSON file where the results will be written")
+    parser.add_argument('--baseline', default=None,
+                        help="JSON file written by a previous run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown over the baseline, e.g. 0.2 "
+                             "for 20 %%")
+    args = parser.parse_args()
+
+    runs = []
+    home = tempfile.mkdtemp(prefix="samfp_startup_")
+    for i in range(args.repeat):
+        runs.append(run_once(home))
+
+    results = {}
+    for stage in STAGES + ['total']:
+        values = [r[stage] for r in runs]
+        results[stage] = dict(min=min(values), median=median(values),
+                              max=max(values))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print("{:>16s} {:>9s} {:>9s} {:>9s} {:>9s}".format(
+        "stage", "min[ms]", "p50[ms]", "max[ms]", "base[ms]"))
+    for stage in STAGES + ['total']:
+        r = results[stage]
+        before = "" if baseline is None or stage not in baseline else \
+            "{:9.1f}".format(1e3 * baseline[stage]['median'])
+        print("{:>16s} {:9.1f} {:9.1f} {:9.1f} {:>9s}".format(
+            stage, 1e3 * r['min'], 1e3 * r['median'], 1e3 * r['max'],
+            before))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(date=datetime.datetime.utcnow().isoformat(),
+                           python=sys.version.split()[0],
+                           repeat=args.repeat, results=results), f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Slower than the baseline: {:s}".format(
+                ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
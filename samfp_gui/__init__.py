@@ -4,11 +4,29 @@
     by Bruno Quint
 """
 
-from . import custom_widgets
-from . import gui
-from . import methods
-from . import pages
-from . import scan
+import importlib
+
 from . import version
 
-__version__ = "{0.api:d}.{0.feature:d}.{0.bug:d}".format(version)
\ No newline at end of file
+__version__ = "{0.api:d}.{0.feature:d}.{0.bug:d}".format(version)
+
+# The submodules are imported the first time they are used, so importing the
+# package is cheap and the command line tools never load PyQt5 (PEP 562)
+_submodules = [
+    'aioclient', 'cancel', 'config', 'connection', 'custom_widgets',
+    'engine', 'estimate', 'export', 'graph', 'gui', 'instrument', 'journal',
+    'methods', 'mock_server', 'model', 'obsqueue', 'pages', 'plan',
+    'protocol', 'qtasync', 'runner', 'scan', 'sequence', 'settle',
+    'simulation',
+]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
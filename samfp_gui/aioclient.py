@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+"""
+    asyncio client for the SAM-FP plugin protocol and a scan runner built on
+    it. Every operation is a coroutine with its own timeout, so the GUI,
+    status polling and progress reporting can share a single thread.
+"""
+
+from __future__ import print_function, division
+
+import asyncio
+import contextlib
+import inspect
+import logging
+import time
+
+from . import protocol, scan
+from .engine import BaseEngine
+from .plan import Z_MAX, Z_MIN
+from .settle import poll_result
+
+log = logging.getLogger("samfp.aioclient")
+
+
+class AsyncClient(object):
+
+    def __init__(self, host=None, port=None, timeout=10., recorder=None):
+        """
+        One stream to the SAM-FP plugin. Commands sent concurrently through
+        the same client are queued, since the protocol does not tell which
+        command a reply belongs to. Use one client per concurrent stream of
+        commands.
+
+        Settings go through the same remote state cache as `scan.set_dhe`
+        and `scan.set_dbs`, so unchanged values are not sent again, and can
+        be sent together with `batch`, as with `scan.batch`.
+
+        Parameters
+        ----------
+        host (string) : the plugin host name. Defaults to scan.HOST.
+        port (int) : the plugin port. Defaults to scan.PORT.
+        timeout (float) : default seconds to wait for a reply. `expose` waits
+            without limit unless given its own timeout.
+        recorder (instrument.Recorder) : optional. Receives the timing of
+            every command.
+        """
+        self.host = host if host is not None else scan.HOST
+        self.port = port if port is not None else scan.PORT
+        self.timeout = timeout
+        self.recorder = recorder
+
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._batch = None
+        self._pipeline_failed = False
+
+    def __repr__(self):
+        return "AsyncClient({0.host:s}:{0.port:d})".format(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    @property
+    def is_connected(self):
+        return self._writer is not None
+
+    @property
+    def is_stale(self):
+        """
+        True if the plugin closed its end of the open stream, which the
+        event loop notices while the client is idle.
+        """
+        return self._writer is not None and (
+            self._reader.at_eof() or self._writer.is_closing())
+
+    async def connect(self, timeout=None):
+        """
+        Open the stream to the plugin.
+
+        Parameters
+        ----------
+        timeout (float) : optional. Seconds to wait for the connection.
+        """
+        await self.close()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            self.timeout if timeout is None else timeout)
+        log.debug("Connected to {0.host:s}:{0.port:d}".format(self))
+
+    async def close(self):
+        """Close the stream. The next command opens a new one."""
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def send(self, command, timeout=None):
+        """
+        Send a command and wait for its reply. If the reply does not arrive
+        in time, or the wait is cancelled, the stream is closed since the
+        late reply would be read as the reply of the next command.
+
+        Parameters
+        ----------
+        command (string or bytes) : a command to be sent via TCP/IP, as
+            text or already encoded by a protocol.Template.
+        timeout (float) : optional. Seconds to wait for the reply. Defaults
+            to the client timeout.
+
+        Returns
+        -------
+        message (string) : the response from the plugin.
+
+        Raises
+        ------
+        asyncio.TimeoutError : if the reply did not arrive in time.
+        OSError : if the command could not be delivered.
+        """
+        return await self._send(
+            command, self.timeout if timeout is None else timeout)
+
+    async def send_many(self, commands, timeout=None):
+        """
+        Pipeline several commands: write all of them at once and then read
+        all the replies, in order. Nothing is retried, since it is unknown
+        which commands the plugin executed.
+
+        Parameters
+        ----------
+        commands (list) : the commands, as text or encoded bytes.
+        timeout (float) : optional. Seconds to wait for each reply. Defaults
+            to the client timeout.
+
+        Returns
+        -------
+        messages (list) : the response to each command.
+
+        Raises
+        ------
+        asyncio.TimeoutError : if a reply did not arrive in time.
+        OSError : if the commands could not be delivered.
+        """
+        return await self._exchange(
+            commands, self.timeout if timeout is None else timeout)
+
+    async def _send(self, command, timeout):
+        return (await self._exchange([command], timeout))[0]
+
+    async def _exchange(self, commands, timeout):
+        """
+        Write the commands and read their replies. As with
+        connection.Connection, a stream the plugin closed while it was idle
+        is replaced before the write, and a single idempotent command is
+        sent again on a new stream if a reused one turns out to be dead.
+        """
+        if not commands:
+            return []
+
+        data = b"".join(protocol.encode(c) for c in commands)
+        commands = [protocol.as_text(c) for c in commands]
+
+        async with self._lock:
+
+            if self.is_stale:
+                log.debug("{0.host:s}:{0.port:d} closed the idle "
+                          "connection".format(self))
+                await self.close()
+
+            reused = self.is_connected
+            try:
+                return await self._write_read(data, commands, timeout)
+            except ConnectionError as error:
+                if not reused or len(commands) > 1 or \
+                        not protocol.is_idempotent(commands[0]):
+                    raise
+                log.warning("{:s} - {} (reconnecting)".format(
+                    commands[0], error))
+
+            return await self._write_read(data, commands, timeout)
+
+    async def _write_read(self, data, commands, timeout):
+
+        messages = []
+        t_start = time.monotonic()
+        t_connected = None
+        if not self.is_connected:
+            await self.connect()
+            t_connected = time.monotonic()
+
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+            t_sent = time.monotonic()
+
+            for command in commands:
+                line = await asyncio.wait_for(self._reader.readline(),
+                                              timeout)
+                if not line.endswith(protocol.TERMINATOR):
+                    raise ConnectionResetError(
+                        "Connection closed by the plugin.")
+
+                t_done = time.monotonic()
+                message = line.decode().strip()
+                messages.append(message)
+
+                if self.recorder is not None:
+                    self.recorder.add_command(
+                        command, t_start, t_connected, t_sent, t_done,
+                        t_done, message)
+
+                log.debug("{:s} - {:s} ({:.1f} ms)".format(
+                    command, message, (t_done - t_sent) * 1e3))
+
+        except BaseException:
+            await self.close()
+            raise
+
+        return messages
+
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        """
+        Collect the settings sent through this client in the block and send
+        them together when it ends, in a single pipelined write, as
+        `scan.batch` does. If the plugin does not answer a pipelined write
+        within scan.BATCH_TIMEOUT seconds, this client sends them one by one
+        from then on. Nothing is sent if the block raises.
+
+        Inside the block the set_* coroutines return scan.QUEUED. Batches
+        opened inside another batch join the outer one.
+
+            async with client.batch() as b:
+                await client.set_scan_current_sweep(sweep)
+                await client.set_scan_current_z(z)
+            b.replies  # ['DONE', 'DONE']
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        self._batch = scan.Batch()
+        try:
+            yield self._batch
+            current_batch = self._batch
+        finally:
+            self._batch = None
+
+        await self._flush(current_batch)
+
+    async def _flush(self, current_batch):
+
+        commands = current_batch.commands
+        replies = None
+
+        if len(commands) > 1 and scan.PIPELINE and not self._pipeline_failed:
+            try:
+                replies = await self._exchange(commands, scan.BATCH_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.warning("The plugin did not answer {:d} pipelined "
+                            "commands. Sending commands one by one from now "
+                            "on.".format(len(commands)))
+                self._pipeline_failed = True
+            except OSError as error:
+                log.warning("Pipelined commands failed ({}). Sending them "
+                            "one by one.".format(error))
+
+        if replies is None:
+            replies = [await self.send(c) for c in commands]
+
+        for command, setting, message in zip(
+                commands, current_batch.settings, replies):
+            if setting is not None:
+                scan.acknowledge(*setting, message=message)
+            if not protocol.is_done(message):
+                log.warning("{:s} - {:s}".format(
+                    protocol.as_text(command), message))
+
+        current_batch.replies = replies
+        return replies
+
+    async def expose(self, timeout=None):
+        """
+        Trigger an exposure and wait until SAMI returns.
+
+        Parameters
+        ----------
+        timeout (float) : optional. Seconds to wait. No limit by default.
+
+        Returns
+        -------
+        message (string) : DONE if successful.
+        """
+        return await self._send(protocol.EXPOSE, timeout)
+
+    async def abort_exposure(self, timeout=None):
+        """
+        Ask the DHE to abort the exposure in progress. It has to be sent
+        through a client other than the one waiting for the exposure. Not
+        every version of the plugin supports it.
+        """
+        return await self.send(protocol.ABORT, timeout)
+
+    async def fp_moveabs(self, z, timeout=None):
+        """
+        Move the FP to an absolute position between 0 and 4095.
+
+        Returns
+        -------
+        message (string) : DONE if successful.
+        """
+        if Z_MAX < z or z < Z_MIN:
+            raise ValueError(
+                "z must be between 0 and 4095. Current value: {:d}".format(z))
+        return await self.send(protocol.FP_MOVEABS(z), timeout)
+
+    async def fp_status(self, timeout=None):
+        """
+        Returns
+        -------
+        message (string) : STABLE or MOVING followed by the current z
+            position, or ERROR if the plugin does not report the FP status.
+        """
+        return await self.send(protocol.FP_STATUS, timeout)
+
+    async def wait_until_stable(self, timeout, interval=0.01):
+        """
+        Poll the FP status until it reports it is stable.
+
+        Returns
+        -------
+        stable (bool) : False if it timed out or if the plugin does not
+            report the FP status.
+        """
+        t_end = time.monotonic() + timeout
+
+        while True:
+            stable = poll_result(await self.fp_status(), t_end, timeout)
+            if stable is not None:
+                return stable
+
+            await asyncio.sleep(interval)
+
+    async def set_dbs(self, key, value, timeout=None):
+        """Set a header keyword unless it already has the same value."""
+        return await self._send_cached('dhe dbs set', key, value, timeout)
+
+    async def set_dhe(self, key, value, timeout=None):
+        """Set a DHE property unless it already has the same value."""
+        return await self._send_cached('dhe set', key, value, timeout)
+
+    async def _send_cached(self, prefix, key, value, timeout):
+
+        if scan.is_acknowledged(prefix, key, value):
+            log.debug("{:s} {:s} {:s} - unchanged".format(prefix, key, value))
+            return "DONE"
+
+        if self._batch is not None:
+            self._batch.add(protocol.SETTINGS[prefix](key, value),
+                            setting=(prefix, key, value))
+            return scan.QUEUED
+
+        message = await self.send(
+            protocol.SETTINGS[prefix](key, value), timeout)
+        scan.acknowledge(prefix, key, value, message)
+
+        return message
+
+    async def set_binning(self, bin_size, timeout=None):
+        return await self.set_dhe(
+            'binning', '{0} {0}'.format(int(bin_size)), timeout)
+
+    async def set_comment(self, comment, timeout=None):
+        return await self.set_dhe('image.comment', comment, timeout)
+
+    async def set_image_basename(self, basename, timeout=None):
+        return await self.set_dhe('image.basename', basename, timeout)
+
+    async def set_image_exposure_time(self, exp_time, timeout=None):
+        return await self.set_dhe(
+            'obs.exptime', '{:f}'.format(exp_time), timeout)
+
+    async def set_image_nframes(self, nimages=1, timeout=None):
+        return await self.set_dhe(
+            'obs.nimages', '{:d}'.format(nimages), timeout)
+
+    async def set_image_path(self, path, timeout=None):
+        return await self.set_dhe('image.dir', path, timeout)
+
+    async def set_image_type(self, image_type, timeout=None):
+        options = ["DARK", "DFLAT", "OBJECT", "SFLAT", "ZERO"]
+        if image_type.upper() not in options:
+            raise ValueError("Image type {} not found within the available "
+                             "options".format(image_type))
+        return await self.set_dhe('image.type', image_type, timeout)
+
+    async def set_target_name(self, target_name, timeout=None):
+        return await self.set_dhe(
+            'image.title', scan.header_title(target_name), timeout)
+
+    async def set_scan_id(self, _id=None, key="FAPERSID", timeout=None):
+        if _id is None:
+            _id = scan.make_scan_id()
+        return await self.set_dbs(key, _id, timeout)
+
+    async def set_scan_nchannels(self, nchannels=0, key="FPNCHAN",
+                                 timeout=None):
+        return await self.set_dbs(key, '{:d}'.format(nchannels), timeout)
+
+    async def set_scan_start(self, zstart=0, key="FPZINIT", timeout=None):
+        return await self.set_dbs(key, '{:f}'.format(int(zstart)), timeout)
+
+    async def set_scan_current_sweep(self, sweep=0, key="FAPERSWP",
+                                     timeout=None):
+        return await self.set_dbs(key, '{:d}'.format(int(sweep)), timeout)
+
+    async def set_scan_current_z(self, z=0, key="FAPERSST", timeout=None):
+        return await self.set_dbs(key, '{:d}'.format(z), timeout)
+
+
+class AsyncScanRunner(BaseEngine):
+
+    def __init__(self, plan, exptime, nframes=1, settle=0.1,
+                 poll_status=False, pipelined=False, readout_time=None,
+                 shutter_margin=0.5, journal=None, recorder=None,
+                 host=None, port=None, timeout=10.):
+        """
+        The coroutine counterpart of engine.ScanEngine: it takes the same
+        parameters, shares its step, journal and settle logic through
+        engine.BaseEngine and reports progress through the same
+        `on_step(step, sweep, channel, z)` callback. Only the waits differ.
+
+        As in ScanEngine, the FP moves and the header keywords go out at the
+        same time over separate clients, the header keywords of a channel
+        in a single pipelined write. In the pipelined mode exposures go
+        through a third client, so the FP moves to the next channel while
+        the current one is being read out, and the header keywords of the
+        next channel are written once the exposure returned.
+        `on_final_readout` may return an awaitable, which is awaited.
+
+        Cancelling the task running `run` (or calling `abort`) interrupts the
+        scan right away, including the exposure in progress.
+
+        Parameters
+        ----------
+        host (string), port (int), timeout (float) : passed to the
+            AsyncClient instances. See ScanEngine for the other parameters.
+        """
+        super(AsyncScanRunner, self).__init__(
+            plan, exptime, nframes, settle, poll_status, pipelined,
+            readout_time, shutter_margin, journal, recorder)
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._task = None
+        self._aborted_at = None
+
+        self._fp = self._client()
+        self._dhe = self._client()
+        self._exposer = self._client() if self.pipelined else self._dhe
+
+    @property
+    def is_running(self):
+        return self._task is not None
+
+    def _client(self):
+        return AsyncClient(self.host, self.port, timeout=self.timeout,
+                           recorder=self.recorder)
+
+    async def run(self):
+        """
+        Run the whole plan, or until `stop` or `abort` is called.
+
+        Returns
+        -------
+        n_steps (int) : the number of channels exposed, including the ones
+            already in the journal.
+        """
+        rows, n_done = self._remaining_rows()
+
+        self._task = asyncio.current_task()
+        status = 'failed'
+
+        try:
+            if self.pipelined:
+                n = await self._run_pipelined(rows, n_done)
+            else:
+                n = await self._run_serial(rows, n_done)
+            status = 'done' if n == len(self.plan) else 'aborted'
+
+        except asyncio.CancelledError:
+            status = 'aborted'
+            if self._exposing:
+                # The scan is cancelled whether or not the DHE heard it
+                try:
+                    async with self._client() as c:
+                        await c.abort_exposure(timeout=2.)
+                except (OSError, asyncio.TimeoutError) as error:
+                    log.error("The exposure was not aborted: {}".format(
+                        error))
+            if self._aborted_at is not None:
+                self.abort_latency = self.clock() - self._aborted_at
+                log.info("Scan aborted in {:.3f} s.".format(
+                    self.abort_latency))
+            raise
+
+        finally:
+            self._task = None
+            for client in set([self._fp, self._dhe, self._exposer]):
+                await client.close()
+            self._write_end(status)
+
+        return n
+
+    def abort(self):
+        """Interrupt the scan right away. Never blocks."""
+        self._stop_requested = True
+        if self._task is not None:
+            self._aborted_at = self.clock()
+            self._task.cancel()
+
+    async def setup_first(self):
+        """
+        Move the FP to the first channel left to expose ahead of `run`. See
+        ScanEngine.setup_first.
+        """
+        rows = self.rows()
+        if rows:
+            self._prepared = rows[0], await self.setup_channel(
+                *rows[0], headers=False)
+
+    async def _setup(self, sweep, channel, z):
+        # The FP may have been moved to the first channel by setup_first
+        settled = self._take_prepared(sweep, channel, z)
+        if settled is not None:
+            await self.write_headers(sweep, channel, z)
+            return settled
+        return await self.setup_channel(sweep, channel, z)
+
+    async def setup_channel(self, sweep, channel, z, headers=True):
+        """
+        Move the FP and write the header keywords of one channel. See
+        ScanEngine.setup_channel.
+
+        Returns
+        -------
+        settled (float) : the time.monotonic() value when the FP is expected
+            to have settled.
+        """
+        self._start_channel(sweep, channel, z)
+
+        # Large jumps go through intermediate positions first
+        for z_sub in self.plan.substeps(sweep, channel):
+            await self._fp.fp_moveabs(z_sub)
+            await asyncio.sleep(self.plan.jump_pause)
+            self._z = z_sub
+
+        if headers:
+            await asyncio.gather(self._fp.fp_moveabs(z),
+                                 self.write_headers(sweep, channel, z))
+        else:
+            await self._fp.fp_moveabs(z)
+
+        return self._moved(z)
+
+    async def write_headers(self, sweep, channel, z):
+        """Write the header keywords of one channel."""
+        async with self._dhe.batch():
+            for name, value in self._header_calls(sweep, z):
+                await getattr(self._dhe, name)(value)
+
+    async def wait_settled(self, settled):
+        await asyncio.sleep(max(0, settled - self.clock()))
+        if self.poll_status:
+            await self._fp.wait_until_stable(self.settle.maximum)
+
+    async def _expose(self):
+        self._exposing = True
+        t0 = self.clock()
+        message = await self._exposer.expose()
+        self._exposure_time = self.clock() - t0
+        self._exposing = False
+        return message
+
+    async def _run_serial(self, rows, step):
+
+        for sweep, channel, z in rows:
+
+            if self._stop_requested:
+                break
+
+            settled = await self._setup(sweep, channel, z)
+            await self.wait_settled(settled)
+            message = await self._expose()
+
+            if self._step_done(message, step + 1, sweep, channel, z):
+                step += 1
+
+        return step
+
+    async def _run_pipelined(self, rows, step):
+
+        if not rows:
+            return step
+
+        settled = await self._setup(*rows[0])
+        headers = None
+
+        for i, (sweep, channel, z) in enumerate(rows):
+
+            if self._stop_requested:
+                break
+
+            # Only now that the previous frame was read out
+            if headers is not None:
+                await self.write_headers(*headers)
+                headers = None
+
+            # Interlock: never open the shutter before the FP settled
+            await self.wait_settled(settled)
+
+            t0 = self.clock()
+            exposure = asyncio.ensure_future(self._expose())
+
+            try:
+                last = i + 1 == len(rows)
+                if not last or self.on_final_readout is not None:
+                    # Wait for the shutter to close and move the FP to the
+                    # next channel while the current one is being read out
+                    await asyncio.wait([exposure], timeout=max(
+                        0, self._shutter_closed(t0) - self.clock()))
+
+                    if not self._stop_requested and last:
+                        result = self.on_final_readout()
+                        if inspect.isawaitable(result):
+                            await result
+                    elif not self._stop_requested:
+                        headers = rows[i + 1]
+                        settled = await self.setup_channel(*headers,
+                                                           headers=False)
+
+                message = await exposure
+            finally:
+                exposure.cancel()
+
+            if self._step_done(message, step + 1, sweep, channel, z):
+                step += 1
+
+        return step
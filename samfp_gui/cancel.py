@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    Cancellation token shared by every blocking operation of a scan.
+"""
+
+from __future__ import print_function, division
+
+import logging
+import threading
+import time
+
+log = logging.getLogger("samfp.cancel")
+
+
+class Cancelled(Exception):
+    """Raised by a blocking operation when its token was cancelled."""
+    pass
+
+
+class CancelToken(object):
+
+    def __init__(self, interval=0.05):
+        """
+        Cancelling the token wakes up every sleep waiting on it and makes
+        every socket read waiting on it give up within `interval` seconds.
+        Then they raise Cancelled, so the scan unwinds from wherever it was
+        blocked.
+
+        Parameters
+        ----------
+        interval (float) : the longest time in seconds an operation that
+            cannot wait on the token directly (e.g. a socket read) takes to
+            notice it was cancelled.
+        """
+        self.interval = interval
+        self.cancelled_at = None
+        self._event = threading.Event()
+
+    def __repr__(self):
+        return "CancelToken(cancelled={})".format(self.is_cancelled)
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel every operation waiting on this token. Never blocks."""
+        if not self._event.is_set():
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+            log.debug("Cancellation requested.")
+
+    def check(self):
+        """
+        Raises
+        ------
+        Cancelled : if the token was cancelled.
+        """
+        if self._event.is_set():
+            raise Cancelled("Cancelled {:.3f} s ago.".format(
+                time.monotonic() - self.cancelled_at))
+
+    def sleep(self, seconds):
+        """
+        Sleep unless the token is cancelled in the meantime.
+
+        Raises
+        ------
+        Cancelled : if the token was cancelled before or while sleeping.
+        """
+        self._event.wait(max(seconds, 0))
+        self.check()
+
+    @property
+    def latency(self):
+        """Seconds since the token was cancelled, or None."""
+        if self.cancelled_at is None:
+            return None
+        return time.monotonic() - self.cancelled_at
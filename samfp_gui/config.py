@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    Everything a scan needs, gathered in one immutable object so it can be
+    handed to the thread or the coroutine that runs the scan.
+"""
+
+from __future__ import print_function, division
+
+import collections
+import logging
+
+from .plan import ScanPlan
+from .sequence import MAX_JUMP
+
+log = logging.getLogger("samfp.config")
+
+IMAGE_TYPES = ["DARK", "DFLAT", "OBJECT", "SFLAT", "ZERO"]
+BINNINGS = [1, 2, 4]
+
+# The sections of a GUI configuration file that hold the scan of each page,
+# in the order of the tabs
+PAGE_SECTIONS = ['scan', 'calib', 'science']
+
+
+class ScanConfig(collections.namedtuple(
+        'ScanConfig',
+        ['plan', 'exptime', 'nframes', 'basename', 'path', 'binning',
+         'comment', 'title', 'image_type', 'pipelined'])):
+    """
+    The plan and the settings of a scan. It is validated when created and
+    cannot be modified afterwards, so it is safe to share between threads.
+
+    Parameters
+    ----------
+    plan (ScanPlan) : the positions to visit.
+    exptime (float) : exposure time per frame in seconds.
+    nframes (int) : number of frames per channel.
+    basename (string) : the image basename.
+    path (string) : the directory of the images.
+    binning (int) : the bin size, one of BINNINGS.
+    comment (string) : the image comment.
+    title (string) : the target name.
+    image_type (string) : one of IMAGE_TYPES.
+    pipelined (bool) : move the FP during the readout.
+
+    Raises
+    ------
+    ValueError : if any setting is out of its allowed range.
+    """
+    __slots__ = ()
+
+    def __new__(cls, plan, exptime, nframes=1, basename='', path='',
+                binning=4, comment='', title='', image_type='OBJECT',
+                pipelined=False):
+
+        if not isinstance(plan, ScanPlan):
+            raise TypeError("Expected a ScanPlan. Got {!r}.".format(plan))
+
+        exptime = float(exptime)
+        nframes = int(nframes)
+        binning = int(binning)
+        image_type = str(image_type).upper()
+
+        if exptime < 0:
+            raise ValueError(
+                "The exposure time must not be negative. "
+                "Got {:g} s.".format(exptime))
+        if nframes < 1:
+            raise ValueError(
+                "At least one frame per channel is needed. "
+                "Got {:d}.".format(nframes))
+        if binning not in BINNINGS:
+            raise ValueError("Binning must be one of {}. Got {:d}.".format(
+                BINNINGS, binning))
+        if image_type not in IMAGE_TYPES:
+            raise ValueError("Image type must be one of {}. Got {:s}.".format(
+                IMAGE_TYPES, image_type))
+
+        return super(ScanConfig, cls).__new__(
+            cls, plan, exptime, nframes, str(basename), str(path), binning,
+            str(comment), str(title), image_type, bool(pipelined))
+
+    def __repr__(self):
+        return "ScanConfig({0.plan!r}, exptime={0.exptime:g}, " \
+               "nframes={0.nframes:d})".format(self)
+
+    @property
+    def n_steps(self):
+        return len(self.plan)
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Build a scan configuration from the dictionary returned by
+        `to_dict`.
+
+        Raises
+        ------
+        KeyError : if the plan or the exposure time is missing.
+        ValueError : if the scan is out of range or any setting is invalid.
+        """
+        d = dict(d)
+        return cls(ScanPlan.from_dict(d.pop('plan')), **d)
+
+    def to_dict(self):
+        """Every setting of the scan, e.g. to save it as JSON."""
+        d = self._asdict()
+        d['plan'] = self.plan.to_dict()
+        return dict(d)
+
+    @classmethod
+    def from_config(cls, cfg, section=None):
+        """
+        Build a scan configuration from a file saved by the GUI or from a
+        plan file with the `image`, `obs` and `scan` sections read by
+        `scan.do_scan`. The scan of a GUI file is that of the page that was
+        active when it was saved, unless `section` is given.
+
+        Parameters
+        ----------
+        cfg (configparser.RawConfigParser) : the parsed file.
+        section (string) : optional. The section that holds the plan.
+
+        Returns
+        -------
+        config (ScanConfig)
+
+        Raises
+        ------
+        configparser.Error : if a section or an option is missing.
+        ValueError : if the scan is out of range or any setting is invalid.
+        """
+        if cfg.has_section('gui'):
+            if section is None:
+                page = int(cfg.getfloat('gui', 'active_page', fallback=0))
+                section = PAGE_SECTIONS[page]
+            plan = ScanPlan.from_config(
+                cfg, section,
+                clip=cfg.getboolean(section, 'clip', fallback=False),
+                max_jump=int(cfg.getfloat('fp', 'maxjump',
+                                          fallback=MAX_JUMP)))
+            return cls(plan, cfg.getfloat('obs', 'exptime'),
+                       int(cfg.getfloat('obs', 'nframes')),
+                       basename=cfg.get('file', 'basename'),
+                       path=cfg.get('file', 'path'),
+                       binning=cfg.get('obs', 'binning'),
+                       comment=cfg.get('obs', 'comment'),
+                       title=cfg.get('obs', 'title'),
+                       image_type=cfg.get('obs', 'type'),
+                       pipelined=cfg.getboolean('obs', 'pipelined',
+                                                fallback=False))
+
+        section = section or 'scan'
+        plan = ScanPlan.from_config(
+            cfg, section,
+            clip=cfg.getboolean(section, 'clip', fallback=False))
+        return cls(plan, cfg.getfloat('obs', 'exptime'),
+                   cfg.getint('obs', 'nframes'),
+                   basename=cfg.get('image', 'basename'),
+                   path=cfg.get('image', 'dir'),
+                   binning=cfg.getint('image', 'binning', fallback=4),
+                   comment=cfg.get('image', 'comment'),
+                   title=cfg.get('image', 'title'),
+                   image_type=cfg.get('image', 'type'),
+                   pipelined=cfg.getboolean(section, 'pipelined',
+                                            fallback=False))
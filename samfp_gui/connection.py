@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+    Long-lived TCP connection to the SAM-FP plugin running on SAMI's machine.
+"""
+
+from __future__ import print_function, division
+
+import collections
+import logging
+import select
+import socket
+import time
+
+from . import protocol
+from .cancel import Cancelled
+
+log = logging.getLogger("samfp.connection")
+
+
+class Connection(object):
+
+    def __init__(self, host, port, timeout=None, retries=3, retry_delay=0.5,
+                 history_size=10000, recorder=None, connect_timeout=None):
+        """
+        Keep a single socket open to the SAM-FP plugin and reuse it for every
+        command. If the socket breaks, it is reopened transparently up to
+        `retries` times before giving up.
+
+        This relies on the plugin reading commands, one per line, for as
+        long as the client keeps the connection open, and answering each
+        with one line, in order.
+
+        Parameters
+        ----------
+        host (string) : the plugin host name.
+        port (int) : the plugin port.
+        timeout (float) : socket timeout in seconds (None blocks forever).
+        retries (int) : how many times a command is retried on a new socket.
+        retry_delay (float) : seconds to wait before the first reconnection.
+            It doubles after each failed attempt.
+        history_size (int) : how many (command, latency) pairs are kept.
+        recorder (instrument.Recorder) : optional. Receives the connect,
+            send, first byte and end timestamps of every command.
+        connect_timeout (float) : seconds to wait for the plugin to accept a
+            new connection. Defaults to `timeout`.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.recorder = recorder
+
+        self.history = collections.deque(maxlen=history_size)
+        self.last_latency = None
+        self.n_connects = 0
+
+        self._socket = None
+        self._buffer = protocol.LineBuffer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def is_connected(self):
+        return self._socket is not None
+
+    def close(self):
+        """Close the socket. The next command will open a new one."""
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+        self._buffer.clear()
+
+    def close_if_stale(self):
+        """
+        Close the socket if the plugin already closed its end, e.g. while
+        the connection was idle, so the next command goes out on a new
+        socket instead of being written into a dead one.
+
+        Returns
+        -------
+        stale (bool) : True if the socket was closed.
+        """
+        if self._socket is None:
+            return False
+
+        try:
+            readable = select.select([self._socket], [], [], 0)[0]
+            stale = bool(readable) and \
+                self._socket.recv(1, socket.MSG_PEEK) == b""
+        except socket.error:
+            stale = True
+
+        if stale:
+            log.debug("{0.host:s}:{0.port:d} closed the idle connection"
+                      .format(self))
+            self.close()
+        return stale
+
+    def connect(self):
+        """
+        Open the socket trying every address returned for HOST:PORT.
+
+        Raises
+        ------
+        socket.error : if none of the addresses accepted the connection.
+        """
+        self.close()
+
+        error = socket.error(
+            "Could not resolve {0.host:s}:{0.port:d}".format(self))
+
+        for res in socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC,
+                                      socket.SOCK_STREAM):
+            af, sock_type, proto, cannon_name, sa = res
+            try:
+                s = socket.socket(af, sock_type, proto)
+            except socket.error as e:
+                error = e
+                continue
+            try:
+                s.settimeout(self.connect_timeout or self.timeout)
+                s.connect(sa)
+                s.settimeout(self.timeout)
+            except socket.error as e:
+                error = e
+                s.close()
+                continue
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket = s
+            self.n_connects += 1
+            log.debug("Connected to {0.host:s}:{0.port:d}".format(self))
+            return
+
+        raise error
+
+    def send(self, command, cancel=None, timeout=None):
+        """
+        Send a command and wait for its reply.
+
+        A command is only sent again on a new socket when the old one was
+        reused and turned out to be dead (e.g. closed by the plugin while
+        idle), and only if it is idempotent (see protocol.is_idempotent):
+        the plugin may have executed it before the socket died, and an
+        exposure must not run twice. A reused socket is therefore checked
+        before a non-idempotent command is written to it, and replaced if
+        the plugin closed it. If a freshly opened socket fails or times out
+        after the command went out, the error is raised as well.
+
+        If a CancelToken is given, the wait for the reply is interrupted
+        within `cancel.interval` seconds of the token being cancelled. The
+        socket is then closed since the late reply would be read as the
+        reply of the next command.
+
+        Parameters
+        ----------
+        command (string or bytes) : a command to be sent via TCP/IP, as text
+            or already encoded by a protocol.Template.
+        cancel (CancelToken) : optional. Interrupts the wait for the reply.
+        timeout (float) : optional. Seconds to wait for the reply instead of
+            the connection timeout.
+
+        Returns
+        -------
+        message (string) : the response from the plugin.
+
+        Raises
+        ------
+        socket.error : if the command could not be delivered.
+        Cancelled : if the token was cancelled before the reply arrived.
+        """
+        data = protocol.encode(command)
+        command = protocol.as_text(command)
+        idempotent = protocol.is_idempotent(command)
+
+        delay = self.retry_delay
+        attempt = 0
+
+        while True:
+
+            if not idempotent:
+                self.close_if_stale()
+
+            reused = self._socket is not None
+            sent = False
+            t_connected = None
+
+            if cancel is not None:
+                cancel.check()
+
+            try:
+                t_start = time.monotonic()
+                if not reused:
+                    self.connect()
+                    t_connected = time.monotonic()
+
+                self._socket.settimeout(
+                    self.timeout if timeout is None else timeout)
+
+                t0 = time.monotonic()
+                self._socket.sendall(data)
+                t_sent = time.monotonic()
+                sent = True
+
+                line, t_first_byte = self._read_line(cancel)
+
+            except (socket.timeout, Cancelled, protocol.ProtocolError):
+                self.close()
+                raise
+
+            except socket.error as error:
+                self.close()
+                attempt += 1
+
+                if sent and not (reused and idempotent) or \
+                        attempt > self.retries:
+                    raise
+
+                log.warning("{:s} - {} (reconnecting, attempt {:d}/{:d})".format(
+                    command, error, attempt, self.retries))
+
+                # A stale socket is replaced right away, a refused
+                # connection is retried with an increasing delay.
+                if not reused:
+                    if cancel is not None:
+                        cancel.sleep(delay)
+                    else:
+                        time.sleep(delay)
+                    delay *= 2
+                continue
+
+            t_done = time.monotonic()
+            message = line.decode().strip()
+
+            latency = t_done - t0
+            self.last_latency = latency
+            self.history.append((command, latency))
+
+            if self.recorder is not None:
+                self.recorder.add_command(command, t_start, t_connected,
+                                          t_sent, t_first_byte, t_done,
+                                          message)
+
+            return message
+
+    def send_many(self, commands, cancel=None, timeout=None):
+        """
+        Pipeline several commands: write all of them at once and then read
+        all the replies, in order, in a single pass. Nothing is retried,
+        since it is unknown which commands the plugin executed, but a socket
+        the plugin closed while idle is replaced before the write.
+
+        Parameters
+        ----------
+        commands (list) : the commands, as text or encoded bytes.
+        cancel (CancelToken) : optional. Interrupts the wait for the replies.
+        timeout (float) : optional. Seconds to wait for each reply instead of
+            the connection timeout.
+
+        Returns
+        -------
+        messages (list) : the response to each command.
+
+        Raises
+        ------
+        socket.error : if the commands could not be delivered or a reply
+            did not arrive in time. The socket is closed.
+        Cancelled : if the token was cancelled before every reply arrived.
+        """
+        if not commands:
+            return []
+
+        data = b"".join(protocol.encode(c) for c in commands)
+        commands = [protocol.as_text(c) for c in commands]
+        messages = []
+
+        if cancel is not None:
+            cancel.check()
+
+        try:
+            t_start = time.monotonic()
+            t_connected = None
+            self.close_if_stale()
+            if self._socket is None:
+                self.connect()
+                t_connected = time.monotonic()
+
+            if timeout is not None:
+                self._socket.settimeout(timeout)
+
+            self._socket.sendall(data)
+            t_sent = time.monotonic()
+
+            for command in commands:
+                line, t_first_byte = self._read_line(cancel)
+                t_done = time.monotonic()
+                message = line.decode().strip()
+                messages.append(message)
+
+                if self.recorder is not None:
+                    self.recorder.add_command(command, t_start, t_connected,
+                                              t_sent, t_first_byte, t_done,
+                                              message)
+
+            if timeout is not None and self._socket is not None:
+                self._socket.settimeout(self.timeout)
+
+        except (socket.error, Cancelled):
+            self.close()
+            raise
+
+        self.last_latency = t_done - t_sent
+        self.history.extend((c, self.last_latency) for c in commands)
+
+        return messages
+
+    def _read_line(self, cancel=None):
+        """
+        Read one reply line, however it was split or coalesced in the
+        stream. Any following reply stays buffered for the next command. If
+        the plugin closes the connection after an unterminated reply, that
+        reply is returned and the next command opens a new socket.
+
+        Returns
+        -------
+        line (bytes) : the reply without its terminator.
+        t_first_byte (float) : when the first byte of the reply arrived.
+        """
+        t_first_byte = None
+
+        while True:
+            line = self._buffer.next_line()
+            if line is not None:
+                return line, t_first_byte or time.monotonic()
+            if self._socket is None:
+                raise socket.error("Connection closed by the plugin.")
+
+            chunk = self._recv(cancel)
+            if not chunk:
+                # A reply without terminator is complete once the plugin
+                # closes the connection after it
+                line = self._buffer.flush()
+                self.close()
+                if not line:
+                    raise socket.error("Connection closed by the plugin.")
+                return line, t_first_byte or time.monotonic()
+            if t_first_byte is None:
+                t_first_byte = time.monotonic()
+            self._buffer.feed(chunk)
+
+    def _recv(self, cancel=None):
+        """
+        Read the reply, polling the token while waiting for it.
+        """
+        if cancel is None:
+            return self._socket.recv(4096)
+
+        timeout = self._socket.gettimeout()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not select.select([self._socket], [], [], cancel.interval)[0]:
+            cancel.check()
+            if deadline is not None and time.monotonic() > deadline:
+                raise socket.timeout("timed out")
+
+        return self._socket.recv(4096)
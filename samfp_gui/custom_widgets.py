@@ -22,6 +22,24 @@ class ComboBox(QtWidgets.QWidget):
                 self.combo_box.setCurrentIndex(idx)
 
 
+class CheckBox(QtWidgets.QWidget):
+
+    def __init__(self, label, state=False):
+
+        super(CheckBox, self).__init__()
+
+        self.check_box = QtWidgets.QCheckBox(label)
+        self.check_box.setChecked(state)
+
+    def __call__(self, x=None):
+
+        if x is None:
+            return self.check_box.isChecked()
+
+        else:
+            self.check_box.setChecked(bool(x))
+
+
 class TextTField(QtWidgets.QWidget):
 
     def __init__(self, label, value):
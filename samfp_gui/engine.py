@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""
+    Scan engine: executes a ScanPlan by sending commands to the SAM-FP plugin.
+"""
+
+from __future__ import print_function, division
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import protocol, scan
+from .cancel import Cancelled, CancelToken
+from .instrument import Recorder
+from .settle import SettleModel, wait_until_stable
+
+log = logging.getLogger("samfp.engine")
+
+
+class BaseEngine(object):
+
+    def __init__(self, plan, exptime, nframes=1, settle=0.1,
+                 poll_status=False, pipelined=False, readout_time=None,
+                 shutter_margin=0.5, journal=None, recorder=None,
+                 clock=time.monotonic):
+        """
+        What ScanEngine and aioclient.AsyncScanRunner share: the channels
+        left to expose, the header keywords of each channel, the settle time
+        of each move and the journal and timing records. The subclasses only
+        send the commands and wait, on a thread or on an asyncio loop.
+
+        See ScanEngine for the parameters.
+        """
+        self.plan = plan
+        self.exptime = exptime
+        self.nframes = nframes
+        if not isinstance(settle, SettleModel):
+            settle = SettleModel(base=settle, per_bcv=0, maximum=settle)
+        self.settle = settle
+        self.poll_status = poll_status
+        self.pipelined = pipelined
+        self.readout_time = readout_time
+        self.shutter_margin = shutter_margin
+        self.journal = journal
+        if recorder is None:
+            recorder = scan.get_recorder() or Recorder()
+        self.recorder = recorder
+        self.clock = clock
+        self.abort_latency = None
+
+        self.on_step = None
+        self.on_final_readout = None
+        self._stop_requested = False
+        self._z = None
+        self._sweep = None
+        self._started = {}
+        self._exposing = False
+        self._exposure_time = None
+        self._prepared = None
+        self._n_done = 0
+
+        if pipelined and nframes > 1 and readout_time is None:
+            log.warning("Readout time unknown for {:d} frames per channel. "
+                        "Running the scan serially.".format(nframes))
+            self.pipelined = False
+
+    @property
+    def shutter_time(self):
+        """Seconds from the expose command until the shutter closes."""
+        readout = self.readout_time or 0
+        return self.nframes * self.exptime + (self.nframes - 1) * readout
+
+    def stop(self):
+        """Stop the scan once the current channel is finished."""
+        self._stop_requested = True
+
+    def rows(self):
+        """The (sweep, channel, z) rows not in the journal yet."""
+        done = self.journal.completed() if self.journal is not None else set()
+        return [r for r in self.plan if (r[0], r[1]) not in done]
+
+    def _remaining_rows(self):
+        """
+        Returns
+        -------
+        rows (list) : the rows left to expose.
+        n_done (int) : the number of channels already in the journal.
+        """
+        rows = self.rows()
+        n_done = len(self.plan) - len(rows)
+        if n_done:
+            log.info("Resuming {:d} of {:d} channels.".format(
+                len(rows), len(self.plan)))
+        self._n_done = n_done
+        return rows, n_done
+
+    def _take_prepared(self, sweep, channel, z):
+        """
+        Returns
+        -------
+        settled (float) : when the FP settled at this channel if
+            `setup_first` moved it there, or None.
+        """
+        prepared, self._prepared = self._prepared, None
+        if prepared is not None and prepared[0] == (sweep, channel, z):
+            return prepared[1]
+        return None
+
+    def _start_channel(self, sweep, channel, z):
+        self._started[(sweep, channel)] = self.clock()
+        if channel == 1:
+            log.info("Moving FP to the initial Z = {:d}".format(z))
+
+    def _moved(self, z):
+        """
+        Record that the FP reached `z`.
+
+        Returns
+        -------
+        settled (float) : the `clock` value when the FP is expected to have
+            settled.
+        """
+        jump = None if self._z is None else z - self._z
+        self._z = z
+        return self.clock() + self.settle(jump)
+
+    def _header_calls(self, sweep, z):
+        """
+        Returns
+        -------
+        calls (list) : the (name, value) of the scan.set_* functions, or of
+            the AsyncClient coroutines, that write the header keywords of a
+            channel.
+        """
+        calls = []
+        if sweep != self._sweep:
+            calls.append(('set_scan_start', int(self.plan.z[0])))
+            calls.append(('set_scan_current_sweep', sweep))
+        calls.append(('set_scan_current_z', z))
+        self._sweep = sweep
+        return calls
+
+    def _shutter_closed(self, t0):
+        """The `clock` value when the FP can move after an exposure."""
+        return t0 + self.shutter_time + self.shutter_margin
+
+    def _step_done(self, message, step, sweep, channel, z):
+        """
+        Record a finished exposure.
+
+        Returns
+        -------
+        ok (bool) : False if the exposure failed and the scan was stopped.
+        """
+        self.recorder.add_channel(sweep, channel, z,
+                                  self._started.pop((sweep, channel)),
+                                  self.clock())
+
+        if not protocol.is_done(message):
+            log.error("Exposure failed at sweep {:d}, channel {:d}: {:s}. "
+                      "Stopping the scan.".format(sweep, channel, message))
+            self.stop()
+            return False
+
+        log.debug("Sweep {:d}, channel {:d}, Z {:d} done.".format(
+            sweep, channel, z))
+        self._n_done = step
+        if self.journal is not None:
+            # The exposure time includes the readout, for the estimator
+            self.journal.write_step(sweep, channel, z,
+                                    exposure=round(self._exposure_time, 3))
+        if self.on_step is not None:
+            self.on_step(step, sweep, channel, z)
+
+        return True
+
+    def _write_end(self, status):
+        if self.journal is not None:
+            self.journal.write_end(status, abort_latency=self.abort_latency)
+
+
+class ScanEngine(BaseEngine):
+
+    def __init__(self, plan, exptime, nframes=1, settle=0.1,
+                 poll_status=False, pipelined=False, readout_time=None,
+                 shutter_margin=0.5, journal=None, recorder=None,
+                 cancel=None, clock=time.monotonic, sleep=None):
+        """
+        Execute a scan plan. The header keywords that do not change along the
+        scan (basename, exposure time, etc.) have to be set before.
+
+        In the serial mode every channel runs fp_moveabs, set_scan_current_z,
+        waits for the FP to settle and exposes, one after the other. In the
+        pipelined mode the FP moves to the next channel while the current
+        one is being read out: the move is sent as soon as the shutter is
+        expected to be closed, and the next exposure only starts after the
+        current exposure returned, the FP move was acknowledged and the FP
+        settled. The header keywords of the next channel are only written
+        once the current exposure returned, since the DHE may write the
+        headers of a frame at the end of its readout.
+
+        The settle time depends on the size of the FP jump through a
+        SettleModel, so small steps wait little and flybacks at the start of
+        each sweep wait longer. If `poll_status` is True, the FP status is
+        also polled after the modeled delay until the FP reports it is
+        stable, for at most `settle.maximum` seconds.
+
+        If a ScanJournal is given, every exposed channel is recorded in it and
+        the channels it already holds are skipped, so an interrupted scan
+        continues from the first missing channel.
+
+        The timing of every command and of every channel is kept in
+        `recorder` so it can be exported once the scan is over.
+
+        In the pipelined mode, `on_final_readout` is called, if set, once the
+        shutter of the last channel closed, while it is read out. That is
+        where an observation queue sets up the next scan, e.g. with its
+        `setup_first`, so the FP is in place when this scan ends.
+
+        `stop` lets the current channel finish. `abort` cancels the token
+        shared by every sleep and every command of the scan, so the engine
+        returns within `cancel.interval` seconds plus one round trip, and
+        asks the DHE to abort the exposure in progress.
+
+        Parameters
+        ----------
+        plan (ScanPlan) : the positions to visit.
+        exptime (float) : exposure time per frame in seconds.
+        nframes (int) : number of frames per channel.
+        settle (SettleModel or float) : settle time model, or a fixed settle
+            time in seconds.
+        poll_status (bool) : poll the FP status after each move until stable.
+        pipelined (bool) : overlap the setup of the next channel with the
+            readout of the current one.
+        readout_time (float) : readout time per frame in seconds. Only needed
+            by the pipelined mode when `nframes` > 1, to know when the
+            shutter closes for the last time.
+        shutter_margin (float) : extra seconds to wait after the shutter is
+            expected to be closed before moving the FP.
+        journal (ScanJournal) : optional. Where the progress is recorded.
+        recorder (instrument.Recorder) : optional. Where the timings are
+            recorded. Defaults to the one installed with
+            `scan.set_recorder`, or a new one.
+        cancel (CancelToken) : optional. Cancelling it aborts the scan.
+        clock (callable) : function that returns the current time.
+        sleep (callable) : optional. Function used to wait, with `clock`,
+            e.g. those of a simulation.VirtualClock. Defaults to the sleep
+            of the cancellation token.
+        """
+        super(ScanEngine, self).__init__(
+            plan, exptime, nframes, settle, poll_status, pipelined,
+            readout_time, shutter_margin, journal, recorder, clock)
+        self.cancel = cancel if cancel is not None else CancelToken()
+        self._sleep = sleep
+        self._is_running = False
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    def run(self):
+        """
+        Run the whole plan, or until `stop` is called.
+
+        Returns
+        -------
+        n_steps (int) : the number of channels exposed, including the ones
+            already in the journal.
+        """
+        rows, n_done = self._remaining_rows()
+
+        self._is_running = True
+        previous_recorder = scan.set_recorder(self.recorder)
+        previous_cancel = scan.set_cancel_token(self.cancel)
+        status = 'failed'
+        try:
+            if self.pipelined:
+                n = self._run_pipelined(rows, n_done)
+            else:
+                n = self._run_serial(rows, n_done)
+            status = 'done' if n == len(self.plan) else 'aborted'
+        except Cancelled:
+            n = self._n_done
+            status = 'aborted'
+        finally:
+            self._is_running = False
+            scan.set_recorder(previous_recorder)
+            scan.set_cancel_token(previous_cancel)
+
+            if self.cancel.is_cancelled:
+                if self._exposing:
+                    scan.abort_exposure()
+                self.abort_latency = self.cancel.latency
+                log.info("Scan aborted in {:.3f} s.".format(
+                    self.abort_latency))
+
+            self._write_end(status)
+
+        return n
+
+    def abort(self):
+        """
+        Interrupt the scan as soon as possible, including the exposure in
+        progress. Never blocks.
+        """
+        self._stop_requested = True
+        self.cancel.cancel()
+
+    def sleep(self, seconds):
+        """
+        Wait unless the scan is aborted.
+
+        Raises
+        ------
+        Cancelled : if the scan was aborted before or while waiting.
+        """
+        if self._sleep is None:
+            self.cancel.sleep(seconds)
+            return
+        self.cancel.check()
+        self._sleep(max(seconds, 0))
+        self.cancel.check()
+
+    def setup_first(self):
+        """
+        Move the FP to the first channel left to expose ahead of `run`, e.g.
+        while the previous scan is read out. `run` then writes its header
+        keywords and starts with its exposure, once the FP settled.
+        """
+        rows = self.rows()
+        if rows:
+            self._prepared = rows[0], self.setup_channel(*rows[0],
+                                                         headers=False)
+
+    def _setup(self, sweep, channel, z):
+        # The FP may have been moved to the first channel by setup_first
+        settled = self._take_prepared(sweep, channel, z)
+        if settled is not None:
+            self.write_headers(sweep, channel, z)
+            return settled
+        return self.setup_channel(sweep, channel, z)
+
+    def setup_channel(self, sweep, channel, z, headers=True):
+        """
+        Move the FP and write the header keywords of one channel.
+
+        Parameters
+        ----------
+        sweep, channel, z : a row of the plan.
+        headers (bool) : if False, only move the FP. `write_headers` has to
+            be called before the exposure.
+
+        Returns
+        -------
+        settled (float) : the `clock` value when the FP is expected to have
+            settled.
+        """
+        self._start_channel(sweep, channel, z)
+
+        # Large jumps go through intermediate positions first
+        for z_sub in self.plan.substeps(sweep, channel):
+            scan.fp_moveabs(z_sub, cancel=self.cancel)
+            self.sleep(self.plan.jump_pause)
+            self._z = z_sub
+
+        # The move and the header keywords go out at the same time, over
+        # separate connections, and are both answered when the block ends
+        with scan.batch(cancel=self.cancel):
+            scan.fp_moveabs(z)
+            if headers:
+                self._queue_headers(sweep, z)
+
+        return self._moved(z)
+
+    def write_headers(self, sweep, channel, z):
+        """Write the header keywords of one channel."""
+        with scan.batch(cancel=self.cancel):
+            self._queue_headers(sweep, z)
+
+    def _queue_headers(self, sweep, z):
+        for name, value in self._header_calls(sweep, z):
+            getattr(scan, name)(value)
+
+    def wait_settled(self, settled):
+        """Block until the FP settled after the last move."""
+        self.sleep(settled - self.clock())
+        if self.poll_status:
+            wait_until_stable(self.settle.maximum, cancel=self.cancel)
+
+    def _expose(self):
+        self._exposing = True
+        t0 = self.clock()
+        message = scan.expose(cancel=self.cancel)
+        self._exposure_time = self.clock() - t0
+        self._exposing = False
+        return message
+
+    def _run_serial(self, rows, step):
+
+        for sweep, channel, z in rows:
+
+            if self._stop_requested:
+                break
+
+            settled = self._setup(sweep, channel, z)
+            self.wait_settled(settled)
+            message = self._expose()
+
+            if self._step_done(message, step + 1, sweep, channel, z):
+                step += 1
+
+        return step
+
+    def _run_pipelined(self, rows, step):
+
+        if not rows:
+            return step
+
+        # Exposures run on their own thread and thus on their own socket
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        try:
+            settled = self._setup(*rows[0])
+            headers = None
+
+            for i, (sweep, channel, z) in enumerate(rows):
+
+                if self._stop_requested:
+                    break
+
+                # Only now that the previous frame was read out
+                if headers is not None:
+                    self.write_headers(*headers)
+                    headers = None
+
+                # Interlock: never open the shutter before the FP settled
+                self.wait_settled(settled)
+
+                t0 = self.clock()
+                exposure = pool.submit(self._expose)
+
+                last = i + 1 == len(rows)
+                if not last or self.on_final_readout is not None:
+                    # Wait for the shutter to close and move the FP to the
+                    # next channel while the current one is being read out
+                    shutter_closed = self._shutter_closed(t0)
+                    if self._sleep is None:
+                        wait([exposure], timeout=max(
+                            0, shutter_closed - self.clock()))
+                    else:
+                        # The exposure only advances a virtual clock while
+                        # this thread waits on it as well
+                        self.sleep(shutter_closed - self.clock())
+
+                    if not self._stop_requested and last:
+                        self.on_final_readout()
+                    elif not self._stop_requested:
+                        headers = rows[i + 1]
+                        settled = self.setup_channel(*headers, headers=False)
+
+                message = exposure.result()
+
+                if self._step_done(message, step + 1, sweep, channel, z):
+                    step += 1
+
+        finally:
+            pool.submit(scan.close_connection).result()
+            pool.shutdown()
+
+        return step
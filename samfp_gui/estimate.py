@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+    Scan duration estimator: how long a plan takes at the telescope and which
+    fraction of it is spent with the shutter open, from an overhead model
+    fitted to the journals of previous scans.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+
+from .journal import JOURNAL_DIR, ScanJournal
+from .sequence import JUMP_PAUSE
+
+log = logging.getLogger("samfp.estimate")
+
+OVERHEAD_FILE = os.path.join(os.path.expanduser("~"), '.samfp_overhead.json')
+
+# Seconds per frame, as assumed by fp_sami, until a readout is measured
+READOUT_TIME = 3.
+
+# Seconds the engine waits after the shutter closed before moving the FP
+SHUTTER_MARGIN = 0.5
+
+Estimate = collections.namedtuple(
+    'Estimate',
+    ['duration', 'exposure', 'overhead', 'efficiency', 'uncertainty'])
+"""
+Predicted times of a scan in seconds. `exposure` is the time with the
+shutter open, `overhead` everything else and `efficiency` the fraction of
+`duration` spent exposing. `uncertainty` is the expected error of
+`duration` from the scatter of the fitted channels, or 0 for the default
+model.
+"""
+
+
+class OverheadModel(object):
+
+    def __init__(self, base=0.3, per_bcv=0.002, first=2.5, move=0.05,
+                 readout=None, scatter=0., n_samples=0):
+        """
+        The time a channel takes besides the exposure itself. Every frame is
+        read out in `readout[binning]` seconds. Setting up a channel, i.e.
+        moving the FP by `jump` BCV, writing its header keywords and waiting
+        for the FP to settle, takes `base + per_bcv * |jump|` seconds, or
+        `first` seconds when the FP position is unknown. Each intermediate
+        move adds `move` seconds to the pause of the plan.
+
+        Parameters
+        ----------
+        base (float) : setup time of a null move in seconds.
+        per_bcv (float) : extra setup time per BCV in seconds.
+        first (float) : setup time of the first channel of a scan.
+        move (float) : time of an intermediate move besides its pause.
+        readout (dict) : seconds per frame for each binning. Binnings that
+            were never measured use READOUT_TIME.
+        scatter (float) : standard deviation of the measured channel times
+            around the model in seconds.
+        n_samples (int) : number of channels the model was fitted to.
+        """
+        self.base = base
+        self.per_bcv = per_bcv
+        self.first = first
+        self.move = move
+        self.readout = dict((int(b), float(r))
+                            for b, r in (readout or {}).items())
+        self.scatter = scatter
+        self.n_samples = n_samples
+
+    def __repr__(self):
+        return "OverheadModel(base={0.base:g}, per_bcv={0.per_bcv:g}, " \
+               "first={0.first:g}, move={0.move:g}, readout={0.readout}, " \
+               "n_samples={0.n_samples:d})".format(self)
+
+    def readout_time(self, binning):
+        """Seconds to read out a frame with the given binning."""
+        return self.readout.get(int(binning), READOUT_TIME)
+
+    def setup(self, jump, n_substeps=0, jump_pause=JUMP_PAUSE):
+        """
+        Parameters
+        ----------
+        jump (float or array) : the size of the FP move(s) in BCV, NaN when
+            the FP position is unknown.
+        n_substeps (int or array) : the intermediate moves of each channel.
+        jump_pause (float) : the pause after every intermediate move.
+
+        Returns
+        -------
+        setup (float or array) : the setup time of the channel(s) in seconds.
+        """
+        jump = np.abs(np.asarray(jump, dtype=float))
+        with np.errstate(invalid='ignore'):
+            setup = np.where(np.isnan(jump), self.first,
+                             self.base + self.per_bcv * jump)
+        return setup + np.asarray(n_substeps) * (jump_pause + self.move)
+
+    @classmethod
+    def fit(cls, journals):
+        """
+        Fit the model to the channels recorded in scan journals. The readout
+        comes from the exposure time of every channel; the setup terms from
+        the time between two channels of the scans run serially, where the
+        setup is not hidden by the readout.
+
+        Parameters
+        ----------
+        journals (list) : ScanJournal objects.
+
+        Returns
+        -------
+        model (OverheadModel)
+
+        Raises
+        ------
+        ValueError : if the journals hold no exposure time.
+        """
+        readouts = collections.defaultdict(list)
+        rows, times, firsts = [], [], []
+
+        for channel in _channels(journals):
+            readouts[channel['binning']].append(
+                (channel['exposure'] - channel['shutter']) /
+                channel['nframes'])
+            if channel['pipelined'] or channel['period'] is None:
+                continue
+            setup = channel['period'] - channel['exposure'] - \
+                channel['n_substeps'] * channel['jump_pause']
+            if channel['jump'] is None:
+                firsts.append(setup)
+            else:
+                rows.append([1., abs(channel['jump']),
+                             channel['n_substeps']])
+                times.append(setup)
+
+        if not readouts:
+            raise ValueError("No channel with a measured exposure time.")
+
+        model = cls(readout=dict((b, max(float(np.median(r)), 0.))
+                                 for b, r in readouts.items()))
+        if firsts:
+            model.first = max(float(np.median(firsts)), 0.)
+
+        if rows:
+            rows, times = np.array(rows), np.array(times)
+            # Only fit the terms the data can tell apart
+            columns = [0] + [i for i in (1, 2)
+                             if np.unique(rows[:, i]).size > 1]
+            coefficients = np.linalg.lstsq(rows[:, columns], times,
+                                           rcond=None)[0]
+            for i, c in zip(columns, coefficients):
+                setattr(model, ['base', 'per_bcv', 'move'][i],
+                        max(float(c), 0.))
+
+            predicted = model.base + model.per_bcv * rows[:, 1] + \
+                model.move * rows[:, 2]
+            model.scatter = float(np.std(times - predicted))
+            model.n_samples = len(times)
+
+        return model
+
+    @classmethod
+    def load(cls, filename=OVERHEAD_FILE):
+        """Read a model saved with `save`, or the default one if missing."""
+        if not os.path.exists(filename):
+            return cls()
+        with open(filename) as f:
+            return cls(**json.load(f))
+
+    def save(self, filename=OVERHEAD_FILE):
+        with open(filename, 'w') as f:
+            json.dump(dict(base=self.base, per_bcv=self.per_bcv,
+                           first=self.first, move=self.move,
+                           readout=self.readout, scatter=self.scatter,
+                           n_samples=self.n_samples), f, indent=2)
+        log.debug("Saved overhead model to {:s}".format(filename))
+
+
+def _channels(journals):
+    """
+    Yield every exposed channel of the journals with its exposure settings,
+    the FP jump that led to it (None if unknown) and the time since the
+    previous channel (None after the scan was resumed).
+    """
+    for journal in journals:
+        entries = journal.entries
+        if not entries:
+            continue
+        try:
+            plan = journal.plan()
+        except (KeyError, ValueError):
+            continue
+
+        start = entries[0]
+        settings = dict(((prefix, key), value)
+                        for prefix, key, value in start.get('settings', []))
+        binning = int(settings.get(('dhe set', 'binning'), '4').split()[0])
+        n_substeps = np.bincount(plan.moves['step'][~plan.moves['final']],
+                                 minlength=len(plan))
+        index = dict(((sweep, channel), i)
+                     for i, (sweep, channel, z) in enumerate(plan))
+
+        previous, z = start, None
+        for entry in entries[1:]:
+            if entry['type'] != 'step':
+                previous = entry
+                continue
+            i = index.get((entry['sweep'], entry['channel']))
+            if 'exposure' not in entry or i is None:
+                previous, z = entry, entry['z']
+                continue
+
+            yield dict(binning=binning, nframes=start['nframes'],
+                       shutter=start['nframes'] * start['exptime'],
+                       exposure=entry['exposure'],
+                       pipelined=start.get('pipelined', False),
+                       jump=None if z is None else entry['z'] - z,
+                       n_substeps=int(n_substeps[i]),
+                       jump_pause=plan.jump_pause,
+                       period=None if previous['type'] == 'end'
+                       else entry['time'] - previous['time'])
+            previous, z = entry, entry['z']
+
+
+def estimate(plan, exptime, nframes=1, binning=4, pipelined=False,
+             model=None, shutter_margin=SHUTTER_MARGIN):
+    """
+    Predict how long a scan takes, following the serial or pipelined
+    sequence of the ScanEngine.
+
+    Parameters
+    ----------
+    plan (ScanPlan) : the positions to visit.
+    exptime (float) : exposure time per frame in seconds.
+    nframes (int) : number of frames per channel.
+    binning (int) : the bin size.
+    pipelined (bool) : the next channel is set up during the readout.
+    model (OverheadModel) : optional. Defaults to the saved model.
+    shutter_margin (float) : as given to the ScanEngine.
+
+    Returns
+    -------
+    estimate (Estimate)
+    """
+    if model is None:
+        model = OverheadModel.load()
+
+    n = len(plan)
+    z = plan.table['z'].astype(float)
+    jumps = np.concatenate([[np.nan], np.diff(z)])
+    n_substeps = np.bincount(plan.moves['step'][~plan.moves['final']],
+                             minlength=n)
+    setup = model.setup(jumps, n_substeps, plan.jump_pause)
+
+    readout = model.readout_time(binning)
+    shutter = nframes * exptime + (nframes - 1) * readout
+    exposure = shutter + readout
+
+    if pipelined and n > 1:
+        # The next exposure waits for this one and for the next setup,
+        # which starts once the shutter closed or the exposure is over
+        periods = np.maximum(
+            exposure, min(exposure, shutter + shutter_margin) + setup[1:])
+        duration = setup[0] + periods.sum() + exposure
+    else:
+        duration = setup.sum() + n * exposure
+
+    open_time = n * nframes * exptime
+    return Estimate(duration=float(duration), exposure=float(open_time),
+                    overhead=float(duration - open_time),
+                    efficiency=float(open_time / duration) if duration else 0.,
+                    uncertainty=float(model.scatter * np.sqrt(n)))
+
+
+def format_duration(seconds):
+    """Seconds as H:MM:SS."""
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Fit the scan overhead model to the journals of previous "
+                    "scans and save it.")
+    parser.add_argument('--journals', default=JOURNAL_DIR,
+                        help="directory of the scan journals")
+    parser.add_argument('-o', '--output', default=OVERHEAD_FILE)
+    args = parser.parse_args()
+
+    journals = ScanJournal.find(args.journals)
+    model = OverheadModel.fit(journals)
+    model.save(args.output)
+    print(model)
+
+    # How well the model predicts the scans it was fitted to
+    print("{:>26s} {:>10s} {:>10s} {:>7s}".format(
+        "scan", "measured", "predicted", "error"))
+    for journal in journals:
+        entries = journal.entries
+        steps = [e for e in entries if e['type'] == 'step']
+        if not journal.is_finished or \
+                any(e['type'] == 'end' for e in entries[:-1]):
+            continue
+        start = entries[0]
+        settings = dict(((prefix, key), value)
+                        for prefix, key, value in start.get('settings', []))
+        predicted = estimate(
+            journal.plan(), start['exptime'], start['nframes'],
+            int(settings.get(('dhe set', 'binning'), '4').split()[0]),
+            start.get('pipelined', False), model).duration
+        measured = steps[-1]['time'] - start['time']
+        print("{:>26s} {:>10s} {:>10s} {:6.1f}%".format(
+            journal.scan_id, format_duration(measured),
+            format_duration(predicted),
+            100 * (predicted - measured) / measured))
+
+
+if __name__ == "__main__":
+    main()
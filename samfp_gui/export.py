@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+    Export a ScanPlan to run outside of the GUI, either as a csh script for
+    the `sami` command line client or as a command stream that a single
+    client process plays over one connection to the SAM-FP plugin.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import logging
+import re
+import time
+
+from . import protocol, scan
+from .cancel import CancelToken
+
+log = logging.getLogger("samfp.export")
+
+# Values per line of the csh data table
+ROW_LENGTH = 16
+
+# A scan ID given when the exported scan runs, not when it is exported, so
+# running it again gets a new FAPERSID. A csh variable in the scripts.
+NEW_SCAN_ID = '$scan_id'
+
+
+def scan_settings(exptime, nframes=1, basename=None, path=None,
+                  binning=None, scan_id=None, title=None, **keywords):
+    """
+    The settings sent before a scan, as the scan module would send them.
+
+    Parameters
+    ----------
+    exptime (float) : exposure time per frame in seconds.
+    nframes (int) : number of frames per channel.
+    basename (string) : optional. The image basename.
+    path (string) : optional. The directory of the images.
+    binning (int) : optional. The bin size.
+    scan_id (string) : optional. The FAPERSID keyword, or NEW_SCAN_ID for
+        a new one every time the scan runs.
+    title (string) : optional. The target name, with its spaces replaced
+        as `scan.set_target_name` does.
+    keywords : any other `dhe set` key and value, e.g. image.comment.
+
+    Returns
+    -------
+    settings (list) : (prefix, key, value) tuples.
+    """
+    items = []
+    if scan_id is not None:
+        items.append(('dhe dbs set', 'FAPERSID', scan_id))
+    if binning is not None:
+        items.append(('dhe set', 'binning', '{0:d} {0:d}'.format(binning)))
+    items.append(('dhe set', 'obs.nimages', '{:d}'.format(nframes)))
+    items.append(('dhe set', 'obs.exptime', '{:f}'.format(exptime)))
+    if basename is not None:
+        items.append(('dhe set', 'image.basename', basename))
+    if path is not None:
+        items.append(('dhe set', 'image.dir', path))
+    if title is not None:
+        keywords['image.title'] = scan.header_title(title)
+    for key, value in sorted(keywords.items()):
+        items.append(('dhe set', key, str(value)))
+    return items
+
+
+def commands(plan, settle=0.):
+    """
+    The command stream of a scan: the moves, the header keywords and the
+    exposures of every channel, with `sleep` pauses after the intermediate
+    moves and, if `settle` is given, before every exposure.
+
+    Parameters
+    ----------
+    plan (ScanPlan) : the positions to visit.
+    settle (float) : seconds to wait for the FP to settle before exposing.
+
+    Returns
+    -------
+    commands (list) : one command per item, without terminator.
+    """
+    lines = []
+    z_start = protocol.as_text(
+        protocol.DBS_SET('FPZINIT', '{:f}'.format(float(plan.z[0]))))
+    current_sweep = None
+
+    for move in plan.moves.tolist():
+        step, z, final = move
+        lines.append(protocol.as_text(protocol.FP_MOVEABS(z)))
+        if not final:
+            lines.append("sleep {:g}".format(plan.jump_pause))
+            continue
+
+        sweep = int(plan.table['sweep'][step])
+        if sweep != current_sweep:
+            lines.append(z_start)
+            lines.append(protocol.as_text(
+                protocol.DBS_SET('FAPERSWP', '{:d}'.format(sweep))))
+            current_sweep = sweep
+        lines.append(protocol.as_text(
+            protocol.DBS_SET('FAPERSST', '{:d}'.format(z))))
+        if settle > 0:
+            lines.append("sleep {:g}".format(settle))
+        lines.append(protocol.as_text(protocol.EXPOSE))
+
+    return lines
+
+
+def write_stream(plan, filename, settings=(), settle=0.):
+    """
+    Write a command stream: the settings followed by every command of the
+    scan, one per line, to be played by `play` over one connection.
+
+    Parameters
+    ----------
+    plan (ScanPlan) : the positions to visit.
+    filename (string) : where to write the stream.
+    settings (list) : (prefix, key, value) tuples, e.g. from `scan_settings`.
+    settle (float) : seconds to wait for the FP to settle before exposing.
+    """
+    with open(filename, 'w') as f:
+        f.write("# {!r}\n".format(plan))
+        for prefix, key, value in settings:
+            f.write(protocol.as_text(
+                protocol.SETTINGS[prefix](key, value)) + "\n")
+        for line in commands(plan, settle):
+            f.write(line + "\n")
+
+    log.info("Wrote {:d} moves and {:d} exposures to {:s}".format(
+        plan.n_moves, plan.n_steps, filename))
+
+
+def _csh_value(value):
+    if '\n' in value or '\r' in value:
+        raise ValueError(
+            "A setting cannot span several lines. Got {!r}.".format(value))
+    # Words are passed as separate arguments, as in `binning 4 4`
+    if value == NEW_SCAN_ID or value and re.match(r'^[\w .,:/+-]*$', value):
+        return value
+    # Quotes end the quoted word, and ! is expanded even inside one
+    return "'{:s}'".format(value.replace("'", "'\\''").replace("!", "\\!"))
+
+
+def _csh_array(name, values):
+    rows = [" ".join(str(v) for v in values[i:i + ROW_LENGTH])
+            for i in range(0, len(values), ROW_LENGTH)]
+    return "set {:s} = ( \\\n    {:s} )\n".format(
+        name, " \\\n    ".join(rows))
+
+
+def write_csh(plan, filename, settings=(), settle=0.):
+    """
+    Write a csh script that runs the scan with the `sami` client. The moves
+    are a data table, one column per move, walked by a single loop, so the
+    script has the same size whatever the number of channels.
+
+    Parameters
+    ----------
+    plan (ScanPlan) : the positions to visit.
+    filename (string) : where to write the script.
+    settings (list) : (prefix, key, value) tuples, e.g. from `scan_settings`.
+    settle (float) : seconds to wait for the FP to settle before exposing.
+
+    Raises
+    ------
+    ValueError : if a setting spans several lines.
+    """
+    moves = plan.moves
+    sweeps = plan.table['sweep'][moves['step']] * moves['final']
+    # Before the file is created, since a setting may not be valid
+    lines = ["sami {:s} {:s} {:s}\n".format(prefix, key, _csh_value(value))
+                for prefix, key, value in settings]
+
+    with open(filename, 'w') as f:
+        f.write("#!/bin/csh -f\n\n")
+        f.write("# {!r}\n".format(plan))
+        f.write("# {:d} channels, {:d} moves\n\n".format(
+            plan.n_steps, plan.n_moves))
+
+        if any(value == NEW_SCAN_ID for _, _, value in settings):
+            f.write("set scan_id = "
+                    "SCAN_`date -u +%Y%m%d_UTC%H%M%S`\n")
+        f.writelines(lines)
+        f.write("\n")
+
+        f.write("# For every move, the BCV position and the sweep exposed "
+                "there, or 0 for\n# an intermediate move\n")
+        f.write(_csh_array('zs', moves['z'].tolist()))
+        f.write(_csh_array('sweeps', sweeps.tolist()))
+        f.write("\nset sweep = 0\n")
+        f.write("@ i = 1\n")
+        f.write("while ($i <= $#zs)\n")
+        f.write("    sami FP moveabs $zs[$i]\n")
+        f.write("    if ($sweeps[$i] == 0) then\n")
+        f.write("        sleep {:g}\n".format(plan.jump_pause))
+        f.write("    else\n")
+        f.write("        if ($sweeps[$i] != $sweep) then\n")
+        f.write("            set sweep = $sweeps[$i]\n")
+        f.write("            sami dhe dbs set FPZINIT {:f}\n".format(
+            float(plan.z[0])))
+        f.write("            sami dhe dbs set FAPERSWP $sweep\n")
+        f.write("        endif\n")
+        f.write("        sami dhe dbs set FAPERSST $zs[$i]\n")
+        if settle > 0:
+            f.write("        sleep {:g}\n".format(settle))
+        f.write("        echo \"sweep $sweep, Z $zs[$i]\"\n")
+        f.write("        sami dhe expose\n")
+        f.write("    endif\n")
+        f.write("    @ i++\n")
+        f.write("end\n")
+
+    log.info("Wrote {:d} moves and {:d} exposures to {:s}".format(
+        plan.n_moves, plan.n_steps, filename))
+
+
+def play(filename, cancel=None):
+    """
+    Send every command of a stream written by `write_stream`, in order, over
+    the connection of the current thread. Lines starting with # are
+    comments and `sleep` lines pause locally. NEW_SCAN_ID is replaced by a
+    new scan ID, the same for the whole stream.
+
+    Parameters
+    ----------
+    filename (string) : the command stream.
+    cancel (CancelToken) : optional. Cancelling it stops the stream.
+
+    Returns
+    -------
+    n (int) : the number of commands sent.
+
+    Raises
+    ------
+    IOError : if a command is answered with an error.
+    """
+    cancel = cancel if cancel is not None else CancelToken()
+    scan_id = None
+    n = 0
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            words = line.split()
+            if words[0] == 'sleep':
+                cancel.sleep(float(words[1]))
+                continue
+
+            if NEW_SCAN_ID in line:
+                scan_id = scan_id or scan.make_scan_id()
+                line = line.replace(NEW_SCAN_ID, scan_id)
+
+            message = scan.send_command(line, cancel=cancel)
+            n += 1
+            if protocol.is_error(message):
+                raise IOError("{:s} failed: {:s}".format(line, message))
+
+    return n
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Play a SAM-FP command stream over one connection.")
+    parser.add_argument('filename')
+    parser.add_argument('--host', default=scan.HOST)
+    parser.add_argument('--port', type=int, default=scan.PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    scan.HOST, scan.PORT = args.host, args.port
+
+    t0 = time.monotonic()
+    try:
+        n = play(args.filename)
+    except KeyboardInterrupt:
+        scan.abort_exposure()
+        raise
+    finally:
+        scan.close_connection()
+
+    log.info("Sent {:d} commands in {:.1f} s".format(
+        n, time.monotonic() - t0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    A small dependency graph of derived quantities. Every derived node
+    declares the nodes it is computed from; setting an input only marks
+    what depends on it as stale, and stale nodes are recomputed the next
+    time they are read. Results are kept until an upstream value changes.
+"""
+
+from __future__ import print_function, division
+
+import collections
+import logging
+
+log = logging.getLogger("samfp.graph")
+
+
+class _Node(object):
+
+    __slots__ = ('name', 'function', 'inputs', 'dependents', 'value',
+                 'stale')
+
+    def __init__(self, name, function=None, inputs=()):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.dependents = []
+        self.value = None
+        self.stale = function is not None
+
+
+def _same(a, b):
+    # NaN is the same as NaN, so an invalid value set twice is no change
+    try:
+        return bool(a == b) or (a != a and b != b)
+    except (TypeError, ValueError):
+        return a is b
+
+
+class Graph(object):
+
+    def __init__(self):
+        """
+        Inputs are created with `input` and derived quantities with
+        `derived`. Read any node with `graph[name]` and change inputs with
+        `set` or `update`.
+        """
+        self._nodes = collections.OrderedDict()
+        self.n_evaluations = 0
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def input(self, name, value=None):
+        """Add an input node."""
+        if name in self._nodes:
+            raise ValueError("{:s} is already in the graph.".format(name))
+        node = _Node(name)
+        node.value = value
+        self._nodes[name] = node
+
+    def derived(self, name, inputs, function=None):
+        """
+        Add a node computed as `function(*[graph[i] for i in inputs])`. The
+        inputs have to be in the graph already, so there is no cycle. Also
+        usable as a decorator, with `function` left out.
+
+        Parameters
+        ----------
+        name (string) : the name of the node.
+        inputs (list) : the names of the nodes it is computed from.
+        function (callable) : computes its value.
+        """
+        if function is None:
+            def decorator(f):
+                self.derived(name, inputs, f)
+                return f
+            return decorator
+
+        if name in self._nodes:
+            raise ValueError("{:s} is already in the graph.".format(name))
+        missing = [i for i in inputs if i not in self._nodes]
+        if missing:
+            raise ValueError("Unknown inputs of {:s}: {}".format(
+                name, ", ".join(missing)))
+
+        node = _Node(name, function, inputs)
+        for i in inputs:
+            self._nodes[i].dependents.append(node)
+        self._nodes[name] = node
+
+    def set(self, name, value):
+        """
+        Change an input. Everything downstream becomes stale, unless the
+        value is the same as before.
+
+        Returns
+        -------
+        changed (bool)
+        """
+        node = self._nodes[name]
+        if node.function is not None:
+            raise ValueError("{:s} is derived and cannot be set.".format(name))
+        if _same(node.value, value):
+            return False
+        node.value = value
+        self._invalidate(node)
+        return True
+
+    def update(self, **values):
+        """
+        Change several inputs at once.
+
+        Returns
+        -------
+        changed (list) : the names of the inputs whose value changed.
+        """
+        return [name for name, value in values.items()
+                if self.set(name, value)]
+
+    def get(self, name):
+        """The value of a node, recomputed first if it is stale."""
+        node = self._nodes[name]
+        if node.stale:
+            args = [self.get(i) for i in node.inputs]
+            node.value = node.function(*args)
+            node.stale = False
+            self.n_evaluations += 1
+        return node.value
+
+    def is_stale(self, name):
+        return self._nodes[name].stale
+
+    def _invalidate(self, node):
+        pending = list(node.dependents)
+        while pending:
+            node = pending.pop()
+            if not node.stale:
+                node.stale = True
+                pending.extend(node.dependents)
@@ -2,25 +2,41 @@
 
 from __future__ import absolute_import, print_function, division
 
+import datetime
+import io
 import logging
 import os
 import sys
 import time
 
 import configparser
-import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
+from numpy import isfinite
+from numpy.ma import masked
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 
-from . import scan
-from .custom_widgets import ComboBox, FloatTField, IntTField, TextTField, HLine
+from . import scan, sequence
+from .custom_widgets import CheckBox, ComboBox, FloatTField, IntTField, \
+    TextTField, HLine
+from .cancel import CancelToken
+from .config import ScanConfig
 from .pages import PageScan, PageCalibrationScan, PageScienceScan
+from .model import ParameterModel
+from .plan import ScanPlan
+
+# The scan engines, the journal, the estimator, the queue, asyncio and the
+# simulator are imported by the handlers that use them, so the window shows
+# up before they are loaded
 
 logging.basicConfig()
 log = logging.getLogger("samfp.scan")
 log.setLevel(logging.DEBUG)
 
+# The icons are installed next to this module (see package_data in setup.py)
+ICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icons')
+
 wavelength = {
     'Ha': 6562.78,
     'SIIf': 6716.47,
@@ -31,11 +47,29 @@ wavelength = {
 }
 
 
+def get_icon(name):
+    """
+    Parameters
+    ----------
+    name (string) : the name of the icon, e.g. "save" for save-icon.png.
+
+    Returns
+    -------
+    icon (QtGui.QIcon)
+    """
+    return QtGui.QIcon(os.path.join(ICON_DIR, "{:s}-icon.png".format(name)))
+
+
 class MainWindow(QtWidgets.QMainWindow):
     temp_cfg_file = os.path.join(os.path.expanduser("~"), '.samfp_temp.cfg')
 
     def __init__(self, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
+
+        # Configuration files are written here, off the GUI thread
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="samfp-config")
+
         self.initUI()
 
     def initUI(self):
@@ -43,8 +77,8 @@ class MainWindow(QtWidgets.QMainWindow):
         # Set the font of the ToolTip windows
         QtWidgets.QToolTip.setFont(QtGui.QFont('SansSerif', 10))
 
-        # Run in simulation mode?
-        self._am_i_simulation = True
+        # Run the scans against the simulated instrument?
+        self._am_i_simulation = False
 
         # Create the status bar
         self.status_bar = self.statusBar()
@@ -52,7 +86,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # Create an action to leave the program
         self.load_action = self.get_load_action()
         self.save_action = self.get_save_action()
-        # self.toogle_connect_action = self.get_toogle_connect_action()
+        self.export_timings_action = self.get_export_timings_action()
+        self.export_script_action = self.get_export_script_action()
+        self.toogle_connect_action = self.get_toogle_connect_action()
         self.exit_action = self.get_exit_action()
 
         # Create the menu bar
@@ -60,6 +96,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.menubar._file = self.menubar.addMenu('&File')
         self.menubar._file.addAction(self.load_action)
         self.menubar._file.addAction(self.save_action)
+        self.menubar._file.addAction(self.export_timings_action)
+        self.menubar._file.addAction(self.export_script_action)
         self.menubar._file.addAction(self.exit_action)
 
         # Create the toolbar
@@ -67,24 +105,44 @@ class MainWindow(QtWidgets.QMainWindow):
         self.toolbar.addAction(self.save_action)
         self.toolbar.addAction(self.load_action)
         self.toolbar.addSeparator()
-        # self.toolbar.addAction(self.toogle_connect_action)
-        # self.toolbar.addSeparator()
+        self.toolbar.addAction(self.toogle_connect_action)
+        self.toolbar.addSeparator()
         self.toolbar.addAction(self.exit_action)
 
         # Create the central widget
         central = MyCentralWidget()
         self.setCentralWidget(central)
 
+        # Every parameter of the forms
+        self.model = ParameterModel()
+        self._started = False
+
         # Set the geometry
         self.center()
         self.setWindowTitle('SAM-FP - Data-Acquisition')
         self.setWindowIcon(QtGui.QIcon('web.png'))
 
+        # Display the main window, then build the rest of it
+        self.show()
+        QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """
+        Build the calibration and science pages and load the persistence
+        configuration file. Runs once, right after the window is first
+        shown, or earlier if the configuration is needed before that.
+        """
+        if self._started:
+            return
+        self._started = True
+
+        central = self.centralWidget()
+        central.build_pages()
+        self.model.bind(central)
+
         # Load the persistence configuration file
         self.load_config_file(self.temp_cfg_file)
-
-        # Display the main window
-        self.show()
+        central.on_scan_changed()
 
     def center(self):
 
@@ -106,194 +164,156 @@ class MainWindow(QtWidgets.QMainWindow):
         self.move(qr.topLeft())
 
     def closeEvent(self, event):
+        self._writer.shutdown(wait=True)
         self.save_config_file(self.temp_cfg_file)
+        aio = self.centralWidget().aio
+        if aio is not None:
+            aio.close()
+        scan.close_connection()
+        scan.close_lanes()
         return
 
     def config_parse(self, config_file):
 
-        _cw = self.centralWidget()
+        self.finish_startup()
 
         cfg = configparser.RawConfigParser()
         cfg.read("{:s}".format(config_file))
 
-        _cw.basename(cfg.get('file', 'basename'))
-        _cw.path(cfg.get('file', 'path'))
-
-        _cw.binning(cfg.get('obs', 'binning'))
-        _cw.comment(cfg.get('obs', 'comment'))
-        _cw.exp_time(cfg.getfloat('obs', 'exptime'))
-        _cw.n_frames(cfg.getint('obs', 'nframes'))
-        _cw.obs_type(cfg.get('obs', 'type'))
-        _cw.target_name(cfg.get('obs', 'title'))
-
-        _cw.fp(cfg.get('fp', 'name'))
-        _cw.fp_gap_size(cfg.get('fp', 'gap_size'))
-
-        scan_page = _cw.page_scan
-        scan_page.id(cfg.get('scan', 'id'))
-        scan_page.n_channels(cfg.getint('scan', 'nchannels'))
-        scan_page.n_sweeps(cfg.getint('scan', 'nsweeps'))
-        scan_page.z_start(cfg.getint('scan', 'zstart'))
-        scan_page.z_step(cfg.getint('scan', 'zstep'))
-
-        calib_page = _cw.page_calibration
-        calib_page.n_channels(cfg.getint('calib', 'nchannels'))
-        calib_page.n_sweeps(cfg.getint('calib', 'nsweeps'))
-        calib_page.z_start(cfg.getfloat('calib', 'zstart'))
-        calib_page.z_step(cfg.getfloat('calib', 'zstep'))
-        calib_page.ref_wavelength(cfg.getfloat('calib', 'ref_wav'))
-        calib_page.fsr(cfg.getfloat('calib', 'fsr'))
-        calib_page.fwhm(cfg.getfloat('calib', 'fwhm'))
-        calib_page.finesse(cfg.getfloat('calib', 'finess'))
-        calib_page.queensgate_constant(cfg.getfloat('calib', 'qgc'))
-        calib_page.sample_factor(cfg.getfloat('calib', 'sample'))
-        calib_page.overscan_factor(cfg.getfloat('calib', 'overscan'))
-
-        sci_page = _cw.page_science
-        sci_page.n_channels(cfg.getint('science', 'nchannels'))
-        sci_page.n_sweeps(cfg.getint('science', 'nsweeps'))
-        sci_page.z_start(cfg.getfloat('science', 'zstart'))
-        sci_page.z_step(cfg.getfloat('science', 'zstep'))
-        sci_page.ref_wavelength(cfg.getfloat('science', 'ref_wav'))
-        sci_page.fsr(cfg.getfloat('science', 'fsr'))
-        sci_page.fwhm(cfg.getfloat('science', 'fwhm'))
-        sci_page.finesse(cfg.getfloat('science', 'finess'))
-        sci_page.queensgate_constant(cfg.getfloat('science', 'qgc'))
-        sci_page.sample_factor(cfg.getfloat('science', 'sample'))
-        sci_page.overscan_factor(cfg.getfloat('science', 'overscan'))
-        sci_page.rest_wavelength(cfg.getfloat('science', 'rest_wav'))
-        sci_page.combo_box(cfg.get('science', 'combo_box'))
-        sci_page.sci_fsr(cfg.getfloat('science', 'fsr_obs'))
-
-        z = cfg.getfloat('science', 'redshift')
-        w_obs = cfg.getfloat('science', 'obs_wav')
-        v = cfg.getfloat('science', 'velocity')
-
-        sci_page.systemic_velocity = v
-        sci_page.redshift = z
-        sci_page.observed_wavelength = w_obs
-
-        if sci_page.combo_box() == "Redshift":
-            sci_page.input(z)
-            sci_page.output_1.set_label("Observed wavelength [A]")
-            sci_page.output_1(w_obs)
-            sci_page.output_2.set_label("Systemic velocity [km / s]")
-            sci_page.output_2(v)
-
-        elif sci_page.combo_box() == "Observed wavelength [A]":
-            sci_page.input(w_obs)
-            sci_page.output_1(z)
-            sci_page.output_2(v)
-        else:
-            sci_page.input(v)
-            sci_page.output_1(z)
-            sci_page.output_2(w_obs)
-
-        _cw.notebook.setCurrentIndex(cfg.getint('gui', 'active_page'))
-        # self._am_i_simulation = cfg.get('gui', 'simulation')
+        # Every value at once, then the derived fields. The signals of the
+        # fields are blocked meanwhile, so the estimate is updated here.
+        self.model.load(cfg)
+        self.model.apply()
+        self.centralWidget().on_scan_changed()
 
     def config_generate(self):
+        self.finish_startup()
+        return self.model.read().to_config()
 
-        _cw = self.centralWidget()
+    def export_script(self, filename=False, stream=None):
+        """
+        Export the scan of the active page so it runs without the GUI: as a
+        csh script looping over a table of positions, or as a command stream
+        played over a single connection by samfp-play.
 
-        cfg = configparser.RawConfigParser()
+        Parameters
+        ----------
+        filename (string) : The name of the file. If None is given, open a
+            dialog to ask the user for one.
+        stream (bool) : write a command stream instead of a csh script.
+            Defaults to True unless the file name ends with .sh.
+        """
+        try:
+            config = self.centralWidget().scan_config()
+        except ValueError as error:
+            log.error("Scan not exported: {}".format(error))
+            return
 
-        cfg.add_section('file')
-        cfg.set('file', 'basename', _cw.basename())
-        cfg.set('file', 'path', _cw.path())
-
-        cfg.add_section('obs')
-        cfg.set('obs', 'binning', _cw.binning())
-        cfg.set('obs', 'comment', _cw.comment())
-        cfg.set('obs', 'exptime', _cw.exp_time())
-        cfg.set('obs', 'nframes', _cw.n_frames())
-        cfg.set('obs', 'title', _cw.target_name())
-        cfg.set('obs', 'type', _cw.obs_type())
-
-        cfg.add_section('fp')
-        cfg.set('fp', 'name', _cw.fp())
-        cfg.set('fp', 'gap_size', _cw.fp_gap_size())
-
-        cfg.add_section('gui')
-        # cfg.set('gui', 'simulation', self._am_i_simulation)
-        cfg.set('gui', 'active_page', _cw.notebook.currentIndex())
-
-        scan_page = _cw.page_scan
-        cfg.add_section('scan')
-        cfg.set('scan', 'id', scan_page.id())
-        cfg.set('scan', 'nchannels', scan_page.n_channels())
-        cfg.set('scan', 'nsweeps', scan_page.n_sweeps())
-        cfg.set('scan', 'zstart', scan_page.z_start())
-        cfg.set('scan', 'zstep', scan_page.z_step())
-
-        calib_page = _cw.page_calibration
-        cfg.add_section('calib')
-        cfg.set('calib', 'nchannels', calib_page.n_channels())
-        cfg.set('calib', 'nsweeps', calib_page.n_sweeps())
-        cfg.set('calib', 'zstart', calib_page.z_start())
-        cfg.set('calib', 'zstep', calib_page.z_step())
-        cfg.set('calib', 'ref_wav', calib_page.ref_wavelength())
-        cfg.set('calib', 'fsr', calib_page.fsr())
-        cfg.set('calib', 'fwhm', calib_page.fwhm())
-        cfg.set('calib', 'finess', calib_page.finesse())
-        cfg.set('calib', 'qgc', calib_page.queensgate_constant())
-        cfg.set('calib', 'sample', calib_page.sample_factor())
-        cfg.set('calib', 'overscan', calib_page.overscan_factor())
-
-        sci_page = _cw.page_science
-        cfg.add_section('science')
-        cfg.set('science', 'nchannels', sci_page.n_channels())
-        cfg.set('science', 'nsweeps', sci_page.n_sweeps())
-        cfg.set('science', 'zstart', sci_page.z_start())
-        cfg.set('science', 'zstep', sci_page.z_step())
-        cfg.set('science', 'ref_wav', sci_page.ref_wavelength())
-        cfg.set('science', 'fsr', sci_page.fsr())
-        cfg.set('science', 'fwhm', sci_page.fwhm())
-        cfg.set('science', 'finess', sci_page.finesse())
-        cfg.set('science', 'qgc', sci_page.queensgate_constant())
-        cfg.set('science', 'sample', sci_page.sample_factor())
-        cfg.set('science', 'overscan', sci_page.overscan_factor())
-        cfg.set('science', 'rest_wav', sci_page.rest_wavelength())
-        cfg.set('science', 'combo_box', sci_page.combo_box())
-
-        if sci_page.combo_box() == "Redshift":
-            z = sci_page.input()
-            w_obs = sci_page.output_1()
-            v = sci_page.output_2()
-        elif sci_page.combo_box() == "Observed wavelength [A]":
-            w_obs = sci_page.input()
-            z = sci_page.output_1()
-            v = sci_page.output_2()
-        else:
-            v = sci_page.input()
-            z = sci_page.output_1()
-            w_obs = sci_page.output_2()
+        if not filename:
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+
+            filename, _ = QFileDialog.getSaveFileName(
+                self, "Export scan", "",
+                "csh Scripts (*.sh);; Command Streams (*.txt)",
+                options=options)
+
+            if not filename:
+                return
+
+        if stream is None:
+            stream = not filename.endswith('.sh')
+
+        from . import export
+
+        settings = export.scan_settings(
+            config.exptime, config.nframes, basename=config.basename,
+            path=config.path, binning=config.binning,
+            scan_id=export.NEW_SCAN_ID, title=config.title,
+            **{'image.comment': config.comment,
+               'image.type': config.image_type})
+
+        try:
+            if stream:
+                export.write_stream(config.plan, filename, settings)
+            else:
+                export.write_csh(config.plan, filename, settings)
+        except ValueError as error:
+            log.error("Scan not exported: {}".format(error))
+            return
+
+        log.debug("Exported scan to: {:s}".format(filename))
+        self.setStatusTip("Exported scan to: {:s}".format(filename))
+
+    def export_timings(self, filename=False):
+        """
+        Export the command timings of the last scan: a JSON file with the
+        latency summary and histograms per verb and the per-channel overhead
+        breakdown, plus the same data as CSV files next to it.
+
+        Parameters
+        ----------
+        filename (string) : The name of the JSON file. If None is given, open
+            a dialog to ask the user for one.
+        """
+        recorder = self.centralWidget().scan.recorder
+        if recorder is None:
+            log.info("There is no scan timing to export.")
+            return
+
+        if not filename:
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+
+            filename, _ = QFileDialog.getSaveFileName(
+                self, "Export timings", "",
+                "JSON Files (*.json);; All Files (*)", options=options)
+
+            if not filename:
+                return
 
-        cfg.set('science', 'redshift', z)
-        cfg.set('science', 'velocity', v)
-        cfg.set('science', 'obs_wav', w_obs)
-        cfg.set('science', 'fsr_obs', sci_page.sci_fsr())
+        root = os.path.splitext(filename)[0]
+        recorder.to_json(root + ".json")
+        recorder.to_csv(root + "_commands.csv")
+        recorder.channels_to_csv(root + "_channels.csv")
 
-        return cfg
+        log.debug("Exported scan timings to: {:s}.json".format(root))
+        self.setStatusTip("Exported scan timings to: {:s}.json".format(root))
 
     def get_exit_action(self):
 
-        icon_path = pkg_resources.resource_filename(
-            'samfp_gui', 'icons/close-icon.png')
+        icon = get_icon('close')
 
-        exit_action = QtWidgets.QAction(QtGui.QIcon(icon_path), '&Exit', self)
+        exit_action = QtWidgets.QAction(icon, '&Exit', self)
         exit_action.setShortcut('Ctrl+Q')
         exit_action.setStatusTip('Exit application')
         exit_action.triggered.connect(self.close)
 
         return exit_action
 
+    def get_export_script_action(self):
+
+        export_action = QtWidgets.QAction('Export &script', self)
+        export_action.setStatusTip(
+            'Export the scan to run it without the GUI.')
+        export_action.triggered.connect(self.export_script)
+
+        return export_action
+
+    def get_export_timings_action(self):
+
+        export_action = QtWidgets.QAction('&Export timings', self)
+        export_action.setStatusTip(
+            'Export the command timings of the last scan.')
+        export_action.triggered.connect(self.export_timings)
+
+        return export_action
+
     def get_load_action(self):
 
-        icon_path = pkg_resources.resource_filename(
-            'samfp_gui', 'icons/load-icon.png')
+        icon = get_icon('load')
 
-        load_action = QtWidgets.QAction(QtGui.QIcon(icon_path), '&Open', self)
+        load_action = QtWidgets.QAction(icon, '&Open', self)
         load_action.setShortcut('Ctrl+O')
         load_action.setStatusTip('Load config file.')
         load_action.triggered.connect(self.load_config_file)
@@ -302,10 +322,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def get_save_action(self):
 
-        icon_path = pkg_resources.resource_filename(
-            'samfp_gui', 'icons/save-icon.png')
+        icon = get_icon('save')
 
-        save_action = QtWidgets.QAction(QtGui.QIcon(icon_path), '&Save', self)
+        save_action = QtWidgets.QAction(icon, '&Save', self)
         save_action.setShortcut('Ctrl+S')
         save_action.setStatusTip('Save config file.')
         save_action.triggered.connect(self.save_config_file)
@@ -314,12 +333,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def get_toogle_connect_action(self):
 
-        icon_path = pkg_resources.resource_filename(
-            'samfp_gui', 'icons/disconnected-icon.png')
+        icon = get_icon('disconnected' if self._am_i_simulation
+                        else 'connected')
 
-        toogle_connect_action = QtWidgets.QAction(QtGui.QIcon(icon_path),
-                                                  '&Toogle Connect', self)
+        toogle_connect_action = QtWidgets.QAction(icon, '&Toogle Connect',
+                                                  self)
         toogle_connect_action.setStatusTip('Start/Stop simulation mode.')
+        toogle_connect_action.setCheckable(True)
+        toogle_connect_action.setChecked(self._am_i_simulation)
+        # Checked means simulation
         toogle_connect_action.triggered.connect(self.toogle_connection)
 
         return toogle_connect_action
@@ -363,7 +385,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         return filename
 
-    def save_config_file(self, filename=False):
+    def save_config_file(self, filename=False, background=False):
         """
         Save a new configuration file.
 
@@ -372,17 +394,33 @@ class MainWindow(QtWidgets.QMainWindow):
         filename (string) : The name of the file that will hold the
             configuration. If None is given, open a dialog to ask the
             user for one.
+        background (bool) : if True, only read the widgets here and write
+            the file from another thread, so the GUI never waits for the
+            disk.
         """
 
         if not filename:
             filename = self.save_file_dialog()
 
-        temp_config = self.config_generate()
-        with open(filename, 'w') as foo:
-            temp_config.write(foo)
+        text = io.StringIO()
+        self.config_generate().write(text)
 
+        if background:
+            self._writer.submit(self._write_config_file, filename,
+                                text.getvalue())
+        else:
+            self._write_config_file(filename, text.getvalue())
+            self.setStatusTip("Saved config file: {:s}".format(filename))
+
+    @staticmethod
+    def _write_config_file(filename, text):
+        try:
+            with open(filename, 'w') as foo:
+                foo.write(text)
+        except IOError as error:
+            log.error("Could not save {:s}: {}".format(filename, error))
+            return
         log.debug("Saved config file: {:s}".format(filename))
-        self.setStatusTip("Saved config file: {:s}".format(filename))
 
     def save_file_dialog(self):
 
@@ -405,27 +443,25 @@ class MainWindow(QtWidgets.QMainWindow):
         if sim_state is None:
 
             if self._am_i_simulation:
-                icon_path = pkg_resources.resource_filename(
-                    'samfp_gui', 'icons/connected-icon.png')
+                icon = get_icon('connected')
                 self._am_i_simulation = False
 
             else:
-                icon_path = pkg_resources.resource_filename(
-                    'samfp_gui', 'icons/disconnected-icon.png')
+                icon = get_icon('disconnected')
                 self._am_i_simulation = True
 
         else:
 
             self._am_i_simulation = sim_state
             if sim_state:
-                icon_path = pkg_resources.resource_filename(
-                    'samfp_gui', 'icons/disconnected-icon.png')
+                icon = get_icon('disconnected')
 
             else:
-                icon_path = pkg_resources.resource_filename(
-                    'samfp_gui', 'icons/connected-icon.png')
+                icon = get_icon('connected')
 
-        self.toogle_connect_action.setIcon(QtGui.QIcon(icon_path))
+        self.toogle_connect_action.setIcon(icon)
+        self.toogle_connect_action.setChecked(self._am_i_simulation)
+        self.centralWidget().scan.simulation = self._am_i_simulation
         log.debug('Simulation mode is now {:}'.format(self._am_i_simulation))
 
 
@@ -437,7 +473,9 @@ class MyCentralWidget(QtWidgets.QFrame):
         # Init bottom group
         self.scan_button = QtWidgets.QPushButton("Scan")
         self.abort_button = QtWidgets.QPushButton("Abort")
+        self.resume_button = QtWidgets.QPushButton("Resume")
         self.progress_bar = QtWidgets.QProgressBar()
+        self.estimate_label = QtWidgets.QLabel()
 
         self.bottom_group = self.init_bottom_panel()
 
@@ -450,9 +488,15 @@ class MyCentralWidget(QtWidgets.QFrame):
         self.exp_time = FloatTField("Exposure time [s]:", 1)
         self.sleep_time = FloatTField("Sleep time [s]:", 0)
         self.n_frames = IntTField("Frames per channel:", 1)
+        self.pipelined = CheckBox("Move FP during readout")
         self.fp = ComboBox("Fabry-Perot: ",
                            ["Low-Resolution", "High-Resolution"])
         self.fp_gap_size = FloatTField("Gap size [um]:", 44)
+        self.max_jump = IntTField("Max. FP jump [bcv]:", sequence.MAX_JUMP)
+        self.max_jump.line_edit.setToolTip(
+            "Larger moves are split in moves of at most this many BCV, "
+            "each followed by a pause, as the CS100 requires. 0 disables "
+            "the splitting.")
 
         self.left_group = self.init_left_panel()
 
@@ -462,22 +506,31 @@ class MyCentralWidget(QtWidgets.QFrame):
 
         self.top_group = self.init_top_panel()
 
-        # Initialize right group
+        # Initialize right group. The other pages are built by build_pages
+        # once the window is on screen
         self.page_scan = PageScan()
-        self.page_calibration = PageCalibrationScan()
-        self.page_science = PageScienceScan()
+        self.page_calibration = None
+        self.page_science = None
 
         self.notebook = QtWidgets.QTabWidget()
         self.right_group = self.init_right_panel()
 
+        # Predicts the scan duration from the timings of previous scans.
+        # Loaded by build_pages
+        self.overhead = None
+        self._estimate_pending = False
+
+        # Scans run back to back. Built by build_pages as well
+        self.queue_panel = None
+
         # Put all of them in the main grid
-        hbox = QtWidgets.QHBoxLayout()
-        hbox.addWidget(self.left_group)
-        hbox.addWidget(self.right_group)
+        self.columns = QtWidgets.QHBoxLayout()
+        self.columns.addWidget(self.left_group)
+        self.columns.addWidget(self.right_group)
 
         vbox = QtWidgets.QVBoxLayout()
         vbox.addWidget(self.top_group)
-        vbox.addLayout(hbox)
+        vbox.addLayout(self.columns)
         vbox.addWidget(self.bottom_group)
 
         self.setLayout(vbox)
@@ -485,13 +538,21 @@ class MyCentralWidget(QtWidgets.QFrame):
         # Create a thread
         self.thread = QtCore.QThread()
 
+        # Or run the scan on an asyncio loop driven by the Qt event loop,
+        # created by the first such scan
+        self.run_async = False
+        self.aio = None
+
         # Create the process object
         self.scan = Scan()
         self.scan.moveToThread(self.thread)
 
-        # Connect thread and process object
+        # Connect thread and process object. A new scan only starts once the
+        # thread is done with the previous one, without ever waiting for it.
+        self.worker_busy = False
         self.thread.started.connect(self.scan.start)
         self.thread.finished.connect(self.scan.stop)
+        self.thread.finished.connect(self.on_worker_finished)
 
         # Connect events to widgets
         self.connect_widgets()
@@ -505,9 +566,44 @@ class MyCentralWidget(QtWidgets.QFrame):
         # Connect the scan abort
         self.abort_button.clicked.connect(self.scan_abort)
 
+        # Connect the resume of an interrupted scan
+        self.resume_button.clicked.connect(self.scan_resume)
+
         # Connect when the FP combo box change index/value
         self.fp.combo_box.currentIndexChanged.connect(self.on_fp_change)
 
+        # self.close.connect(self.scan_abort)
+
+        # Connect the progress bar to the signal in the scan
+        self.scan.signal_value.connect(self.update_progress_bar)
+
+        # Also connect the scan state to the buttons state
+        self.scan.signal_running.connect(self.enable_scan)
+
+        # Update the estimated duration whenever the scan changes
+        for field in [self.exp_time, self.n_frames, self.max_jump]:
+            field.line_edit.textChanged.connect(self.on_scan_changed)
+        self.binning.combo_box.currentIndexChanged.connect(
+            self.on_scan_changed)
+        self.pipelined.check_box.stateChanged.connect(self.on_scan_changed)
+        self.notebook.currentChanged.connect(self.on_scan_changed)
+        self.connect_page(self.page_scan)
+
+    def build_pages(self):
+        """
+        Build the calibration and science pages and the observation queue,
+        and load the overhead model, if not done yet.
+        """
+
+        if self.page_science is not None:
+            return
+
+        self.page_calibration = PageCalibrationScan()
+        self.page_science = PageScienceScan()
+
+        self.notebook.addTab(self.page_calibration, "Calibration Scan")
+        self.notebook.addTab(self.page_science, "Science Scan")
+
         # Connect when we set the calibration scan pameters
         self.page_calibration.set_scanpars_button.clicked.connect(
             self.setup_calibration_scan
@@ -518,25 +614,38 @@ class MyCentralWidget(QtWidgets.QFrame):
 
         # Connect when we set the science scan pameters
         self.page_science.set_scanpars_button.clicked.connect(
-            self.setup_calibration_scan
+            self.setup_science_scan
         )
         self.page_science.set_scanpars_button.clicked.connect(
             self.page_scan.set_id
         )
 
-        # self.close.connect(self.scan_abort)
+        self.connect_page(self.page_calibration)
+        self.connect_page(self.page_science)
 
-        # Connect the progress bar to the signal in the scan
-        self.scan.signal_value.connect(self.update_progress_bar)
+        from .estimate import OverheadModel
+        from .obsqueue import ObservationQueue
 
-        # Also connect the scan state to the buttons state
-        self.scan.signal_running.connect(self.enable_scan)
+        self.overhead = OverheadModel.load()
+        self.queue_panel = QueuePanel(ObservationQueue.load(), self.overhead)
+        self.columns.addWidget(self.queue_panel)
+
+        # Connect the observation queue
+        self.queue_panel.add_button.clicked.connect(self.queue_add)
+        self.queue_panel.run_button.clicked.connect(self.queue_run)
+        self.scan.signal_queue.connect(self.queue_panel.refresh)
 
+    def connect_page(self, page):
+        """Update the estimated duration when the scan of a page changes."""
+        for field in [page.z_start, page.z_step, page.n_channels,
+                      page.n_sweeps]:
+            field.line_edit.textChanged.connect(self.on_scan_changed)
 
     def init_bottom_panel(self):
         """Initialize the widgets at the bottom of the screen."""
 
         self.scan_button.setEnabled(True)
+        self.resume_button.setEnabled(True)
         self.abort_button.setDisabled(True)
         self.progress_bar.setDisabled(True)
 
@@ -545,8 +654,10 @@ class MyCentralWidget(QtWidgets.QFrame):
         bottom_grid.setSpacing(5)
 
         bottom_grid.addWidget(self.scan_button, 10, 0)
-        bottom_grid.addWidget(self.abort_button, 10, 1)
-        bottom_grid.addWidget(self.progress_bar, 10, 2)
+        bottom_grid.addWidget(self.resume_button, 10, 1)
+        bottom_grid.addWidget(self.abort_button, 10, 2)
+        bottom_grid.addWidget(self.progress_bar, 10, 3)
+        bottom_grid.addWidget(self.estimate_label, 11, 0, 1, 4)
 
         bottom_grid.setAlignment(QtCore.Qt.AlignLeft)
         bottom_grid.setAlignment(QtCore.Qt.AlignTop)
@@ -582,15 +693,20 @@ class MyCentralWidget(QtWidgets.QFrame):
         grid.addWidget(self.n_frames.label, 6, 0)
         grid.addWidget(self.n_frames.line_edit, 6, 1)
 
-        grid.addWidget(HLine(), 7, 0, 1, 3)
+        grid.addWidget(self.pipelined.check_box, 7, 0, 1, 2)
+
+        grid.addWidget(HLine(), 8, 0, 1, 3)
 
-        grid.addWidget(self.fp.label, 8, 0)
-        grid.addWidget(self.fp.combo_box, 8, 1)
+        grid.addWidget(self.fp.label, 9, 0)
+        grid.addWidget(self.fp.combo_box, 9, 1)
 
-        grid.addWidget(self.fp_gap_size.label, 9, 0)
-        grid.addWidget(self.fp_gap_size.line_edit, 9, 1)
+        grid.addWidget(self.fp_gap_size.label, 10, 0)
+        grid.addWidget(self.fp_gap_size.line_edit, 10, 1)
         self.fp_gap_size.disable()
 
+        grid.addWidget(self.max_jump.label, 11, 0)
+        grid.addWidget(self.max_jump.line_edit, 11, 1)
+
         grid.setAlignment(QtCore.Qt.AlignLeft)
         grid.setAlignment(QtCore.Qt.AlignTop)
         group.setLayout(grid)
@@ -618,8 +734,6 @@ class MyCentralWidget(QtWidgets.QFrame):
     def init_right_panel(self):
 
         self.notebook.addTab(self.page_scan, "Basic Scan")
-        self.notebook.addTab(self.page_calibration, "Calibration Scan")
-        self.notebook.addTab(self.page_science, "Science Scan")
 
         return self.notebook
 
@@ -637,66 +751,231 @@ class MyCentralWidget(QtWidgets.QFrame):
         # Just some debug levelgi
         log.debug('"Abort" buttom pressed.')
 
-        # Gently quit the thread
-        self.scan.stop()
+        # Interrupt the scan and let the thread finish on its own. The
+        # event loop of the thread quits as soon as the scan returns.
+        self.scan.abort()
         self.thread.quit()
-        self.thread.wait()  # block until your thread as properly finished.
+
+    def start_worker(self):
+        """Run the scan on the worker thread."""
+        self.worker_busy = True
+        self.enable_scan(True)
+        self.thread.start()
+
+    def on_worker_finished(self):
+        """The thread returned from the scan and its event loop stopped."""
+        self.worker_busy = False
+        self.enable_scan(False)
+
+    def worker_is_busy(self):
+        """
+        Returns
+        -------
+        busy (bool) : True, and tell the observer, if the thread is still
+            unwinding the previous scan, e.g. right after an abort.
+        """
+        if self.worker_busy:
+            log.info("The previous scan is still finishing.")
+            self.setStatusTip("The previous scan is still finishing.")
+        return self.worker_busy
+
+    def scan_resume(self):
+
+        # Just some debug level
+        log.debug('"Resume" buttom pressed.')
+
+        if self.worker_is_busy():
+            return
+
+        if self.scan.simulation:
+            log.info("Interrupted scans are not resumed in simulation mode.")
+            self.setStatusTip(
+                "Interrupted scans are not resumed in simulation mode.")
+            return
+
+        from .journal import ScanJournal
+
+        journal = ScanJournal.latest_unfinished()
+        if journal is None:
+            log.info("There is no interrupted scan to resume.")
+            self.setStatusTip("There is no interrupted scan to resume.")
+            return
+
+        try:
+            plan = journal.plan()
+        except ValueError as error:
+            log.error("Could not resume {:s}: {}".format(
+                journal.scan_id, error))
+            return
+
+        # Configure the thread
+        self.scan.n_steps = len(plan)
+        self.scan.resume_journal = journal
+        self.scan.on_change_value(len(journal.completed()))
+
+        # Start the thread
+        self.start_worker()
 
     def scan_start(self):
 
         # Just some debug level
         log.debug('"Scan" buttom pressed.')
 
-        # Saving temporary configuration file
+        if self.worker_is_busy():
+            return
+
+        # Compute and validate the whole scan before sending anything
+        try:
+            config = self.scan_config()
+        except ValueError as error:
+            log.error("Scan not started: {}".format(error))
+            self.setStatusTip("Scan not started: {}".format(error))
+            return
+
+        # Saving temporary configuration file, without waiting for it
         main_window = self.parent()
-        main_window.save_config_file(main_window.temp_cfg_file)
+        main_window.save_config_file(main_window.temp_cfg_file,
+                                     background=True)
 
         # Configure the thread
-        _current_page = self.notebook.currentWidget()
-        self.scan.n_steps = _current_page.total_steps
-        self.scan.config_file = main_window.temp_cfg_file
+        self.scan.n_steps = config.n_steps
+        self.scan.config = config
         self.scan.on_change_value(0)
 
-        # Make sure that the thread has stopped
-        if self.thread.isRunning():
-            log.debug('There is a thread still running. Killing it.')
-            self.thread.quit()
-            self.thread.wait()
-        else:
-            log.debug('No thread running.')
+        if self.run_async and not self.scan.simulation:
+            if self.aio is None:
+                from .qtasync import AsyncioDriver
+                self.aio = AsyncioDriver(parent=self)
+            self.scan.start_async(self.aio)
+            return
 
         # Start the thread
-        self.thread.start()
+        self.start_worker()
+
+    def queue_add(self):
+        """Add the scan of the active page to the observation queue."""
+        try:
+            config = self.scan_config()
+        except ValueError as error:
+            log.error("Scan not queued: {}".format(error))
+            self.setStatusTip("Scan not queued: {}".format(error))
+            return
+
+        self.queue_panel.queue.add(config)
+        self.queue_panel.refresh()
+
+    def queue_run(self):
+        """Run every pending scan of the observation queue."""
+        if self.worker_is_busy():
+            return
+
+        if self.scan.simulation:
+            log.info("The queue does not run in simulation mode.")
+            self.setStatusTip("The queue does not run in simulation mode.")
+            return
+
+        if self.queue_panel.queue.next_pending() is None:
+            log.info("There is no pending scan in the queue.")
+            self.setStatusTip("There is no pending scan in the queue.")
+            return
+
+        # Configure the thread
+        self.scan.queue = self.queue_panel.queue
+        self.scan.on_change_value(0)
+
+        # Start the thread
+        self.start_worker()
+
+    def scan_config(self):
+        """
+        Read the widgets of the active page and of the observation settings.
+
+        Returns
+        -------
+        config (ScanConfig)
+
+        Raises
+        ------
+        ValueError : if the scan is out of range or any setting is invalid.
+        """
+        page = self.notebook.currentWidget()
+        plan = ScanPlan(page.z_start(), page.z_step(), page.n_channels(),
+                        page.n_sweeps(), max_jump=self.max_jump() or None)
+
+        return ScanConfig(plan, self.exp_time(), self.n_frames(),
+                          basename=self.basename(), path=self.path(),
+                          binning=self.binning(), comment=self.comment(),
+                          title=self.target_name(),
+                          image_type=self.obs_type(),
+                          pipelined=self.pipelined())
+
+    def on_scan_changed(self):
+        """
+        Called for every change of the scan. Several changes in a row update
+        the estimate once Qt is back in its event loop.
+        """
+        if not self._estimate_pending:
+            self._estimate_pending = True
+            QtCore.QTimer.singleShot(0, self.update_estimate)
+
+    def update_estimate(self):
+        """Show how long the scan on the active page would take."""
+        self._estimate_pending = False
+        if self.overhead is None:
+            # build_pages updates it once the model is loaded
+            return
+
+        try:
+            config = self.scan_config()
+        except (TypeError, ValueError):
+            self.estimate_label.setText("Estimated duration: -")
+            return
+
+        from .estimate import estimate, format_duration
+
+        # As the engine, which pipelines several frames only when it knows
+        # the readout time
+        pipelined = config.pipelined and config.nframes == 1
+        e = estimate(config.plan, config.exptime, config.nframes,
+                     config.binning, pipelined, self.overhead)
+
+        text = "Estimated duration: {:s}".format(format_duration(e.duration))
+        if e.uncertainty:
+            text += " \u00b1 {:s}".format(format_duration(e.uncertainty))
+        text += ", {:.0f} % exposing".format(100 * e.efficiency)
+        self.estimate_label.setText(text)
 
     def setup_calibration_scan(self):
 
         overscan_factor = self.page_calibration.overscan_factor()
         sampling = self.page_calibration.sample_factor()
         finesse = self.page_calibration.finesse()
-        fwhm = self.page_calibration.fwhm()
+        fsr = self.page_calibration.fsr()
 
-        n_channels = overscan_factor * finesse * sampling
-        z_step = fwhm / sampling
+        if finesse <= 0 or sampling <= 0:
+            log.warning("Finesse and sample factor must be positive.")
+            return
 
-        self.page_scan.n_channels(round(n_channels))
-        self.page_scan.z_step(- z_step)
+        self.page_scan.n_channels(
+            sequence.n_channels(finesse, sampling, overscan_factor))
+        self.page_scan.z_step(
+            - float(sequence.bcv_step(fsr, finesse, sampling)))
 
     def setup_science_scan(self):
 
-        overscan_factor = self.page_science.overscan_factor()
-        sampling = self.page_science.sample_factor()
-
-        QGC = self.page_science.queensgate_constant()
-        finesse = self.page_science.finesse()
+        page = self.page_science
+        page.refresh()
 
-        sci_fsr = self.page_science.observed_wavelength / QGC
-        sci_fwhm = finesse / sci_fsr
+        n_channels = page.graph['n_channels']
+        z_step = page.graph['z_step']
 
-        n_channels = overscan_factor * finesse * sampling
-        z_step = sci_fwhm / sampling
+        if n_channels is masked or not isfinite(z_step):
+            log.warning("Queensgate constant, finesse and sample factor "
+                        "must be positive.")
+            return
 
-        self.page_scan.n_channels(round(n_channels))
-        self.page_scan.z_step(- z_step)
+        self.page_scan.n_channels(n_channels)
+        self.page_scan.z_step(z_step)
 
     def timerEvent(self, e):
 
@@ -743,22 +1022,135 @@ class MyCentralWidget(QtWidgets.QFrame):
 
     @pyqtSlot(bool)
     def enable_scan(self, val):
-        self.scan_button.setDisabled(val)
+        # Once the scan returned, its thread quits on its own and the
+        # buttons are enabled by on_worker_finished
+        idle = not val and not self.worker_busy
+        if not val and self.worker_busy:
+            self.thread.quit()
+
+        self.scan_button.setEnabled(idle)
+        self.resume_button.setEnabled(idle)
         self.abort_button.setEnabled(val)
         self.progress_bar.setEnabled(val)
+        if self.queue_panel is not None:
+            self.queue_panel.run_button.setEnabled(idle)
+
+
+class QueuePanel(QtWidgets.QGroupBox):
+
+    def __init__(self, queue, overhead=None):
+        """
+        Shows the observation queue with the status and the estimated
+        duration of every scan, and lets the observer reorder it.
+
+        Parameters
+        ----------
+        queue (obsqueue.ObservationQueue) : the queue to show.
+        overhead (estimate.OverheadModel) : optional. Defaults to the saved
+            model.
+        """
+        super(QueuePanel, self).__init__("Observation queue")
+
+        from .estimate import OverheadModel
+
+        self.queue = queue
+        self.overhead = overhead or OverheadModel.load()
+
+        self.list = QtWidgets.QListWidget()
+        self.add_button = QtWidgets.QPushButton("Add")
+        self.remove_button = QtWidgets.QPushButton("Remove")
+        self.up_button = QtWidgets.QPushButton("Up")
+        self.down_button = QtWidgets.QPushButton("Down")
+        self.retry_button = QtWidgets.QPushButton("Retry")
+        self.run_button = QtWidgets.QPushButton("Run queue")
+
+        grid = QtWidgets.QGridLayout()
+        grid.addWidget(self.list, 0, 0, 1, 3)
+        grid.addWidget(self.add_button, 1, 0)
+        grid.addWidget(self.remove_button, 1, 1)
+        grid.addWidget(self.retry_button, 1, 2)
+        grid.addWidget(self.up_button, 2, 0)
+        grid.addWidget(self.down_button, 2, 1)
+        grid.addWidget(self.run_button, 2, 2)
+        self.setLayout(grid)
+
+        self.remove_button.clicked.connect(self.remove)
+        self.retry_button.clicked.connect(self.retry)
+        self.up_button.clicked.connect(lambda: self.move(-1))
+        self.down_button.clicked.connect(lambda: self.move(1))
+
+        self.refresh()
+
+    @pyqtSlot()
+    def refresh(self):
+        """Show the queue as it is now."""
+        from .estimate import estimate, format_duration
+
+        row = self.list.currentRow()
+        self.list.clear()
+
+        for item in self.queue:
+            config = item.config
+            duration = estimate(
+                config.plan, config.exptime, config.nframes, config.binning,
+                config.pipelined and config.nframes == 1,
+                self.overhead).duration
+            self.list.addItem("{:s} - {:d} channels, {:s} - {:s}".format(
+                item.name, config.n_steps, format_duration(duration),
+                item.status))
+
+        self.list.setCurrentRow(min(row, self.list.count() - 1))
+
+    def move(self, offset):
+        """Move the selected scan up or down the queue."""
+        row = self.list.currentRow()
+        if row < 0:
+            return
+        self.queue.move(row, row + offset)
+        self.refresh()
+        self.list.setCurrentRow(min(max(row + offset, 0),
+                                    self.list.count() - 1))
+
+    def remove(self):
+        row = self.list.currentRow()
+        if row < 0:
+            return
+        try:
+            self.queue.remove(row)
+        except ValueError as error:
+            log.warning(str(error))
+        self.refresh()
+
+    def retry(self):
+        """Queue the selected scan again."""
+        row = self.list.currentRow()
+        if row < 0:
+            return
+        try:
+            self.queue.reset(row)
+        except ValueError as error:
+            log.warning(str(error))
+        self.refresh()
 
 
 class Scan(QtCore.QObject):
 
     signal_value = QtCore.pyqtSignal(int)
     signal_running = QtCore.pyqtSignal(bool)
+    signal_queue = QtCore.pyqtSignal()
 
     def __init__(self, is_simulation=None):
         super(Scan, self).__init__()
 
-        self.config_file = None
+        self.config = None
+        self.recorder = None
+        self.resume_journal = None
+        self.queue = None
+        self._cancel = None
+        self._engine = None
+        self._task = None
         self._isRunning = False
-        self._isSimulation = is_simulation
+        self.simulation = bool(is_simulation)
         self._maxSteps = 1
         self._step = None
 
@@ -776,6 +1168,10 @@ class Scan(QtCore.QObject):
         value = int(value * 100. / self._maxSteps)
         self.signal_value.emit(value)
 
+    def on_step_done(self, step, sweep, channel, z):
+        self._step = step
+        self.on_change_value(self._step)
+
     def start(self):
         """
         This is what happens when the scan actually starts. Any configuration
@@ -785,88 +1181,180 @@ class Scan(QtCore.QObject):
         log.debug("Start scan.")
 
         # Start scan parameters
+        self._cancel = CancelToken()
         self._step = 0
         self._isRunning = True
         self.signal_running.emit(self._isRunning)
 
         # Running the scan
-        if self._isSimulation:
-            while (self._step < self._maxSteps) and self._isRunning:
+        if self.simulation:
+            self._simulate(self.config)
 
-                # Increment a step
-                self._step += 1
+        elif self.queue is not None:
+            queue, self.queue = self.queue, None
+            self._run_queue(queue)
 
-                # Sleep simulates operations within the server
-                time.sleep(1)
+        elif self.resume_journal is not None:
+            # Continue an interrupted scan from its journal
+            journal = self.resume_journal
+            self.resume_journal = None
 
-                # When finished, emit a signal and print it
-                self.on_change_value(self._step)
-                log.debug("Current scan step: %d" % self._step)
+            try:
+                plan = journal.plan()
+            except ValueError as error:
+                log.error("Scan not resumed: {}".format(error))
+                self.stop()
+                return
 
-        else:
-            # Read the temp configuration file
-            cfg = configparser.RawConfigParser()
-            cfg.read(self.config_file)
+            log.debug("Resuming {:s}.".format(journal.scan_id))
+            entry = journal.restore()
 
-            # Parse configuration
-            scan.set_image_basename(str(cfg.get('file', 'basename')))
-            scan.set_image_path(str(cfg.get('file', 'path')))
+            self._run_engine(plan, entry['exptime'], entry['nframes'],
+                             entry.get('pipelined', False), journal)
 
-            scan.set_binning(int(cfg.get('obs', 'binning')))
-            scan.set_comment(str(cfg.get('obs', 'comment')))
-            scan.set_image_exposure_time(cfg.getfloat('obs', 'exptime'))
-            scan.set_image_nframes(cfg.getint('obs', 'nframes'))
-            scan.set_target_name(str(cfg.get('obs', 'title')))
-            scan.set_image_type(str(cfg.get('obs', 'type')))
+        else:
+            from . import runner
 
-            current_page_index = int(cfg.get('gui', 'active_page'))
-            pages = ['scan', 'calib', 'science']
-            section = pages[current_page_index]
+            # The configuration was validated when the scan was requested
+            config = self.config
 
-            number_of_channels = cfg.getint(section, 'nchannels')
-            number_of_sweeps = cfg.getint(section, 'nsweeps')
-            z = cfg.getint(section, 'zstart')
-            dz = cfg.getfloat(section, 'zstep')
+            # Send every setting at once
+            journal = runner.start_journal(config)
 
-            stime = 0.1
+            self._run_engine(config.plan, config.exptime, config.nframes,
+                             config.pipelined, journal)
 
-            # Prepare the scan parameters
-            scan.set_scan_id()
+        # Leaving gracefully
+        self.stop()
 
-            for sweep in range(number_of_sweeps):
+    def start_async(self, driver):
+        """
+        Run the scan as a coroutine on the asyncio loop stepped by `driver`
+        (a qtasync.AsyncioDriver) instead of on a QThread. Progress is
+        reported from the GUI thread.
+        """
+        log.debug("Start scan (asyncio).")
 
-                z = cfg.getint(section, 'zstart')
-                print("Moving FP to the initial Z = {:d}".format(int(round(z))))
-                z = scan.fp_moveabs(int(round(z)))
-                scan.set_scan_start(int(round(z)))
-                scan.set_scan_current_sweep(sweep + 1)
+        self._step = 0
+        self._isRunning = True
+        self.signal_running.emit(self._isRunning)
 
-                for channel in range(number_of_channels):
+        self._task = driver.submit(self._scan_async(),
+                                   callback=lambda task: self.stop())
 
-                    if self._isRunning is False:
-                        self.stop()
-                        return
+    async def _scan_async(self):
+        from . import runner
+        from .aioclient import AsyncClient, AsyncScanRunner
+        from .settle import SettleModel
 
-                    if 4095 < z or z < 0:
-                        log.warning("Z = {z:d} out of the allowed range [0, 4095]".format(int(round(z))))
-                        continue
+        config = self.config
 
-                    scan.fp_moveabs(int(round(z)))
-                    scan.set_scan_current_z(int(round(z)))
+        # Every setting at once, as runner.send_settings
+        async with AsyncClient() as client, client.batch():
+            await client.set_image_basename(config.basename)
+            await client.set_image_path(config.path)
 
-                    time.sleep(stime)
-                    scan.expose()
+            await client.set_binning(config.binning)
+            await client.set_comment(config.comment)
+            await client.set_image_exposure_time(config.exptime)
+            await client.set_image_nframes(config.nframes)
+            await client.set_target_name(config.title)
+            await client.set_image_type(config.image_type)
 
-                    # Increment a step
-                    self._step += 1
-                    self.on_change_value(self._step)
-                    z = z + dz
+            scan_id = scan.make_scan_id()
+            await client.set_scan_id(scan_id)
 
+        journal = runner.open_journal(config, scan_id)
 
+        self._engine = AsyncScanRunner(config.plan, config.exptime,
+                                       config.nframes,
+                                       settle=SettleModel.load(),
+                                       pipelined=config.pipelined,
+                                       journal=journal)
+        self._engine.on_step = self.on_step_done
+        self.recorder = self._engine.recorder
 
-        # Leaving gracefully
-        self.stop()
+        try:
+            if self._isRunning:
+                await self._engine.run()
+        finally:
+            self._engine = None
 
+    def _simulate(self, config):
+        """
+        Run the scan against the simulated instrument, on a virtual clock,
+        and report how long it would take.
+        """
+        from .simulation import Simulator
+
+        with Simulator() as simulator:
+            self._engine = simulator.prepare(config, cancel=self._cancel)
+            self._engine.on_step = self.on_step_done
+            self.recorder = self._engine.recorder
+
+            try:
+                n = self._engine.run() if self._isRunning else 0
+            finally:
+                self._engine = None
+
+        log.info("Simulated scan: {:d} of {:d} channels in {} of "
+                 "instrument time.".format(
+                     n, config.n_steps,
+                     datetime.timedelta(seconds=round(simulator.elapsed))))
+
+    def _run_queue(self, queue):
+        """Run every pending scan of the observation queue."""
+        from .obsqueue import QueueRunner
+        from .settle import SettleModel
+
+        self._engine = QueueRunner(queue, settle=SettleModel.load(),
+                                   cancel=self._cancel)
+        self._engine.on_item = self.on_queue_item
+        self._engine.on_step = \
+            lambda item, step, sweep, channel, z: self.on_step_done(
+                step, sweep, channel, z)
+
+        n = self._engine.run() if self._isRunning else 0
+        log.info("Queue: {:d} scans done.".format(n))
+        self._engine = None
+
+    def on_queue_item(self, item):
+        if item.status == 'running':
+            self.n_steps = item.config.n_steps
+            self.on_change_value(0)
+        self.signal_queue.emit()
+
+    def _run_engine(self, plan, exptime, nframes, pipelined, journal):
+        from .engine import ScanEngine
+        from .settle import SettleModel
+
+        self._engine = ScanEngine(plan, exptime, nframes,
+                                  settle=SettleModel.load(),
+                                  pipelined=pipelined, journal=journal,
+                                  cancel=self._cancel)
+        self._engine.on_step = self.on_step_done
+        self.recorder = self._engine.recorder
+
+        if self._isRunning:
+            self._engine.run()
+        if self._engine.abort_latency is not None:
+            log.info("Scan aborted {:.3f} s after the request.".format(
+                self._engine.abort_latency))
+        self._engine = None
+
+    def abort(self):
+        """
+        Interrupt the scan as soon as possible, including the exposure in
+        progress. Safe to call from the GUI thread since it never blocks.
+        """
+        self._isRunning = False
+        if self._cancel is not None:
+            self._cancel.cancel()
+        if self._engine is not None:
+            self._engine.abort()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
     def stop(self):
         """
@@ -874,4 +1362,6 @@ class Scan(QtCore.QObject):
         or to make sure that the scan will be finished properly.
         """
         self._isRunning = False
+        if self._engine is not None:
+            self._engine.stop()
         self.signal_running.emit(self._isRunning)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    Timing instrumentation for the commands sent to the SAM-FP plugin.
+"""
+
+from __future__ import print_function, division
+
+import collections
+import csv
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger("samfp.instrument")
+
+VERBS = ['moveabs', 'expose', 'dbs set', 'set', 'status']
+
+CommandRecord = collections.namedtuple(
+    'CommandRecord',
+    ['command', 'verb', 'thread', 'start', 'connected', 'sent', 'first_byte',
+     'done', 'reply'])
+"""
+Timestamps of one command, all from time.monotonic(). `connected` is None
+when an open socket was reused. `done` is when the whole reply was read; the
+socket itself stays open for the next command.
+"""
+
+ChannelRecord = collections.namedtuple(
+    'ChannelRecord', ['sweep', 'channel', 'z', 'start', 'done'])
+
+
+def command_verb(command):
+    """
+    Parameters
+    ----------
+    command (string) : a command sent to the plugin.
+
+    Returns
+    -------
+    verb (string) : one of VERBS or the first word of the command.
+    """
+    words = command.lower().split()
+    if words[:3] == ['dhe', 'dbs', 'set']:
+        return 'dbs set'
+    if words[:2] == ['dhe', 'set']:
+        return 'set'
+    if words[:2] in (['fp', 'moveabs'], ['fp', 'status']):
+        return words[1]
+    if words[:2] == ['dhe', 'expose']:
+        return 'expose'
+    return words[0] if words else ''
+
+
+class Recorder(object):
+
+    def __init__(self, slow=1.0):
+        """
+        Collect the timestamps of every command and of every scan channel.
+
+        Parameters
+        ----------
+        slow (float) : a warning is logged whenever a command other than
+            `dhe expose` takes longer than this many seconds.
+        """
+        self.slow = slow
+        self.commands = []
+        self.channels = []
+        self._lock = threading.Lock()
+
+    def add_command(self, command, start, connected, sent, first_byte, done,
+                    reply):
+        record = CommandRecord(command, command_verb(command),
+                               threading.current_thread().name, start,
+                               connected, sent, first_byte, done, reply)
+        with self._lock:
+            self.commands.append(record)
+
+        duration = done - start
+        if record.verb != 'expose' and duration > self.slow:
+            log.warning("Slow plugin reply: {:s} took {:.2f} s".format(
+                command, duration))
+
+    def add_channel(self, sweep, channel, z, start, done):
+        with self._lock:
+            self.channels.append(ChannelRecord(sweep, channel, z, start, done))
+
+    def durations(self, verb=None):
+        """
+        Returns
+        -------
+        durations (array) : round trip time of the commands in seconds,
+            optionally only of those with the given verb.
+        """
+        with self._lock:
+            records = list(self.commands)
+        return np.array([r.done - r.start for r in records
+                         if verb is None or r.verb == verb])
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary (dict) : count, total, mean, p50, p95, p99 and max round trip
+            time in seconds for each verb.
+        """
+        summary = {}
+        for verb in sorted(set(r.verb for r in self.commands)):
+            d = self.durations(verb)
+            summary[verb] = dict(
+                count=int(d.size), total=float(d.sum()), mean=float(d.mean()),
+                p50=float(np.percentile(d, 50)),
+                p95=float(np.percentile(d, 95)),
+                p99=float(np.percentile(d, 99)),
+                max=float(d.max()))
+        return summary
+
+    def histograms(self, bins=20):
+        """
+        Returns
+        -------
+        histograms (dict) : for each verb, the `counts` per bin and the bin
+            `edges` of the round trip times in seconds (log spaced).
+        """
+        histograms = {}
+        for verb in sorted(set(r.verb for r in self.commands)):
+            d = self.durations(verb)
+            lo, hi = max(d.min(), 1e-6), max(d.max(), 2e-6)
+            counts, edges = np.histogram(
+                d, bins=np.logspace(np.log10(lo), np.log10(hi), bins + 1))
+            histograms[verb] = dict(counts=counts.tolist(),
+                                    edges=edges.tolist())
+        return histograms
+
+    def channel_breakdown(self):
+        """
+        Split the wall time of each channel, from the start of its setup to
+        the end of its exposure, into the time spent waiting for each verb.
+        Every command belongs to the last channel whose setup started before
+        it, so in the pipelined mode the setup of the next channel is not
+        counted twice.
+
+        Returns
+        -------
+        breakdown (list) : one dict per channel with the time per verb, the
+            `overhead` (wall time minus exposure) and the `idle` time outside
+            any command (settling, bookkeeping).
+        """
+        with self._lock:
+            commands = list(self.commands)
+            channels = sorted(self.channels, key=lambda c: c.start)
+
+        starts = np.array([c.start for c in channels])
+        busy = [dict.fromkeys(VERBS, 0.) for c in channels]
+
+        for r in commands:
+            i = np.searchsorted(starts, r.start, side='right') - 1
+            if i < 0 or r.start > channels[i].done:
+                continue
+            busy[i][r.verb] = busy[i].get(r.verb, 0.) + r.done - r.start
+
+        breakdown = []
+        for c, b in zip(channels, busy):
+            row = collections.OrderedDict(
+                [('sweep', c.sweep), ('channel', c.channel), ('z', c.z),
+                 ('wall', c.done - c.start)])
+            row.update((verb, b[verb]) for verb in VERBS)
+            row['overhead'] = row['wall'] - row['expose']
+            row['idle'] = max(row['wall'] - sum(b.values()), 0.)
+            breakdown.append(row)
+
+        return breakdown
+
+    def to_csv(self, filename):
+        """Write one line per command."""
+        with self._lock:
+            records = list(self.commands)
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(CommandRecord._fields)
+            writer.writerows(records)
+
+    def channels_to_csv(self, filename):
+        """Write the per-channel overhead breakdown."""
+        breakdown = self.channel_breakdown()
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            if breakdown:
+                writer.writerow(breakdown[0].keys())
+                writer.writerows(row.values() for row in breakdown)
+
+    def to_json(self, filename, bins=20):
+        """Write the summary, histograms and per-channel breakdown."""
+        with open(filename, 'w') as f:
+            json.dump(dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           summary=self.summary(),
+                           histograms=self.histograms(bins),
+                           channels=self.channel_breakdown()), f, indent=2)
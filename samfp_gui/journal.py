@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    Append-only scan journal used to resume interrupted scans.
+
+    Every scan writes one JSON object per line to a file named after its scan
+    ID (the FAPERSID keyword): a "start" entry with the plan and the settings
+    sent to the plugin, one "step" entry per exposed channel and an "end"
+    entry when the scan finishes, fails or is aborted. Resuming a scan keeps
+    appending to the same run; starting it again opens a new run with a new
+    "start" entry.
+"""
+
+from __future__ import print_function, division
+
+import glob
+import json
+import logging
+import os
+import time
+
+from . import scan
+from .plan import ScanPlan
+
+log = logging.getLogger("samfp.journal")
+
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), '.samfp_journal')
+
+
+class ScanJournal(object):
+
+    def __init__(self, scan_id, directory=None):
+        """
+        Parameters
+        ----------
+        scan_id (string) : the scan ID stored in the FAPERSID keyword.
+        directory (string) : where the journal files are kept. Defaults to
+            JOURNAL_DIR, as it is when the journal is created.
+        """
+        directory = directory or JOURNAL_DIR
+        self.scan_id = scan_id
+        self.directory = directory
+        self.path = os.path.join(directory, "{:s}.jsonl".format(scan_id))
+
+    def __repr__(self):
+        return "ScanJournal({:s})".format(self.scan_id)
+
+    @classmethod
+    def find(cls, directory=None):
+        """
+        Returns
+        -------
+        journals (list) : every scan journal in the directory, the most
+            recent first.
+        """
+        directory = directory or JOURNAL_DIR
+        paths = glob.glob(os.path.join(directory, "*.jsonl"))
+        paths.sort(key=os.path.getmtime, reverse=True)
+        return [cls(os.path.splitext(os.path.basename(path))[0], directory)
+                for path in paths]
+
+    @classmethod
+    def latest_unfinished(cls, directory=None):
+        """
+        Returns
+        -------
+        journal (ScanJournal) : the most recent scan that did not reach its
+            end, or None if there is none.
+        """
+        for journal in cls.find(directory):
+            if not journal.is_finished:
+                return journal
+
+        return None
+
+    @property
+    def entries(self):
+        """
+        The entries of the last run, skipping a truncated last line.
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    log.warning("Ignoring corrupted line in {:s}".format(
+                        self.path))
+
+        starts = [i for i, e in enumerate(entries) if e['type'] == 'start']
+        return entries[starts[-1]:] if starts else []
+
+    @property
+    def is_finished(self):
+        return any(e['type'] == 'end' and e['status'] == 'done'
+                   for e in self.entries)
+
+    def completed(self):
+        """
+        Returns
+        -------
+        steps (set) : the (sweep, channel) pairs already exposed.
+        """
+        return set((e['sweep'], e['channel'])
+                   for e in self.entries if e['type'] == 'step')
+
+    def start_entry(self):
+        entries = self.entries
+        if not entries:
+            raise ValueError("{:s} has no start entry.".format(self.path))
+        return entries[0]
+
+    def plan(self):
+        """Rebuild the plan of the scan."""
+        return ScanPlan.from_dict(self.start_entry()['plan'])
+
+    def restore(self):
+        """
+        Send again every setting recorded when the scan started so the
+        remaining channels get the same headers.
+
+        Returns
+        -------
+        entry (dict) : the start entry.
+        """
+        entry = self.start_entry()
+        scan.invalidate_remote_state()
+        with scan.batch():
+            for prefix, key, value in entry['settings']:
+                if prefix == 'dhe dbs set':
+                    scan.set_dbs(key, value)
+                else:
+                    scan.set_dhe(key, value)
+        return entry
+
+    def write_start(self, plan, exptime, nframes, **kwargs):
+        """
+        Record the plan and the settings currently acknowledged by the plugin.
+        Any extra keyword argument is stored as well.
+        """
+        self._write(type='start', scan_id=self.scan_id,
+                    plan=plan.to_dict(),
+                    exptime=exptime, nframes=nframes,
+                    settings=scan.get_remote_state(), **kwargs)
+
+    def write_step(self, sweep, channel, z, **kwargs):
+        self._write(type='step', sweep=sweep, channel=channel, z=z, **kwargs)
+
+    def write_end(self, status, **kwargs):
+        self._write(type='end', status=status, **kwargs)
+
+    def _write(self, **entry):
+        entry['time'] = time.time()
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
@@ -1,4 +1,36 @@
 # -*- coding: utf-8 -*-
+"""
+    Fabry-Perot calibration quantities. Every function accepts scalars or
+    NumPy arrays and broadcasts them. Results computed from invalid inputs
+    (zero, negative or not finite) are masked: arrays come back as masked
+    arrays and scalars as numpy.ma.masked.
+"""
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from . import sequence
+
+
+def _masked(values, *inputs):
+    """
+    Mask the values computed from non-positive or non-finite inputs.
+
+    Returns
+    -------
+    values (float, masked array or numpy.ma.masked)
+    """
+    values = np.asarray(values, dtype=float)
+    invalid = ~np.isfinite(values)
+    for x in inputs:
+        x = np.ma.filled(np.ma.asarray(x, dtype=float), np.nan)
+        invalid = invalid | ~(x > 0) | ~np.isfinite(x)
+
+    result = np.ma.masked_array(values, mask=invalid)
+    if result.ndim:
+        return result
+    return np.ma.masked if invalid else float(values)
 
 
 def calc_order(wavelength, gap_size):
@@ -7,18 +39,16 @@ def calc_order(wavelength, gap_size):
 
     Parameters
     ----------
-    wavelength (float):
-    gap_size (float):
+    wavelength (float or array) : in Angstrom.
+    gap_size (float or array) : the distance between the plates in microns.
 
     Returns
     -------
-    order (float)
+    order (float or masked array)
     """
-    try:
-        foo = 2 * (gap_size * 1e-6) / (wavelength * 1e-10)
-    except ZeroDivisionError as e:
-        foo = -1
-    return
+    with np.errstate(divide='ignore', invalid='ignore'):
+        order = sequence.interference_order(wavelength, gap_size)
+    return _masked(order, wavelength, gap_size)
 
 
 def calc_finesse(fsr, fwhm):
@@ -27,22 +57,20 @@ def calc_finesse(fsr, fwhm):
 
     Parameters
     ----------
-    FSR (float) : free-spectral-range in BCV or A
-    FWHM (float) : full-width-at-half-maximum in BCV or A
+    FSR (float or array) : free-spectral-range in BCV or A
+    FWHM (float or array) : full-width-at-half-maximum in BCV or A
 
     Returns
     -------
-    F (float) : the finesse
+    F (float or masked array) : the finesse
 
     Observations
     ------------
     Both FSR and FWHM have to have same units.
     """
-    try:
-        foo = float(fsr) / float(fwhm)
-    except ZeroDivisionError as e:
-        foo = -1
-    return foo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        finesse = np.divide(fsr, fwhm, dtype=float)
+    return _masked(finesse, fsr, fwhm)
 
 
 def calc_queensgate_constant(wavelength, free_spectra_range_bcv):
@@ -51,16 +79,119 @@ def calc_queensgate_constant(wavelength, free_spectra_range_bcv):
 
     Parameters
     ----------
-    wavelength (float):
-    free_spectra_range_bcv (float):
+    wavelength (float or array) : the reference wavelength in Angstrom.
+    free_spectra_range_bcv (float or array) : the FSR at this wavelength in
+        BCV.
+
+    Returns
+    -------
+    queensgate_constant (float or masked array) : in Angstrom per BCV.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qgc = sequence.queensgate_constant(wavelength, free_spectra_range_bcv)
+    return _masked(qgc, wavelength, free_spectra_range_bcv)
 
 
+def calc_fsr_wavelength(wavelength, gap_size):
+    """
+    Returns the free spectral range in Angstrom.
+
+    Parameters
+    ----------
+    wavelength (float or array) : in Angstrom.
+    gap_size (float or array) : the distance between the plates in microns.
+
     Returns
     -------
-    queensgate_constant (float) :
+    fsr (float or masked array)
     """
-    try:
-        foo = wavelength / free_spectra_range_bcv
-    except ZeroDivisionError as e:
-        foo = -1
-    return foo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fsr = sequence.fsr_wavelength(
+            wavelength, sequence.interference_order(wavelength, gap_size))
+    return _masked(fsr, wavelength, gap_size)
+
+
+def calc_fsr_velocity(wavelength, gap_size):
+    """
+    Returns the free spectral range in km / s.
+
+    Parameters
+    ----------
+    wavelength (float or array) : in Angstrom.
+    gap_size (float or array) : the distance between the plates in microns.
+
+    Returns
+    -------
+    fsr (float or masked array)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fsr = sequence.fsr_velocity(
+            wavelength, sequence.interference_order(wavelength, gap_size))
+    return _masked(fsr, wavelength, gap_size)
+
+
+def calc_fsr_bcv(wavelength, queensgate_constant):
+    """
+    Returns the free spectral range in BCV.
+
+    Parameters
+    ----------
+    wavelength (float or array) : in Angstrom.
+    queensgate_constant (float or array) : in Angstrom per BCV.
+
+    Returns
+    -------
+    fsr (float or masked array)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fsr = sequence.fsr_bcv(wavelength, queensgate_constant)
+    return _masked(fsr, wavelength, queensgate_constant)
+
+
+def calc_resolution(wavelength, gap_size, finesse):
+    """
+    Returns the spectral resolution, the wavelength over the FWHM.
+
+    Parameters
+    ----------
+    wavelength (float or array) : in Angstrom.
+    gap_size (float or array) : the distance between the plates in microns.
+    finesse (float or array) : the effective finesse.
+
+    Returns
+    -------
+    resolution (float or masked array)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fsr = sequence.fsr_wavelength(
+            wavelength, sequence.interference_order(wavelength, gap_size))
+        resolution = np.asarray(wavelength) * finesse / fsr
+    return _masked(resolution, wavelength, gap_size, finesse)
+
+
+def calc_n_channels(finesse, sample_factor=2., overscan_factor=1.):
+    """
+    Returns the number of channels to scan.
+
+    Parameters
+    ----------
+    finesse (float or array) : the effective finesse.
+    sample_factor (float or array) : channels per FWHM.
+    overscan_factor (float or array) : the number of FSR to scan.
+
+    Returns
+    -------
+    n_channels (int or masked array)
+    """
+    inputs = (finesse, sample_factor, overscan_factor)
+    values = np.broadcast_arrays(*[
+        np.ma.filled(np.ma.asarray(x, dtype=float), np.nan) for x in inputs])
+    valid = np.isfinite(values[0] * values[1] * values[2])
+
+    n = sequence.n_channels(*[np.where(valid, x, 0) for x in values])
+    n = _masked(n, *inputs)
+    if n is np.ma.masked:
+        return n
+    if np.ma.isMaskedArray(n):
+        return n.astype(int)
+    return int(n)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+    Stand-in for the SAM-FP plugin that runs on SAMI's machine. It speaks the
+    same text protocol so scans can be exercised off the mountain.
+
+    by Bruno Quint
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import logging
+import socket
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import protocol
+
+log = logging.getLogger("samfp.mock")
+
+
+class PluginState(object):
+
+    def __init__(self, move_delay=0., move_delay_per_bcv=0.,
+                 settle_delay=0., settle_delay_per_bcv=0.,
+                 exposure_delay=None, readout_delay=0., sleep=time.sleep,
+                 clock=time.monotonic, poll_interval=0.01):
+        """
+        Everything the plugin remembers between commands and how long each
+        command takes to be answered.
+
+        Parameters
+        ----------
+        move_delay (float) : seconds spent on every `fp moveabs`.
+        move_delay_per_bcv (float) : extra seconds per BCV of the FP jump.
+        settle_delay (float) : seconds the FP reports it is still moving
+            after a move was acknowledged.
+        settle_delay_per_bcv (float) : extra settle seconds per BCV.
+        exposure_delay (float) : seconds spent exposing each frame. If None,
+            the `obs.exptime` set through `dhe set` is used.
+        readout_delay (float) : seconds spent reading out each frame.
+        sleep (callable) : function used to wait.
+        clock (callable) : function that returns the current time.
+        poll_interval (float) : seconds between two checks for a `dhe abort`
+            while exposing.
+        """
+        self.move_delay = move_delay
+        self.move_delay_per_bcv = move_delay_per_bcv
+        self.exposure_delay = exposure_delay
+        self.readout_delay = readout_delay
+        self.settle_delay = settle_delay
+        self.settle_delay_per_bcv = settle_delay_per_bcv
+        self.sleep = sleep
+        self.clock = clock
+        self.poll_interval = poll_interval
+
+        self.z = 0
+        self.settled_at = 0
+        self.dhe = {}
+        self.dbs = {}
+        self.n_commands = 0
+        self.n_exposures = 0
+        self.n_aborts = 0
+        self.aborted = False
+
+        self._lock = threading.Lock()
+
+    @property
+    def exptime(self):
+        if self.exposure_delay is not None:
+            return self.exposure_delay
+        return float(self.dhe.get('obs.exptime', 0))
+
+    @property
+    def nimages(self):
+        return int(self.dhe.get('obs.nimages', 1))
+
+    def handle(self, command):
+        """
+        Execute a single command.
+
+        Parameters
+        ----------
+        command (string) : the command as received, without the line break.
+
+        Returns
+        -------
+        message (string) : DONE if successful or ERROR followed by the reason.
+        """
+        words = command.split()
+        lower = [w.lower() for w in words]
+
+        with self._lock:
+            self.n_commands += 1
+
+        if lower[:3] == ['dhe', 'dbs', 'set'] and len(words) > 4:
+            with self._lock:
+                self.dbs[words[3]] = " ".join(words[4:])
+            return "DONE"
+
+        if lower[:2] == ['dhe', 'set'] and len(words) > 3:
+            with self._lock:
+                self.dhe[words[2]] = " ".join(words[3:])
+            return "DONE"
+
+        if lower[:2] == ['fp', 'moveabs'] and len(words) == 3:
+            return self.moveabs(words[2])
+
+        if lower == ['fp', 'status']:
+            return self.status()
+
+        if lower == ['dhe', 'expose']:
+            return self.expose()
+
+        if lower == ['dhe', 'abort']:
+            return self.abort()
+
+        return "ERROR: unknown command {:s}".format(command)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            self.n_aborts += 1
+        return "DONE"
+
+    def expose(self):
+        with self._lock:
+            self.aborted = False
+        for frame in range(self.nimages):
+            if not self._wait(self.exptime):
+                return "ERROR: exposure aborted"
+            self.sleep(self.readout_delay)
+        with self._lock:
+            self.n_exposures += 1
+        return "DONE"
+
+    def _wait(self, seconds):
+        """
+        Sleep in short slices so `dhe abort` can interrupt it.
+
+        Returns
+        -------
+        completed (bool) : False if the wait was aborted.
+        """
+        t_end = self.clock() + seconds
+        while not self.aborted:
+            remaining = t_end - self.clock()
+            if remaining <= 0:
+                return True
+            self.sleep(min(remaining, self.poll_interval))
+        return False
+
+    def moveabs(self, value):
+        try:
+            z = int(value)
+        except ValueError:
+            return "ERROR: invalid BCV value {:s}".format(value)
+
+        if 4095 < z or z < 0:
+            return "ERROR: z must be between 0 and 4095"
+
+        jump = abs(z - self.z)
+        self.sleep(self.move_delay + self.move_delay_per_bcv * jump)
+        with self._lock:
+            self.z = z
+            self.settled_at = self.clock() + self.settle_delay + \
+                self.settle_delay_per_bcv * jump
+        return "DONE"
+
+    def status(self):
+        if self.clock() < self.settled_at:
+            return "MOVING {:d}".format(self.z)
+        return "STABLE {:d}".format(self.z)
+
+
+class MockPlugin(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="localhost", port=8888, connect_delay=0.,
+                 split_replies=False, one_shot=False, idle_timeout=None,
+                 state=None, **kwargs):
+        """
+        TCP server that answers the SAM-FP plugin protocol, one command per
+        line, using a PluginState.
+
+        Parameters
+        ----------
+        host (string) : interface to listen on.
+        port (int) : port to listen on. Use 0 to pick a free one.
+        connect_delay (float) : seconds to wait before serving a new client.
+        split_replies (bool) : send every reply in two TCP segments, to
+            exercise the framing of the clients.
+        one_shot (bool) : answer a single command per connection, without
+            line terminator, and close it, like a plugin written for one
+            connection per command.
+        idle_timeout (float) : optional. Close a connection that sent no
+            command for this many seconds.
+        state (PluginState) : optional. Shared plugin state. Any other
+            keyword argument is used to create one.
+        """
+        self.connect_delay = connect_delay
+        self.split_replies = split_replies
+        self.one_shot = one_shot
+        self.idle_timeout = idle_timeout
+        self.state = state if state is not None else PluginState(**kwargs)
+        self._thread = None
+
+        socketserver.TCPServer.__init__(self, (host, port), _PluginHandler)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log.debug("Mock plugin listening on {:s}:{:d}".format(
+            self.host, self.port))
+
+    def stop(self):
+        """Stop serving and release the port."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class _PluginHandler(socketserver.StreamRequestHandler):
+
+    # Replies to pipelined commands go out as soon as they are ready
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        time.sleep(self.server.connect_delay)
+        self.connection.settimeout(self.server.idle_timeout)
+
+        try:
+            self._serve()
+        except socket.timeout:
+            log.debug("Closing an idle connection")
+
+    def _serve(self):
+
+        for line in self.rfile:
+            command = line.decode().strip()
+            if not command:
+                continue
+
+            message = self.server.state.handle(command)
+            log.debug("{:s} - {:s}".format(command, message))
+
+            if self.server.one_shot:
+                data = message.encode()
+            else:
+                data = protocol.encode(message)
+            if self.server.split_replies:
+                self.wfile.write(data[:2])
+                self.wfile.flush()
+                time.sleep(0.001)
+                data = data[2:]
+            self.wfile.write(data)
+            self.wfile.flush()
+            if self.server.one_shot:
+                break
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Stand-in for the SAM-FP plugin.")
+    parser.add_argument('--host', default="localhost")
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--connect-delay', type=float, default=0.,
+                        help="seconds before a new client is served")
+    parser.add_argument('--move-delay', type=float, default=0.,
+                        help="seconds spent on every FP move")
+    parser.add_argument('--move-delay-per-bcv', type=float, default=0.,
+                        help="extra seconds per BCV of the FP jump")
+    parser.add_argument('--settle-delay', type=float, default=0.,
+                        help="seconds the FP takes to settle after a move")
+    parser.add_argument('--settle-delay-per-bcv', type=float, default=0.,
+                        help="extra settle seconds per BCV of the FP jump")
+    parser.add_argument('--exposure-delay', type=float, default=None,
+                        help="seconds per frame (default: obs.exptime)")
+    parser.add_argument('--readout-delay', type=float, default=0.,
+                        help="seconds to read out each frame")
+    parser.add_argument('--split-replies', action='store_true',
+                        help="send every reply in two TCP segments")
+    parser.add_argument('--one-shot', action='store_true',
+                        help="close the connection after every reply, "
+                             "sent without line terminator")
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help="seconds before an idle connection is closed")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    log.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    server = MockPlugin(args.host, args.port,
+                        connect_delay=args.connect_delay,
+                        split_replies=args.split_replies,
+                        one_shot=args.one_shot,
+                        idle_timeout=args.idle_timeout,
+                        move_delay=args.move_delay,
+                        move_delay_per_bcv=args.move_delay_per_bcv,
+                        settle_delay=args.settle_delay,
+                        settle_delay_per_bcv=args.settle_delay_per_bcv,
+                        exposure_delay=args.exposure_delay,
+                        readout_delay=args.readout_delay)
+
+    log.info("Mock plugin listening on {:s}:{:d}".format(
+        server.host, server.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
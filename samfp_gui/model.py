@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    Parameter model of the GUI: every value of the forms, kept apart from the
+    widgets so a whole configuration is loaded, compared or saved at once.
+"""
+
+from __future__ import print_function, division
+
+import configparser
+import contextlib
+import logging
+
+from .sequence import MAX_JUMP
+
+log = logging.getLogger("samfp.model")
+
+# (section, option, widget, type). The widget is the attribute path from the
+# central widget; the section and option are those of the .cfg files.
+FIELDS = [
+    ('file', 'basename', 'basename', str),
+    ('file', 'path', 'path', str),
+
+    ('obs', 'binning', 'binning', str),
+    ('obs', 'comment', 'comment', str),
+    ('obs', 'exptime', 'exp_time', float),
+    ('obs', 'nframes', 'n_frames', int),
+    ('obs', 'title', 'target_name', str),
+    ('obs', 'type', 'obs_type', str),
+    ('obs', 'pipelined', 'pipelined', bool),
+
+    ('fp', 'name', 'fp', str),
+    ('fp', 'gap_size', 'fp_gap_size', float),
+    ('fp', 'maxjump', 'max_jump', int),
+
+    ('scan', 'id', 'page_scan.id', str),
+]
+
+for _section, _page in [('scan', 'page_scan'), ('calib', 'page_calibration'),
+                        ('science', 'page_science')]:
+    FIELDS += [
+        (_section, 'nchannels', _page + '.n_channels', int),
+        (_section, 'nsweeps', _page + '.n_sweeps', int),
+        (_section, 'zstart', _page + '.z_start', float),
+        (_section, 'zstep', _page + '.z_step', float),
+    ]
+
+for _section, _page in [('calib', 'page_calibration'),
+                        ('science', 'page_science')]:
+    FIELDS += [
+        (_section, 'ref_wav', _page + '.ref_wavelength', float),
+        (_section, 'fsr', _page + '.fsr', float),
+        (_section, 'fwhm', _page + '.fwhm', float),
+        (_section, 'finess', _page + '.finesse', float),
+        (_section, 'qgc', _page + '.queensgate_constant', float),
+        (_section, 'sample', _page + '.sample_factor', float),
+        (_section, 'overscan', _page + '.overscan_factor', float),
+    ]
+
+FIELDS += [
+    ('science', 'rest_wav', 'page_science.rest_wavelength', float),
+    ('science', 'combo_box', 'page_science.combo_box', str),
+    ('science', 'fsr_obs', 'page_science.sci_fsr', float),
+]
+
+# Options with a default, for files saved by older versions
+DEFAULTS = {('obs', 'pipelined'): False, ('fp', 'maxjump'): MAX_JUMP,
+            ('gui', 'async'): False}
+
+# The science page shows one of these as its input and computes the others
+REDSHIFT = ('science', 'redshift')
+VELOCITY = ('science', 'velocity')
+OBSERVED = ('science', 'obs_wav')
+SCIENCE_INPUTS = {
+    "Redshift": REDSHIFT,
+    "Observed wavelength [A]": OBSERVED,
+    "Systemic velocity [km / s]": VELOCITY,
+}
+
+GUI_FIELDS = [('gui', 'active_page', int), ('gui', 'async', bool)]
+
+
+def _get(cfg, section, option, kind):
+    fallback = DEFAULTS.get((section, option))
+    kwargs = {} if fallback is None else dict(fallback=fallback)
+    if kind is bool:
+        return cfg.getboolean(section, option, **kwargs)
+    if kind is int:
+        # Integers are sometimes saved as floats, e.g. "1024.0"
+        return int(cfg.getfloat(section, option, **kwargs))
+    if kind is float:
+        return cfg.getfloat(section, option, **kwargs)
+    return cfg.get(section, option, **kwargs)
+
+
+@contextlib.contextmanager
+def signals_blocked(widgets):
+    """
+    Block the Qt signals of the given widgets (the line edits, combo boxes
+    and check boxes behind the custom widgets) inside the block.
+    """
+    blocked = []
+    for widget in widgets:
+        for name in ('line_edit', 'combo_box', 'check_box'):
+            qt_widget = getattr(widget, name, None)
+            if qt_widget is not None:
+                blocked.append((qt_widget, qt_widget.blockSignals(True)))
+    try:
+        yield
+    finally:
+        for qt_widget, previous in reversed(blocked):
+            qt_widget.blockSignals(previous)
+
+
+class ParameterModel(object):
+
+    def __init__(self, values=None):
+        """
+        All the parameters of the forms, keyed by (section, option) as in
+        the configuration files. `bind` attaches the model to the widgets;
+        `apply` then writes every value at once with the widget signals
+        blocked and recomputes the derived fields once, and `read` takes
+        the values back from the widgets.
+
+        Parameters
+        ----------
+        values (dict) : optional. The initial values.
+        """
+        self.values = dict(values or {})
+        self._widgets = []
+        self._central = None
+
+    def __eq__(self, other):
+        return isinstance(other, ParameterModel) and \
+            self.values == other.values
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return ParameterModel(self.values)
+
+    def bind(self, central):
+        """
+        Parameters
+        ----------
+        central (MyCentralWidget) : holds the widgets named in FIELDS.
+        """
+        self._central = central
+        self._widgets = []
+        for section, option, path, kind in FIELDS:
+            widget = central
+            for name in path.split('.'):
+                widget = getattr(widget, name)
+            self._widgets.append((section, option, widget, kind))
+
+    def load(self, cfg):
+        """
+        Replace every value by those of a configuration file. They are all
+        read before any is replaced, so a file missing an option leaves the
+        model as it was.
+
+        Parameters
+        ----------
+        cfg (configparser.RawConfigParser) : a parsed configuration file.
+
+        Raises
+        ------
+        configparser.Error : if a section or an option is missing.
+
+        Returns
+        -------
+        model (ParameterModel) : this model.
+        """
+        values = {}
+        for section, option, path, kind in FIELDS:
+            values[(section, option)] = _get(cfg, section, option, kind)
+        for section, option, kind in GUI_FIELDS:
+            values[(section, option)] = _get(cfg, section, option, kind)
+        for key in (REDSHIFT, VELOCITY, OBSERVED):
+            values[key] = _get(cfg, key[0], key[1], float)
+        self.values = values
+        return self
+
+    def to_config(self):
+        """
+        Returns
+        -------
+        cfg (configparser.RawConfigParser)
+        """
+        cfg = configparser.RawConfigParser()
+        for (section, option), value in self.values.items():
+            if not cfg.has_section(section):
+                cfg.add_section(section)
+            cfg.set(section, option, str(value))
+        return cfg
+
+    def read(self):
+        """
+        Take the current values from the widgets.
+
+        Returns
+        -------
+        model (ParameterModel) : this model.
+        """
+        values = {}
+        for section, option, widget, kind in self._widgets:
+            values[(section, option)] = kind(widget())
+
+        central = self._central
+        values[('gui', 'active_page')] = central.notebook.currentIndex()
+        values[('gui', 'async')] = central.run_async
+
+        # The input of the science page is one of the three, the outputs
+        # hold the other two, redshift first and velocity last
+        sci_page = central.page_science
+        first = SCIENCE_INPUTS.get(sci_page.combo_box(), VELOCITY)
+        others = [k for k in (REDSHIFT, OBSERVED, VELOCITY) if k != first]
+        values[first] = sci_page.input()
+        values[others[0]] = sci_page.output_1()
+        values[others[1]] = sci_page.output_2()
+
+        self.values = values
+        return self
+
+    def apply(self):
+        """
+        Write every value to the widgets in one batch. No widget signal is
+        emitted meanwhile; the outputs of the science page are recomputed
+        once at the end.
+        """
+        central = self._central
+        values = self.values
+
+        with signals_blocked([w for _, _, w, _ in self._widgets] +
+                             [central.page_science.input]):
+            for section, option, widget, kind in self._widgets:
+                if (section, option) in values:
+                    widget(values[(section, option)])
+
+            sci_page = central.page_science
+            key = SCIENCE_INPUTS.get(sci_page.combo_box(), VELOCITY)
+            if key in values:
+                sci_page.input(values[key])
+
+        central.notebook.setCurrentIndex(
+            values.get(('gui', 'active_page'), 0))
+        central.run_async = values.get(('gui', 'async'), False)
+
+        # Derived fields, once
+        central.page_science.on_combobox_change()
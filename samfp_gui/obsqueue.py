@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+    Observation queue: scans (calibrations, science, darks) run back to back
+    by the same ScanEngine the GUI uses. The queue is saved after every
+    change, so it survives a restart, and every item keeps its status.
+    Nothing here imports Qt.
+"""
+
+from __future__ import print_function, division
+
+import json
+import logging
+import os
+import threading
+
+from . import runner
+from .cancel import Cancelled
+from .config import ScanConfig
+
+log = logging.getLogger("samfp.obsqueue")
+
+QUEUE_FILE = os.path.join(os.path.expanduser("~"), '.samfp_queue.json')
+
+STATUSES = ['pending', 'running', 'done', 'aborted', 'failed']
+
+
+class QueueItem(object):
+
+    def __init__(self, config, name='', status='pending', scan_id=None):
+        """
+        A scan waiting in the queue, or that went through it.
+
+        Parameters
+        ----------
+        config (ScanConfig) : the scan to run.
+        name (string) : shown in the queue. Defaults to the image type and
+            the target name.
+        status (string) : one of STATUSES.
+        scan_id (string) : the FAPERSID of the scan once it started.
+        """
+        if status not in STATUSES:
+            raise ValueError("Status must be one of {}. Got {:s}.".format(
+                STATUSES, status))
+        self.config = config
+        self.name = name or " ".join(
+            s for s in [config.image_type, config.title] if s)
+        self.status = status
+        self.scan_id = scan_id
+
+    def __repr__(self):
+        return "QueueItem({!r}, status={:s})".format(self.name, self.status)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(ScanConfig.from_dict(d['config']), d.get('name', ''),
+                   d.get('status', 'pending'), d.get('scan_id'))
+
+    def to_dict(self):
+        return dict(name=self.name, status=self.status, scan_id=self.scan_id,
+                    config=self.config.to_dict())
+
+
+class ObservationQueue(object):
+
+    def __init__(self, filename=QUEUE_FILE):
+        """
+        An ordered list of QueueItem saved to `filename`, as JSON, after
+        every change. Items can be added, removed and moved while the queue
+        runs, from any thread; the running item can only be aborted.
+
+        Parameters
+        ----------
+        filename (string) : where the queue is kept. None keeps it in
+            memory only.
+        """
+        self.filename = filename
+        self._items = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._items))
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    @classmethod
+    def load(cls, filename=QUEUE_FILE):
+        """
+        Read a saved queue, or start an empty one if there is none. An item
+        that was running when the queue was saved is marked as aborted: its
+        journal lets `samfp-scan --resume` or the Resume button finish it.
+        """
+        queue = cls(filename)
+        if filename is None or not os.path.exists(filename):
+            return queue
+
+        with open(filename) as f:
+            items = json.load(f)['items']
+
+        for d in items:
+            try:
+                item = QueueItem.from_dict(d)
+            except (KeyError, TypeError, ValueError) as error:
+                log.warning("Skipping a queued scan: {}".format(error))
+                continue
+            if item.status == 'running':
+                item.status = 'aborted'
+            queue._items.append(item)
+
+        return queue
+
+    def save(self):
+        if self.filename is None:
+            return
+        with self._lock:
+            text = json.dumps(dict(items=[i.to_dict() for i in self._items]),
+                              indent=2)
+        # Never leave a half written queue behind
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(text)
+        os.replace(temp, self.filename)
+
+    def add(self, config, name=''):
+        """
+        Append a scan to the queue.
+
+        Returns
+        -------
+        item (QueueItem)
+        """
+        item = QueueItem(config, name)
+        with self._lock:
+            self._items.append(item)
+        self.save()
+        return item
+
+    def remove(self, index):
+        """
+        Raises
+        ------
+        ValueError : if the item is running.
+        """
+        with self._lock:
+            if self._items[index].status == 'running':
+                raise ValueError("A running scan cannot be removed.")
+            del self._items[index]
+        self.save()
+
+    def move(self, index, new_index):
+        """Move an item to a new position."""
+        with self._lock:
+            new_index = min(max(new_index, 0), len(self._items) - 1)
+            self._items.insert(new_index, self._items.pop(index))
+        self.save()
+
+    def reset(self, index):
+        """
+        Queue an item again, e.g. after it was aborted.
+
+        Raises
+        ------
+        ValueError : if the item is running.
+        """
+        with self._lock:
+            item = self._items[index]
+            if item.status == 'running':
+                raise ValueError("A running scan cannot be reset.")
+            item.status, item.scan_id = 'pending', None
+        self.save()
+
+    def next_pending(self, after=None):
+        """
+        Returns
+        -------
+        item (QueueItem) : the first pending item, or the first one behind
+            `after`, or None if there is none.
+        """
+        with self._lock:
+            items = self._items
+            if after is not None:
+                items = items[items.index(after) + 1:] \
+                    if after in items else []
+            for item in items:
+                if item.status == 'pending':
+                    return item
+        return None
+
+    def set_status(self, item, status, scan_id=None):
+        with self._lock:
+            item.status = status
+            if scan_id is not None:
+                item.scan_id = scan_id
+        self.save()
+
+
+class QueueRunner(object):
+
+    def __init__(self, queue, settle=None, cancel=None, overlap=True):
+        """
+        Run the pending items of a queue one after the other, in the order
+        they have when each one starts.
+
+        With `overlap`, the FP moves to the first channel of the next scan,
+        and settles, while the last channel of the current scan is read
+        out. The settings and header keywords of the next scan are only
+        sent once the readout is over, as the engine does between channels.
+        This only happens when the current scan is pipelined, i.e. when the
+        observer allows the FP to move during its readouts.
+
+        Parameters
+        ----------
+        queue (ObservationQueue) : the scans to run.
+        settle (SettleModel or float) : optional. Defaults to the saved model.
+        cancel (CancelToken) : optional. Cancelling it aborts the scan in
+            progress and the queue.
+        overlap (bool) : set the next scan up during the last readout.
+        """
+        self.queue = queue
+        self.settle = settle
+        self.cancel = cancel
+        self.overlap = overlap
+
+        self.on_item = None
+        self.on_step = None
+        self._engine = None
+        self._prepared = None
+        self._stop_requested = False
+
+    def run(self):
+        """
+        Returns
+        -------
+        n_done (int) : the number of scans that reached their end.
+        """
+        n_done = 0
+        item = None
+        while not self._stop_requested:
+            item = self.queue.next_pending()
+            if item is None:
+                break
+
+            try:
+                engine = self._engine_for(item)
+            except (IOError, ValueError) as error:
+                log.error("Could not start {!r}: {}".format(item.name, error))
+                self._set_status(item, 'failed')
+                continue
+            except Cancelled:
+                break
+
+            self._engine = engine
+            self._set_status(item, 'running', engine.journal.scan_id)
+            if self.on_step is not None:
+                engine.on_step = \
+                    lambda *args, item=item: self.on_step(item, *args)
+            if self.overlap and engine.pipelined:
+                engine.on_final_readout = \
+                    lambda item=item: self._prepare_next(item)
+
+            try:
+                n = engine.run()
+            finally:
+                self._engine = None
+
+            if n == len(engine.plan):
+                self._set_status(item, 'done')
+                n_done += 1
+            else:
+                # Aborted, or stopped after an exposure failed
+                self._set_status(
+                    item, 'aborted' if engine.cancel.is_cancelled
+                    or self._stop_requested else 'failed')
+                break
+
+        self._prepared = None
+        return n_done
+
+    def abort(self):
+        """Abort the scan in progress and stop the queue. Never blocks."""
+        self._stop_requested = True
+        engine = self._engine
+        if engine is not None:
+            engine.abort()
+        if self.cancel is not None:
+            self.cancel.cancel()
+
+    def stop(self):
+        """Stop the queue once the current scan is finished."""
+        self._stop_requested = True
+
+    def _set_status(self, item, status, scan_id=None):
+        self.queue.set_status(item, status, scan_id)
+        if self.on_item is not None:
+            self.on_item(item)
+
+    def _engine_for(self, item):
+        # The FP may have been moved to its first channel during the last
+        # readout, if the queue was not reordered since. Its settings are
+        # only sent now that the previous scan is over.
+        prepared, self._prepared = self._prepared, None
+        if prepared is not None and prepared[0] is item:
+            engine = prepared[1]
+            engine.journal = runner.start_journal(item.config)
+            return engine
+        return runner.prepare(item.config, settle=self.settle,
+                              cancel=self.cancel)
+
+    def _prepare_next(self, item):
+        """Called by the engine during the last readout of `item`."""
+        following = self.queue.next_pending(after=item)
+        if following is None:
+            return
+        try:
+            engine = runner.build_engine(following.config,
+                                         settle=self.settle,
+                                         cancel=self.cancel)
+            engine.setup_first()
+        except (IOError, ValueError) as error:
+            # It is set up again when its turn comes
+            log.warning("Could not set up {!r} in advance: {}".format(
+                following.name, error))
+            return
+        self._prepared = following, engine
+        log.debug("Moved the FP for {!r} during the last readout.".format(
+            following.name))
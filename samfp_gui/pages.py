@@ -2,10 +2,14 @@
 from __future__ import print_function, division
 
 from PyQt5 import QtCore, QtWidgets
-from numpy import sqrt
+from numpy import divide, errstate, isfinite, nan, sqrt
+from numpy.ma import filled, masked
 
 from .custom_widgets import ComboBox, FloatTField, IntTField, TextTField, HLine
-from .methods import calc_finesse, calc_queensgate_constant
+from .graph import Graph
+from .methods import calc_finesse, calc_fsr_bcv, calc_n_channels, \
+    calc_queensgate_constant
+from .sequence import SPEED_OF_LIGHT, bcv_step
 
 
 class PageScan(QtWidgets.QWidget):
@@ -141,10 +145,18 @@ class PageCalibrationScan(PageScan):
 
     def get_finesse(self):
         f = calc_finesse(self.fsr(), self.fwhm())
+        if f is masked:
+            self.setStatusTip("Please check that the FSR and the FWHM are "
+                              "positive.")
+            return
         self.finesse(f)
 
     def get_queensgate_constant(self):
         f = calc_queensgate_constant(self.ref_wavelength(), self.fsr())
+        if f is masked:
+            self.setStatusTip("Please check that the reference wavelength "
+                              "and the FSR are positive.")
+            return
         self.queensgate_constant(f)
 
 class PageScienceScan(PageCalibrationScan):
@@ -165,7 +177,6 @@ class PageScienceScan(PageCalibrationScan):
         self.output_1 = FloatTField("Redshift", 0)
         self.output_2 = FloatTField("Systemic velocity [km / s]", 0)
         self.cal_outputs_button = QtWidgets.QPushButton("Update outputs")
-        self.on_combobox_change()
 
         #self.output_1.line_edit.setDisabled(True)
         #self.output_2.line_edit.setDisabled(True)
@@ -176,6 +187,20 @@ class PageScienceScan(PageCalibrationScan):
         self.sci_fsr = FloatTField("FSR for the observation [bcv]:", 0)
         self.sci_fsr.add_button("Get")
 
+        super(PageScienceScan, self).__init__()
+
+        # Derived quantities, recomputed only when one of their inputs
+        # changes
+        self.graph = science_graph()
+        self._inputs = [('rest_wavelength', self.rest_wavelength),
+                        ('value', self.input),
+                        ('qgc', self.queensgate_constant),
+                        ('finesse', self.finesse),
+                        ('sample', self.sample_factor),
+                        ('overscan', self.overscan_factor)]
+        self._refresh_pending = False
+        self.refresh()
+
         # Connect ---
         self.combo_box.combo_box.currentIndexChanged.connect(
             self.on_combobox_change
@@ -188,16 +213,13 @@ class PageScienceScan(PageCalibrationScan):
             self.on_combobox_change
         )
 
-        self.input.line_edit.returnPressed.connect(
-            self.on_combobox_change
-        )
+        for name, field in self._inputs:
+            field.line_edit.textChanged.connect(self.on_input_changed)
 
         self.sci_fsr.connect(
             self.calc_sci_fsr
         )
 
-        super(PageScienceScan, self).__init__()
-
     def initUI(self):
 
         grid1 = QtWidgets.QGridLayout()
@@ -249,66 +271,123 @@ class PageScienceScan(PageCalibrationScan):
         vbox.setSpacing(5)
         self.setLayout(vbox)
 
-    def calc_sci_fsr(self):
-        QGC = self.queensgate_constant()
-        try:
-            fsr = self.observed_wavelength / QGC
-        except ZeroDivisionError as e:
-            self.setStatusTip("Zero Division Error: Please check that the "
-                              "Queensgate Constant value is not 0.")
-            fsr = 0
-        self.sci_fsr(fsr)
-
-    def on_combobox_change(self):
-
-        # Wavelength emitted
-        w_emit = self.rest_wavelength()
-
-        # Light Speed [km / s]
-        c = 299792.458
-
-        if self.combo_box() == "Redshift":
-            z = self.input()
+    @property
+    def redshift(self):
+        return self.graph['redshift']
 
-            w_obs = w_emit * (1 + z)
-            self.output_1.set_label("Observed wavelength [A]:")
-            self.output_1(w_obs)
+    @property
+    def systemic_velocity(self):
+        return self.graph['velocity']
 
-            v = c * ((1 + z) ** 2 - 1) / ((1 + z) ** 2 + 1)
-            self.output_2.set_label("Systemic velocity [km / s]:")
-            self.output_2(v)
+    @property
+    def observed_wavelength(self):
+        return self.graph['observed_wavelength']
 
-        elif self.combo_box() == "Observed wavelength [A]":
-            w_obs = self.input()
+    def calc_sci_fsr(self):
+        self.refresh()
+        if not isfinite(self.graph['sci_fsr']):
+            self.setStatusTip("Zero Division Error: Please check that the "
+                              "Queensgate Constant value is positive.")
 
+    def on_combobox_change(self):
+        self.refresh()
+
+    def on_input_changed(self):
+        """
+        Called for every change of an input field. Several changes in a row
+        are applied together once Qt is back in its event loop.
+        """
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            QtCore.QTimer.singleShot(0, self.refresh)
+
+    def refresh(self):
+        """
+        Pass the input fields to the graph and show the derived values. Only
+        the quantities downstream of a changed input are recomputed.
+        """
+        self._refresh_pending = False
+
+        values = dict(mode=self.combo_box())
+        for name, field in self._inputs:
             try:
-                z = (w_obs - w_emit) / w_emit
-            except ZeroDivisionError:
-                z = 9999
-                self.setStatusTip(
-                    "Zero Division Error - "
-                    "Please, check the value of the emission line.")
-
-            self.output_1.set_label("Redshift:")
-            self.output_1(z)
-
-            v = c * ((1 + z) ** 2 - 1) / ((1 + z) ** 2 + 1)
-            self.output_2.set_label("Systemic velocity [km / s]:")
-            self.output_2(v)
-
+                values[name] = field()
+            except ValueError:
+                # Being edited, e.g. a lone minus sign
+                continue
+        self.graph.update(**values)
+
+        mode = self.graph['mode']
+        if mode == "Redshift":
+            outputs = [("Observed wavelength [A]:", 'observed_wavelength'),
+                       ("Systemic velocity [km / s]:", 'velocity')]
+        elif mode == "Observed wavelength [A]":
+            outputs = [("Redshift:", 'redshift'),
+                       ("Systemic velocity [km / s]:", 'velocity')]
         else:
-            v = self.input()
-
-            z = sqrt((1 + v / c) / (1 - v / c)) - 1
-            self.output_1.set_label("Redshift:")
-            self.output_1(z)
-
-            w_obs = w_emit * (1 + z)
-            self.output_2.set_label("Observed wavelength [A]:")
-            self.output_2(w_obs)
-
-        self.systemic_velocity = v
-        self.redshift = z
-        self.observed_wavelength = w_obs
-
-        return
\ No newline at end of file
+            outputs = [("Redshift:", 'redshift'),
+                       ("Observed wavelength [A]:", 'observed_wavelength')]
+
+        for field, (label, name) in zip([self.output_1, self.output_2],
+                                        outputs):
+            field.set_label(label)
+            field(self.graph[name])
+
+        if not isfinite(self.graph['redshift']):
+            self.setStatusTip("Zero Division Error - "
+                              "Please, check the value of the emission line.")
+
+        fsr = self.graph['sci_fsr']
+        self.sci_fsr(fsr if isfinite(fsr) else 0)
+
+
+def science_graph():
+    """
+    Returns
+    -------
+    graph (Graph) : the quantities of the science page, from the rest
+        wavelength, the input selected by `mode` and its `value`, and the
+        FP parameters.
+    """
+    graph = Graph()
+    graph.input('rest_wavelength', 6562.98)
+    graph.input('mode', "Observed wavelength [A]")
+    graph.input('value', 6562.98)
+    graph.input('qgc', 0.)
+    graph.input('finesse', 0.)
+    graph.input('sample', 2.)
+    graph.input('overscan', 1.)
+
+    @graph.derived('redshift', ['mode', 'value', 'rest_wavelength'])
+    def redshift(mode, value, w_emit):
+        with errstate(divide='ignore', invalid='ignore'):
+            if mode == "Redshift":
+                return float(value)
+            if mode == "Observed wavelength [A]":
+                return float(divide(value - w_emit, w_emit))
+            v = value / SPEED_OF_LIGHT
+            return float(sqrt(divide(1 + v, 1 - v)) - 1)
+
+    @graph.derived('observed_wavelength', ['rest_wavelength', 'redshift'])
+    def observed_wavelength(w_emit, z):
+        return w_emit * (1 + z)
+
+    @graph.derived('velocity', ['redshift'])
+    def velocity(z):
+        return SPEED_OF_LIGHT * ((1 + z) ** 2 - 1) / ((1 + z) ** 2 + 1)
+
+    @graph.derived('sci_fsr', ['observed_wavelength', 'qgc'])
+    def sci_fsr(w_obs, qgc):
+        return float(filled(calc_fsr_bcv(w_obs, qgc), nan))
+
+    @graph.derived('n_channels', ['finesse', 'sample', 'overscan'])
+    def n_channels(finesse, sample, overscan):
+        return calc_n_channels(finesse, sample, overscan)
+
+    @graph.derived('z_step', ['sci_fsr', 'finesse', 'sample'])
+    def z_step(fsr, finesse, sample):
+        if finesse <= 0 or sample <= 0:
+            return nan
+        return -float(bcv_step(fsr, finesse, sample))
+
+    return graph
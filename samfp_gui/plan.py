@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    Scan plans: the full table of FP positions a scan will visit, computed
+    and validated before the first command is sent.
+"""
+
+from __future__ import print_function, division
+
+import logging
+
+import numpy as np
+
+from . import sequence
+
+log = logging.getLogger("samfp.plan")
+
+Z_MIN = sequence.BCV_MIN
+Z_MAX = sequence.BCV_MAX
+
+PLAN_DTYPE = np.dtype([('sweep', int), ('channel', int), ('z', int)])
+
+
+class ScanPlan(object):
+
+    def __init__(self, z_start, z_step, n_channels, n_sweeps=1, clip=False,
+                 max_jump=None, jump_pause=sequence.JUMP_PAUSE):
+        """
+        Build the (sweep, channel, z) table of a scan. Every sweep starts at
+        `z_start` and moves `z_step` BCV per channel. Sweeps and channels are
+        counted from 1, as they are written to the headers.
+
+        If `max_jump` is given, every move larger than `max_jump` BCV,
+        including the flyback between sweeps, is preceded by intermediate
+        moves of at most `max_jump` BCV, each followed by a pause of
+        `jump_pause` seconds, as the CS100 requires.
+
+        Parameters
+        ----------
+        z_start (float) : the FP position of the first channel in BCV.
+        z_step (float) : the FP step between channels in BCV.
+        n_channels (int) : the number of channels per sweep.
+        n_sweeps (int) : the number of sweeps.
+        clip (bool) : if True, positions outside [Z_MIN, Z_MAX] are clipped
+            to the allowed range instead of rejecting the plan.
+        max_jump (int) : optional. The largest move the FP makes at once.
+        jump_pause (float) : seconds to wait after each intermediate move.
+
+        Raises
+        ------
+        ValueError : if the plan is empty or if any position is outside the
+            allowed range and `clip` is False.
+        """
+        n_channels = int(n_channels)
+        n_sweeps = int(n_sweeps)
+
+        if n_channels < 1 or n_sweeps < 1:
+            raise ValueError(
+                "A scan needs at least one channel and one sweep. "
+                "Got {:d} channels and {:d} sweeps.".format(
+                    n_channels, n_sweeps))
+
+        self.z_start = z_start
+        self.z_step = z_step
+        self.n_channels = n_channels
+        self.n_sweeps = n_sweeps
+        self.clip = clip
+        self.max_jump = max_jump
+        self.jump_pause = jump_pause
+
+        z = sequence.channel_positions(z_start, z_step, n_channels)
+
+        bad = (z < Z_MIN) | (z > Z_MAX)
+        if bad.any():
+            first = int(np.argmax(bad))
+            msg = "Channel {:d} at Z = {:d} is out of the allowed range " \
+                  "[{:d}, {:d}] ({:d} of {:d} channels).".format(
+                      first + 1, z[first], Z_MIN, Z_MAX, bad.sum(), n_channels)
+            if not clip:
+                raise ValueError(msg)
+            log.warning(msg + " Clipping.")
+            z = np.clip(z, Z_MIN, Z_MAX)
+
+        self.table = np.empty(n_channels * n_sweeps, dtype=PLAN_DTYPE)
+        self.table['sweep'] = np.repeat(np.arange(1, n_sweeps + 1), n_channels)
+        self.table['channel'] = np.tile(np.arange(1, n_channels + 1), n_sweeps)
+        self.table['z'] = np.tile(z, n_sweeps)
+
+        # The moves towards row i are moves[_bounds[i]:_bounds[i + 1]]
+        self.moves = sequence.substeps(self.table['z'], max_jump)
+        self._bounds = np.searchsorted(self.moves['step'],
+                                       np.arange(self.table.size + 1))
+
+    def __iter__(self):
+        for sweep, channel, z in self.table.tolist():
+            yield sweep, channel, z
+
+    def __len__(self):
+        return self.table.size
+
+    def __repr__(self):
+        return "ScanPlan(z_start={0.z_start}, z_step={0.z_step}, " \
+               "n_channels={0.n_channels}, n_sweeps={0.n_sweeps})".format(self)
+
+    @classmethod
+    def from_config(cls, cfg, section, clip=False,
+                    max_jump=sequence.MAX_JUMP):
+        """
+        Build a plan from a configuration file section containing the
+        `zstart`, `zstep`, `nchannels` and `nsweeps` options, and optionally
+        `maxjump` and `jumppause`.
+
+        Parameters
+        ----------
+        cfg (configparser.RawConfigParser) : the parsed configuration.
+        section (string) : the section that holds the scan parameters.
+        clip (bool) : clip out-of-range positions instead of rejecting them.
+        max_jump (int) : the largest move at once if the section has no
+            `maxjump`. 0 or None disables the intermediate moves.
+
+        Returns
+        -------
+        plan (ScanPlan)
+        """
+        return cls(cfg.getfloat(section, 'zstart'),
+                   cfg.getfloat(section, 'zstep'),
+                   cfg.getint(section, 'nchannels'),
+                   cfg.getint(section, 'nsweeps'),
+                   clip=clip,
+                   max_jump=cfg.getint(section, 'maxjump',
+                                       fallback=max_jump) or None,
+                   jump_pause=cfg.getfloat(section, 'jumppause',
+                                           fallback=sequence.JUMP_PAUSE))
+
+    @classmethod
+    def from_dict(cls, d):
+        """Build a plan from the dictionary returned by `to_dict`."""
+        return cls(d['z_start'], d['z_step'], d['n_channels'], d['n_sweeps'],
+                   clip=d.get('clip', False), max_jump=d.get('max_jump'),
+                   jump_pause=d.get('jump_pause', sequence.JUMP_PAUSE))
+
+    def to_dict(self):
+        """The parameters of the plan, e.g. to save it as JSON."""
+        return dict(z_start=self.z_start, z_step=self.z_step,
+                    n_channels=self.n_channels, n_sweeps=self.n_sweeps,
+                    clip=self.clip, max_jump=self.max_jump,
+                    jump_pause=self.jump_pause)
+
+    @property
+    def z(self):
+        """The FP positions of one sweep in BCV."""
+        return self.table['z'][:self.n_channels]
+
+    @property
+    def n_steps(self):
+        return self.table.size
+
+    def substeps(self, sweep, channel):
+        """
+        Returns
+        -------
+        z (list) : the intermediate positions to visit, in order, before
+            moving to the given channel. Empty if the move is small enough.
+        """
+        i = (sweep - 1) * self.n_channels + channel - 1
+        first, end = self._bounds[i], self._bounds[i + 1]
+        return self.moves['z'][first:end - 1].tolist()
+
+    @property
+    def n_moves(self):
+        """The number of moves, intermediate ones included."""
+        return self.moves.size
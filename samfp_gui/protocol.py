@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+    Codec of the SAM-FP plugin protocol: commands and replies are ASCII text
+    lines terminated by a line feed. Replies are DONE, ERROR followed by the
+    reason, or a status word followed by a value (e.g. STABLE 2048).
+"""
+
+from __future__ import print_function, division
+
+import collections
+
+TERMINATOR = b"\n"
+
+# Longest reply accepted before giving up on finding its terminator
+MAX_LINE = 65536
+
+
+class ProtocolError(IOError):
+    """Raised when the plugin sends something that is not a reply."""
+    pass
+
+
+class Template(object):
+
+    def __init__(self, fmt):
+        """
+        A command whose constant part is encoded once. Calling it fills the
+        %-style placeholders and returns the bytes to send, terminator
+        included.
+
+        Parameters
+        ----------
+        fmt (string) : the command with bytes %-style placeholders, e.g.
+            "fp moveabs %d".
+        """
+        self.fmt = fmt.encode() + TERMINATOR
+
+    def __repr__(self):
+        return "Template({!r})".format(self.fmt)
+
+    def __call__(self, *args):
+        return self.fmt % tuple(
+            a.encode() if isinstance(a, str) else a for a in args)
+
+
+EXPOSE = b"dhe expose\n"
+ABORT = b"dhe abort\n"
+FP_STATUS = b"fp status\n"
+FP_MOVEABS = Template("fp moveabs %d")
+DHE_SET = Template("dhe set %s %s")
+DBS_SET = Template("dhe dbs set %s %s")
+
+SETTINGS = {'dhe set': DHE_SET, 'dhe dbs set': DBS_SET}
+
+# Commands that leave the instrument in the same state when run twice, so
+# they may be sent again if the reply was lost. An exposure is not.
+IDEMPOTENT = ['dhe set', 'dhe dbs set', 'dhe abort', 'fp moveabs',
+              'fp status']
+
+
+def encode(command):
+    """
+    Parameters
+    ----------
+    command (string or bytes) : a command as text, or already encoded with
+        its terminator (e.g. by a Template).
+
+    Returns
+    -------
+    data (bytes) : what is written to the socket.
+    """
+    if isinstance(command, bytes):
+        return command
+    return command.encode() + TERMINATOR
+
+
+def subsystem(command):
+    """
+    Commands to different subsystems behind the plugin (the FP controller
+    and the DHE) do not depend on each other and may run concurrently.
+
+    Parameters
+    ----------
+    command (string or bytes) : a command as text or encoded.
+
+    Returns
+    -------
+    subsystem (string) : the first word of the command, e.g. "fp" or "dhe".
+    """
+    if isinstance(command, bytes):
+        return command.split(None, 1)[0].decode().lower()
+    return command.split(None, 1)[0].lower()
+
+
+def is_idempotent(command):
+    """
+    Parameters
+    ----------
+    command (string or bytes) : a command as text or encoded.
+
+    Returns
+    -------
+    idempotent (bool) : True if running the command twice does no harm.
+        Unknown commands are not.
+    """
+    text = " ".join(as_text(command).lower().split())
+    return any(text == c or text.startswith(c + " ") for c in IDEMPOTENT)
+
+
+def as_text(command):
+    """
+    Returns
+    -------
+    command (string) : the command as text, without the terminator.
+    """
+    if isinstance(command, bytes):
+        return command.rstrip(TERMINATOR).decode()
+    return command
+
+
+class LineBuffer(object):
+
+    def __init__(self):
+        """
+        Split a byte stream into lines. Chunks go in with `feed` as they are
+        received and complete lines come out of `next_line`, so a reply
+        split over several reads or several replies coalesced in one read
+        are both handled.
+        """
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def clear(self):
+        """Forget any partial line, e.g. after the socket was reopened."""
+        del self._buffer[:]
+
+    def feed(self, data):
+        """
+        Raises
+        ------
+        ProtocolError : if the buffer grows beyond MAX_LINE without a
+            terminator.
+        """
+        self._buffer += data
+        if len(self._buffer) > MAX_LINE and \
+                self._buffer.find(TERMINATOR) < 0:
+            self.clear()
+            raise ProtocolError(
+                "No line terminator in {:d} bytes.".format(MAX_LINE))
+
+    def next_line(self):
+        """
+        Returns
+        -------
+        line (bytes) : the first complete line without its terminator, or
+            None if no complete line was received yet.
+        """
+        i = self._buffer.find(TERMINATOR)
+        if i < 0:
+            return None
+        line = bytes(self._buffer[:i])
+        del self._buffer[:i + 1]
+        return line
+
+    def flush(self):
+        """
+        Returns
+        -------
+        line (bytes) : whatever is left of an unterminated line, e.g. the
+            last reply of a plugin that closed the connection after it.
+            The buffer is emptied.
+        """
+        line = bytes(self._buffer)
+        self.clear()
+        return line
+
+
+Reply = collections.namedtuple('Reply', ['status', 'value'])
+"""
+A parsed reply: `status` is its first word in upper case, without a
+trailing colon (DONE, ERROR, STABLE, ...), `value` the rest of it.
+"""
+
+
+def parse_reply(message):
+    """
+    Parameters
+    ----------
+    message (string) : a reply from the plugin.
+
+    Returns
+    -------
+    reply (Reply)
+    """
+    status, _, value = message.strip().partition(" ")
+    return Reply(status.rstrip(":").upper(), value.strip())
+
+
+def is_done(message):
+    """True if the reply reports success."""
+    return message.strip().upper() == "DONE"
+
+
+def is_error(message):
+    """True if the reply reports a failure."""
+    return message.lstrip()[:5].upper() == "ERROR"
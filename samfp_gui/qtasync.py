@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    Runs an asyncio event loop inside the Qt event loop, so coroutines (e.g.
+    an AsyncScanRunner) share the GUI thread instead of running on a QThread.
+"""
+
+from __future__ import print_function, division
+
+import asyncio
+import logging
+
+from PyQt5 import QtCore
+
+log = logging.getLogger("samfp.qtasync")
+
+
+class AsyncioDriver(QtCore.QObject):
+
+    def __init__(self, loop=None, interval=0.01, parent=None):
+        """
+        Run an asyncio event loop in short slices from a QTimer. Within a
+        slice the loop waits on its sockets and timers as usual; between two
+        slices Qt processes the GUI events, so the GUI stays responsive
+        however slow the plugin replies are.
+
+        Parameters
+        ----------
+        loop (asyncio.AbstractEventLoop) : optional. The loop to drive. A new
+            one is created if not given.
+        interval (float) : the longest slice in seconds.
+        parent (QObject) : optional. The Qt parent.
+        """
+        super(AsyncioDriver, self).__init__(parent)
+
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.interval = interval
+
+        # A zero timeout fires whenever Qt has no pending event
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.step)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def step(self):
+        """Run the asyncio loop for one slice."""
+        if self.loop.is_running():
+            return
+
+        handle = self.loop.call_later(self.interval, self.loop.stop)
+        self.loop.run_forever()
+        handle.cancel()
+
+        # Nothing left to run, stop until the next submit. The done
+        # callbacks of the last task are still run by this last slice.
+        if not asyncio.all_tasks(self.loop):
+            self.loop.call_soon(self.loop.stop)
+            self.loop.run_forever()
+            self.stop()
+
+    def submit(self, coro, callback=None):
+        """
+        Schedule a coroutine on the driven loop and start stepping it.
+
+        Parameters
+        ----------
+        coro (coroutine) : what to run.
+        callback (callable) : optional. Called with the finished task.
+
+        Returns
+        -------
+        task (asyncio.Task) : cancel it to interrupt the coroutine.
+        """
+        task = self.loop.create_task(coro)
+        task.add_done_callback(self._log_error)
+        if callback is not None:
+            task.add_done_callback(callback)
+        self.start()
+        return task
+
+    def close(self):
+        """Cancel every pending task and close the loop."""
+        self.stop()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    @staticmethod
+    def _log_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Task failed: {}".format(task.exception()))
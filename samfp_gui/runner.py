@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+    Run a scan without the GUI: load a configuration file saved by the GUI
+    or a plan file, run it with the same ScanEngine the GUI uses and report
+    the progress on stdout as JSON lines. Nothing here imports Qt.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import configparser
+import json
+import logging
+import signal
+import sys
+import time
+
+from . import scan
+from .config import ScanConfig
+from .engine import ScanEngine
+from .estimate import OverheadModel, estimate
+from .journal import ScanJournal
+from .settle import SettleModel
+
+log = logging.getLogger("samfp.runner")
+
+
+def send_settings(config):
+    """
+    Send every header setting of a scan at once and give it a new ID.
+
+    Parameters
+    ----------
+    config (ScanConfig) : the scan to be run.
+
+    Returns
+    -------
+    scan_id (string) : the FAPERSID of the scan.
+    """
+    with scan.batch():
+        scan.set_image_basename(config.basename)
+        scan.set_image_path(config.path)
+
+        scan.set_binning(config.binning)
+        scan.set_comment(config.comment)
+        scan.set_image_exposure_time(config.exptime)
+        scan.set_image_nframes(config.nframes)
+        scan.set_target_name(config.title)
+        scan.set_image_type(config.image_type)
+
+        # Prepare the scan parameters
+        scan_id = scan.make_scan_id()
+        scan.set_scan_id(scan_id)
+
+    return scan_id
+
+
+def load_config(filename, section=None):
+    """
+    Parameters
+    ----------
+    filename (string) : a configuration file saved by the GUI or a plan file.
+    section (string) : optional. The section that holds the plan.
+
+    Returns
+    -------
+    config (ScanConfig)
+
+    Raises
+    ------
+    IOError : if the file cannot be read.
+    configparser.Error : if a section or an option is missing.
+    ValueError : if the scan is out of range or any setting is invalid.
+    """
+    cfg = configparser.RawConfigParser()
+    if not cfg.read(filename):
+        raise IOError("Could not read {:s}.".format(filename))
+    return ScanConfig.from_config(cfg, section)
+
+
+class JsonReporter(object):
+
+    def __init__(self, stream=None, clock=time.monotonic):
+        """
+        Write one JSON object per line and flush it at once, so whatever
+        reads the output follows the scan as it goes. Every object has the
+        `type` of the event, the wall clock `time` and the seconds `elapsed`
+        since the reporter was created.
+
+        Parameters
+        ----------
+        stream (file) : optional. Where to write. Defaults to sys.stdout.
+        clock (callable) : function that returns the current time, from
+            which `elapsed` is measured.
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.clock = clock
+        self._t0 = clock()
+
+    def __call__(self, type, **fields):
+        event = dict(type=type, time=round(time.time(), 3),
+                     elapsed=round(self.clock() - self._t0, 3))
+        event.update(fields)
+        self.stream.write(json.dumps(event) + "\n")
+        self.stream.flush()
+
+
+def start_journal(config):
+    """
+    Send the settings of a new scan and open its journal.
+
+    Parameters
+    ----------
+    config (ScanConfig) : the scan to be run.
+
+    Returns
+    -------
+    journal (ScanJournal) : with the start entry written.
+    """
+    return open_journal(config, send_settings(config))
+
+
+def open_journal(config, scan_id):
+    """
+    Open the journal of a new scan once its settings were sent, e.g. by an
+    aioclient.AsyncClient.
+
+    Parameters
+    ----------
+    config (ScanConfig) : the scan to be run.
+    scan_id (string) : the FAPERSID it was given.
+
+    Returns
+    -------
+    journal (ScanJournal) : with the start entry written.
+    """
+    journal = ScanJournal(scan_id)
+    journal.write_start(config.plan, config.exptime, config.nframes,
+                        pipelined=config.pipelined)
+    return journal
+
+
+def build_engine(config, journal=None, settle=None, cancel=None):
+    """
+    Build the engine of a scan without sending anything to the plugin.
+
+    Parameters
+    ----------
+    config (ScanConfig) : the scan to run.
+    journal (ScanJournal) : optional. Where the progress is recorded.
+    settle (SettleModel or float) : optional. Defaults to the saved model.
+    cancel (CancelToken) : optional. Cancelling it aborts the scan.
+
+    Returns
+    -------
+    engine (ScanEngine)
+    """
+    if settle is None:
+        settle = SettleModel.load()
+    return ScanEngine(config.plan, config.exptime, config.nframes,
+                      settle=settle, pipelined=config.pipelined,
+                      journal=journal, cancel=cancel)
+
+
+def prepare(config=None, journal=None, settle=None, cancel=None):
+    """
+    Send the settings of a new scan, or those recorded in the journal of an
+    interrupted one, and build the engine that runs it.
+
+    Parameters
+    ----------
+    config (ScanConfig) : the scan to start. Ignored if `journal` is given.
+    journal (ScanJournal) : optional. The interrupted scan to continue.
+    settle (SettleModel or float) : optional. Defaults to the saved model.
+    cancel (CancelToken) : optional. Cancelling it aborts the scan.
+
+    Returns
+    -------
+    engine (ScanEngine) : ready to `run`, with its journal.
+    """
+    if journal is None:
+        return build_engine(config, start_journal(config), settle, cancel)
+
+    if settle is None:
+        settle = SettleModel.load()
+    plan = journal.plan()
+    entry = journal.restore()
+    return ScanEngine(plan, entry['exptime'], entry['nframes'],
+                      settle=settle, pipelined=entry.get('pipelined', False),
+                      journal=journal, cancel=cancel)
+
+
+def run(engine, report):
+    """
+    Run the engine and report its start, every exposed channel and its end.
+    SIGINT and SIGTERM abort the scan, including the exposure in progress,
+    instead of killing the process.
+
+    Parameters
+    ----------
+    engine (ScanEngine) : as returned by `prepare`.
+    report (callable) : called as report(type, **fields) for every event.
+
+    Returns
+    -------
+    status (string) : 'done' or 'aborted'.
+    """
+    plan = engine.plan
+    n_steps = len(plan)
+
+    def on_step(step, sweep, channel, z):
+        report('step', step=step, n_steps=n_steps, sweep=sweep,
+               channel=channel, z=z)
+
+    engine.on_step = on_step
+
+    def on_signal(signum, frame):
+        log.warning("Signal {:d} received. Aborting the scan.".format(
+            signum))
+        engine.abort()
+
+    handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        handlers[signum] = signal.signal(signum, on_signal)
+
+    journal = engine.journal
+    report('start',
+           scan_id=journal.scan_id if journal is not None else None,
+           n_steps=n_steps,
+           n_done=len(journal.completed()) if journal is not None else 0,
+           n_channels=plan.n_channels, n_sweeps=plan.n_sweeps,
+           z_start=plan.z_start, z_step=plan.z_step,
+           exptime=engine.exptime, nframes=engine.nframes,
+           pipelined=engine.pipelined)
+
+    try:
+        n = engine.run()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    status = 'done' if n == n_steps else 'aborted'
+    report('end', status=status, n_done=n, n_steps=n_steps,
+           abort_latency=engine.abort_latency)
+    return status
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description="Run a SAM-FP scan without the GUI. The progress is "
+                    "written to stdout as JSON lines.")
+    parser.add_argument('filename', nargs='?',
+                        help="configuration saved by the GUI or plan file")
+    parser.add_argument('--section',
+                        help="section that holds the plan (default: the "
+                             "active page of a GUI file, or 'scan')")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the last interrupted scan instead")
+    parser.add_argument('--simulate', action='store_true',
+                        help="run against the simulated instrument, on a "
+                             "virtual clock")
+    parser.add_argument('--estimate', action='store_true',
+                        help="only report how long the scan would take")
+    parser.add_argument('--timings',
+                        help="save the command timings to this JSON file")
+    parser.add_argument('--host', default=scan.HOST)
+    parser.add_argument('--port', type=int, default=scan.PORT)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.filename is None and not args.resume:
+        parser.error("a filename is needed unless --resume is given")
+    if args.simulate and args.resume:
+        parser.error("--resume cannot be simulated")
+    if args.estimate and (args.resume or args.simulate):
+        parser.error("--estimate needs a filename only")
+
+    # The log goes to stderr, so stdout only holds the JSON lines
+    logging.basicConfig()
+    level = logging.DEBUG if args.verbose else logging.WARNING
+    for name in ("samfp", "samfp.scan"):
+        logging.getLogger(name).setLevel(level)
+
+    scan.HOST, scan.PORT = args.host, args.port
+
+    if args.estimate:
+        return report_estimate(args)
+    if args.simulate:
+        return simulate(args)
+
+    report = JsonReporter()
+
+    try:
+        if args.resume:
+            journal = ScanJournal.latest_unfinished()
+            if journal is None:
+                raise ValueError("There is no interrupted scan to resume.")
+            engine = prepare(journal=journal)
+        else:
+            engine = prepare(load_config(args.filename, args.section))
+        status = run(engine, report)
+    except (IOError, configparser.Error, TypeError, ValueError) as error:
+        report('error', message=str(error))
+        return 1
+    finally:
+        scan.close_lanes()
+        scan.close_connection()
+
+    if args.timings:
+        engine.recorder.to_json(args.timings)
+
+    return 0 if status == 'done' else 1
+
+
+def report_estimate(args):
+    """The --estimate mode of `main`. Nothing is sent to the instrument."""
+    report = JsonReporter()
+    try:
+        config = load_config(args.filename, args.section)
+    except (IOError, configparser.Error, TypeError, ValueError) as error:
+        report('error', message=str(error))
+        return 1
+
+    # As the engine, which pipelines several frames only when it knows the
+    # readout time
+    pipelined = config.pipelined and config.nframes == 1
+    result = estimate(config.plan, config.exptime, config.nframes,
+                      config.binning, pipelined, OverheadModel.load())
+    report('estimate', n_steps=len(config.plan), pipelined=pipelined,
+           **dict((k, round(v, 3)) for k, v in result._asdict().items()))
+    return 0
+
+
+def simulate(args):
+    """The --simulate mode of `main`, where `elapsed` is virtual time."""
+    from .simulation import Simulator
+
+    try:
+        config = load_config(args.filename, args.section)
+    except (IOError, configparser.Error, TypeError, ValueError) as error:
+        JsonReporter()('error', message=str(error))
+        return 1
+
+    with Simulator() as simulator:
+        report = JsonReporter(clock=simulator.clock.monotonic)
+        engine = simulator.prepare(config)
+        status = run(engine, report)
+
+    if args.timings:
+        engine.recorder.to_json(args.timings)
+
+    return 0 if status == 'done' else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,15 +3,70 @@
 
 from __future__ import print_function
 
+import collections
 import configparser
+import contextlib
 import logging
+import os
 import socket
 import sys
-from time import sleep
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import protocol
+from .connection import Connection
+from .plan import ScanPlan
 
 HOST = "soarhrc.ctio.noao.edu"
 PORT = 8888
 
+# Seconds to wait for the plugin to accept a new connection
+CONNECT_TIMEOUT = 5.
+
+# Seconds to wait for the reply to a command. An exposure waits as long per
+# frame, for its readout, on top of its exposure time, or EXPOSE_TIMEOUT
+# if the exposure time was not set through this module.
+REPLY_TIMEOUT = 60.
+EXPOSE_TIMEOUT = 3600.
+
+# Send batched commands in a single write. Disabled automatically if the
+# plugin does not answer every command of a pipelined write within
+# BATCH_TIMEOUT seconds.
+PIPELINE = True
+BATCH_TIMEOUT = 2.
+
+# Send the batched commands of different subsystems (FP and DHE) at the
+# same time, each over its own connection.
+CONCURRENT = True
+
+# Returned by the commands queued in a batch instead of the plugin reply
+QUEUED = "QUEUED"
+
+_local = threading.local()
+
+# Last value acknowledged by the plugin for every "dhe set" and
+# "dhe dbs set" key, so unchanged settings are not sent again.
+_remote_state = {}
+_remote_state_lock = threading.Lock()
+
+# Timing recorder shared by the connections of every thread
+_recorder = None
+
+# Cancellation token used by every command that is not given one
+_cancel = None
+
+# Set when the plugin failed to answer a pipelined write
+_pipeline_failed = False
+
+# One worker thread, and thus one connection, per subsystem other than the
+# DHE, which is driven from the calling thread.
+_lanes = {}
+_lanes_lock = threading.Lock()
+
+# Scan IDs given by this process, so two scans never share one
+_scan_ids = set()
+_scan_ids_lock = threading.Lock()
+
 logging.basicConfig()
 log = logging.getLogger("samfp.scan")
 log.setLevel(logging.DEBUG)
@@ -25,61 +80,104 @@ def main():
 
 
 def do_scan(cfg):
-    # Set the image properties
-    set_image_basename(str(cfg.get('image', 'basename')))
-    set_comment(str(cfg.get('image', 'comment')))
-    set_image_path(str(cfg.get('image', 'dir')))
-    set_image_type(str(cfg.get('image', 'type')))
-    set_target_name(str(cfg.get('image', 'title')))
 
-    # Set the observation properties
-    set_image_exposure_time(cfg.getfloat('obs', 'exptime'))
-    set_image_nframes(cfg.getint('obs', 'nframes'))
+    from .engine import ScanEngine
+    from .journal import ScanJournal
+    from .settle import SettleModel
 
-    # Prepare the scan parameters
-    set_scan_id(cfg.get('scan', 'id'))
+    journal = ScanJournal(cfg.get('scan', 'id'))
+    resume = cfg.getboolean('scan', 'resume', fallback=False) and \
+        bool(journal.entries) and not journal.is_finished
+
+    # Compute and validate the whole scan before sending anything
+    if resume:
+        plan = journal.plan()
+    else:
+        plan = ScanPlan.from_config(
+            cfg, 'scan', clip=cfg.getboolean('scan', 'clip', fallback=False))
+    if cfg.has_option('scan', 'stime'):
+        settle = cfg.getfloat('scan', 'stime')
+    else:
+        settle = SettleModel.load()
+
+    with batch():
+        # Set the image properties
+        set_image_basename(str(cfg.get('image', 'basename')))
+        set_comment(str(cfg.get('image', 'comment')))
+        set_image_path(str(cfg.get('image', 'dir')))
+        set_image_type(str(cfg.get('image', 'type')))
+        set_target_name(str(cfg.get('image', 'title')))
+
+        # Set the observation properties
+        set_image_exposure_time(cfg.getfloat('obs', 'exptime'))
+        set_image_nframes(cfg.getint('obs', 'nframes'))
+
+        # Prepare the scan parameters
+        set_scan_id(cfg.get('scan', 'id'))
+
+    if resume:
+        journal.restore()
+    else:
+        journal.write_start(plan, cfg.getfloat('obs', 'exptime'),
+                            cfg.getint('obs', 'nframes'))
 
     # Actually scan
-    number_of_sweeps = cfg.getint('scan', 'nsweeps')
-    number_of_channels = cfg.getint('scan', 'nchannels')
-    stime = cfg.getfloat('scan', 'stime')
-    z = cfg.getint('scan', 'zstart')
-    dz = cfg.getfloat('scan', 'zstep')
+    engine = ScanEngine(
+        plan, cfg.getfloat('obs', 'exptime'), cfg.getint('obs', 'nframes'),
+        settle=settle,
+        poll_status=cfg.getboolean('scan', 'poll', fallback=False),
+        pipelined=cfg.getboolean('scan', 'pipelined', fallback=False),
+        readout_time=cfg.getfloat('scan', 'readout', fallback=None),
+        journal=journal)
+    engine.run()
 
-    for sweep in range(number_of_sweeps):
+    if cfg.has_option('scan', 'timings'):
+        engine.recorder.to_json(cfg.get('scan', 'timings'))
 
-        print("Moving FP to the initial Z = {:d}".format(z))
-        z = fp_moveabs(z)
-        set_scan_start(z)
-        set_scan_current_sweep(sweep)
 
-        for channel in range(number_of_channels):
-            z = z + dz
-            fp_moveabs(int(round(z)))
-            set_scan_current_z(int(round(z)))
+def abort_exposure(timeout=2.):
+    """
+    Ask the DHE to abort the exposure in progress. It is sent on a new
+    socket since the one waiting for the exposure is busy. Not every version
+    of the plugin supports it.
 
-            if 4095 < z or z < 0:
-                log.warning(
-                    "Z = {z:d} out of the allowed range [0, 4095]".format(z))
+    Parameters
+    ----------
+    timeout (float) : seconds to wait for the reply.
 
-            sleep(stime)
-            expose()
+    Returns
+    -------
+    message (string) : DONE if successful or ERROR otherwise.
+    """
+    try:
+        with Connection(HOST, PORT, timeout=timeout, retries=0) as connection:
+            msg = connection.send(protocol.ABORT)
+    except socket.error as error:
+        msg = "ERROR: {}".format(error)
+
+    if not protocol.is_done(msg):
+        log.warning("Could not abort the exposure: {:s}".format(msg))
+    return msg
 
 
-def expose():
+def expose(cancel=None):
     """
     Tell SAMI to trigger an exposure in the current frame or for the current
     set of images.
 
+    Parameters
+    ----------
+    cancel (CancelToken) : optional. Stops waiting for the exposure.
+
     Returns
     -------
     message (string) : DONE if successful.
     """
-    msg = send_command("dhe expose")
+    msg = send_command(protocol.EXPOSE, cancel=cancel)
     return msg
 
 
-def fp_moveabs(z):
+def fp_moveabs(z, cancel=None):
     """
     Send a command to SAMI and the SAM-FP plugin to move the FP
     to an absolute position. It has to have a value beween 0 and 4095.
@@ -87,63 +185,499 @@ def fp_moveabs(z):
     Parameters
     ----------
     z (int) : the absolute z position.
+    cancel (CancelToken) : optional. Stops waiting for the move.
 
     Returns
     -------
     z (int) : the current z position if the command was received successfully.
     """
     if 4095 < z or z < 0:
-        raise (ValueError,
-               "z must be between 0 and 4095. Current value: {:d}".format(z))
+        raise ValueError(
+            "z must be between 0 and 4095. Current value: {:d}".format(z))
+
+    current_batch = getattr(_local, 'batch', None)
+    if current_batch is not None:
+        current_batch.add(protocol.FP_MOVEABS(z))
+        return z
 
-    msg = send_command("fp moveabs {:d}".format(z))
-    if msg.lower() != "done":
+    msg = send_command(protocol.FP_MOVEABS(z), cancel=cancel)
+    if not protocol.is_done(msg):
         print(msg)
 
     return z
 
 
-def send_command(command):
+def get_connection():
+    """
+    Return the connection to the SAM-FP plugin used by the current thread,
+    opening a new one if HOST or PORT changed since its last command, in
+    which case the remote state cache is also cleared. Each thread has its
+    own socket so commands can be in flight concurrently.
+
+    Returns
+    -------
+    connection (Connection) : the long-lived connection to HOST:PORT.
+    """
+    global _pipeline_failed
+
+    connection = getattr(_local, 'connection', None)
+
+    if connection is not None and \
+            (connection.host, connection.port) != (HOST, PORT):
+        invalidate_remote_state()
+        _pipeline_failed = False
+        connection = None
+
+    if connection is None:
+        close_connection()
+        connection = Connection(HOST, PORT, timeout=REPLY_TIMEOUT,
+                                connect_timeout=CONNECT_TIMEOUT)
+        _local.connection = connection
+
+    connection.recorder = _recorder
+    return connection
+
+
+def close_connection():
+    """Close the current thread's connection to the plugin, if any."""
+    connection = getattr(_local, 'connection', None)
+
+    if connection is not None:
+        connection.close()
+    _local.connection = None
+
+
+def get_recorder():
+    """
+    Returns
+    -------
+    recorder (instrument.Recorder) : the recorder that receives the timing
+        of every command, or None.
+    """
+    return _recorder
+
+
+def set_recorder(recorder):
     """
-    Send a command to the SAM-FP server plugin at the SAMI's GUI.
+    Record the timing of every command sent from now on, from any thread.
 
     Parameters
     ----------
-    command (string) : a command to be sent via TCP/IP.
+    recorder (instrument.Recorder) : the new recorder or None to stop
+        recording.
+
+    Returns
+    -------
+    previous (instrument.Recorder) : the recorder it replaces.
+    """
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    return previous
+
+
+def set_cancel_token(cancel):
+    """
+    Make every command sent from now on, from any thread, give up waiting
+    for its reply once the token is cancelled.
+
+    Parameters
+    ----------
+    cancel (CancelToken) : the new token or None.
+
+    Returns
+    -------
+    previous (CancelToken) : the token it replaces.
+    """
+    global _cancel
+    previous, _cancel = _cancel, cancel
+    return previous
+
+
+def fp_status(cancel=None):
+    """
+    Ask the SAM-FP plugin whether the FP is still moving. Not every version
+    of the plugin supports it.
+
+    Parameters
+    ----------
+    cancel (CancelToken) : optional. Stops waiting for the reply.
+
+    Returns
+    -------
+    message (string) : STABLE or MOVING followed by the current z position,
+        or ERROR if the plugin does not report the FP status.
+    """
+    msg = send_command(protocol.FP_STATUS, cancel=cancel)
+    return msg
+
+
+def send_command(command, cancel=None, timeout=None):
+    """
+    Send a command to the SAM-FP server plugin at the SAMI's GUI. The same
+    socket is reused for every command and reopened if it breaks. Whenever
+    the socket is reopened, every setting in the remote state cache is sent
+    again since the plugin may have lost it. A socket the plugin closed
+    while idle is reopened, and the settings sent again, before the command
+    goes out.
+
+    Parameters
+    ----------
+    command (string or bytes) : a command to be sent via TCP/IP, as text or
+        already encoded by a protocol.Template.
+    cancel (CancelToken) : optional. Stops waiting for the reply when it is
+        cancelled. Defaults to the token installed with `set_cancel_token`.
+    timeout (float) : optional. Seconds to wait for the reply. Defaults to
+        `exposure_timeout()` for an exposure and REPLY_TIMEOUT otherwise.
 
     Returns
     -------
     message (string) : the response from the plugin.
+
+    Raises
+    ------
+    Cancelled : if the token was cancelled before the reply arrived.
     """
+    if cancel is None:
+        cancel = _cancel
+    if timeout is None and protocol.encode(command) == protocol.EXPOSE:
+        timeout = exposure_timeout()
+
+    connection = get_connection()
+    connection.close_if_stale()
+    n_connects = connection.n_connects
+
+    try:
+        if not connection.is_connected and n_connects > 0:
+            connection.connect()
+            resync()
+            n_connects = connection.n_connects
+        message = connection.send(command, cancel=cancel, timeout=timeout)
+    except socket.error as error:
+        print('Could not send command: {:s} ({})'.format(
+            protocol.as_text(command), error))
+        return "ERROR"
 
-    global HOST
-    global PORT
+    log.debug("{:s} - {:s} ({:.1f} ms)".format(
+        protocol.as_text(command), message, connection.last_latency * 1e3))
 
-    s = None
-    for res in socket.getaddrinfo(HOST, PORT, socket.AF_UNSPEC,
-                                  socket.SOCK_STREAM):
-        af, sock_type, proto, cannon_name, sa = res
+    # The socket went stale while sending this command
+    if 0 < n_connects < connection.n_connects:
+        resync()
+
+    return message
+
+
+def exposure_timeout():
+    """
+    Returns
+    -------
+    timeout (float) : seconds to wait for the reply to an exposure with the
+        exposure time and number of frames the plugin acknowledged.
+    """
+    with _remote_state_lock:
+        exptime = _remote_state.get(('dhe set', 'obs.exptime'))
+        nframes = _remote_state.get(('dhe set', 'obs.nimages'), '1')
+
+    if exptime is None:
+        return EXPOSE_TIMEOUT
+    return int(nframes) * (float(exptime) + REPLY_TIMEOUT)
+
+
+class Batch(object):
+
+    def __init__(self):
+        """
+        Commands collected by `batch`. A setting queued twice is only sent
+        once, with its last value.
+        """
+        self.commands = []
+        self.settings = []
+        self.replies = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, command, setting=None):
+        """
+        Parameters
+        ----------
+        command (bytes) : the encoded command.
+        setting (tuple) : optional. The (prefix, key, value) it sets, to
+            update the remote state cache once it is acknowledged.
+        """
+        if setting is not None:
+            for i, other in enumerate(self.settings):
+                if other is not None and other[:2] == setting[:2]:
+                    del self.commands[i]
+                    del self.settings[i]
+                    break
+
+        self.commands.append(command)
+        self.settings.append(setting)
+
+    @property
+    def ok(self):
+        """True if every command was acknowledged."""
+        return all(protocol.is_done(r) for r in self.replies)
+
+
+@contextlib.contextmanager
+def batch(cancel=None):
+    """
+    Collect the set_* and fp_moveabs calls made in the current thread and
+    send them together when the block ends: a single pipelined write and
+    one read pass for all the replies, so they cost one round trip. If the
+    plugin does not answer a pipelined write, the commands are sent one by
+    one, now and from then on. Nothing is sent if the block raises.
+
+    The FP and the DHE commands are independent, so they are sent at the
+    same time over separate connections and the block only ends when both
+    were answered: the header keywords are written while the FP moves.
+
+    Inside the block the set_* functions return QUEUED. Batches opened
+    inside another batch join the outer one.
+
+        with scan.batch() as b:
+            scan.fp_moveabs(z)
+            scan.set_scan_current_z(z)
+        b.replies  # ['DONE', 'DONE']
+
+    Parameters
+    ----------
+    cancel (CancelToken) : optional. Stops waiting for the replies.
+    """
+    outer = getattr(_local, 'batch', None)
+    if outer is not None:
+        yield outer
+        return
+
+    _local.batch = Batch()
+    try:
+        yield _local.batch
+        current_batch = _local.batch
+    finally:
+        _local.batch = None
+
+    _flush(current_batch, cancel)
+
+
+def close_lanes():
+    """Close the connections of the subsystem worker threads."""
+    with _lanes_lock:
+        lanes = list(_lanes.values())
+        _lanes.clear()
+
+    for lane in lanes:
+        lane.submit(close_connection).result()
+        lane.shutdown()
+
+
+def _lane(name):
+
+    with _lanes_lock:
+        if name not in _lanes:
+            _lanes[name] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="samfp-{:s}".format(name))
+        return _lanes[name]
+
+
+def _flush(current_batch, cancel=None):
+
+    if cancel is None:
+        cancel = _cancel
+
+    commands = current_batch.commands
+    groups = collections.OrderedDict()
+    for i, command in enumerate(commands):
+        groups.setdefault(protocol.subsystem(command), []).append(i)
+
+    if CONCURRENT and len(groups) > 1:
+        # Every subsystem gets its commands at the same time; the DHE ones
+        # are sent from this thread while the others run on their lanes.
+        futures = [(indices, _lane(name).submit(
+                        _send_group, [commands[i] for i in indices], cancel))
+                   for name, indices in groups.items() if name != 'dhe']
+
+        replies = [None] * len(commands)
+        indices = groups.get('dhe', [])
+        for i, message in zip(indices, _send_group(
+                [commands[i] for i in indices], cancel)):
+            replies[i] = message
+
+        for indices, future in futures:
+            for i, message in zip(indices, future.result()):
+                replies[i] = message
+    else:
+        replies = _send_group(commands, cancel)
+
+    for command, setting, message in zip(
+            commands, current_batch.settings, replies):
+        if setting is not None:
+            acknowledge(*setting, message=message)
+        if not protocol.is_done(message):
+            log.warning("{:s} - {:s}".format(
+                protocol.as_text(command), message))
+
+    current_batch.replies = replies
+    return replies
+
+
+def _send_group(commands, cancel):
+    """
+    Send commands through the current thread's connection, pipelined if
+    possible.
+    """
+    global _pipeline_failed
+
+    if len(commands) > 1 and PIPELINE and not _pipeline_failed:
+        connection = get_connection()
+        connection.close_if_stale()
         try:
-            s = socket.socket(af, sock_type, proto)
-        except socket.error as msg:
-            s = None
-            continue
+            if not connection.is_connected and connection.n_connects > 0:
+                connection.connect()
+                resync()
+            replies = connection.send_many(commands, cancel=cancel,
+                                           timeout=BATCH_TIMEOUT)
+        except socket.timeout:
+            log.warning("The plugin did not answer {:d} pipelined commands. "
+                        "Sending commands one by one from now on.".format(
+                            len(commands)))
+            _pipeline_failed = True
+        except socket.error as error:
+            log.warning("Pipelined commands failed ({}). Sending them one "
+                        "by one.".format(error))
+        else:
+            for command, message in zip(commands, replies):
+                log.debug("{:s} - {:s} (pipelined)".format(
+                    protocol.as_text(command), message))
+            return replies
+
+    return [send_command(c, cancel=cancel) for c in commands]
+
+
+def set_dbs(key, value):
+    """
+    Set a header keyword through the SAMI's database unless the plugin
+    already acknowledged the same value.
+
+    Parameters
+    ----------
+    key (string) : the header keyword.
+    value (string) : the value formatted as it will be sent.
+
+    Returns
+    -------
+    message (string) : DONE if successful.
+    """
+    return _send_cached('dhe dbs set', key, value)
+
+
+def set_dhe(key, value):
+    """
+    Set a DHE property unless the plugin already acknowledged the same value.
+
+    Parameters
+    ----------
+    key (string) : the property name (e.g. image.basename).
+    value (string) : the value formatted as it will be sent.
+
+    Returns
+    -------
+    message (string) : DONE if successful.
+    """
+    return _send_cached('dhe set', key, value)
+
+
+def get_remote_state():
+    """
+    Returns
+    -------
+    settings (list) : a [command, key, value] list for every setting the
+        plugin acknowledged, e.g. ['dhe set', 'image.basename', 'fp_sami'].
+    """
+    with _remote_state_lock:
+        return [[prefix, key, value] for (prefix, key), value
+                in sorted(_remote_state.items())]
+
+
+def invalidate_remote_state(key=None):
+    """
+    Forget what the plugin was told so the next set_* calls are sent again.
+    Use it whenever the settings may have been changed by someone else,
+    e.g. from SAMI's own GUI.
+
+    Parameters
+    ----------
+    key (string) : optional. Forget only this property or keyword.
+    """
+    with _remote_state_lock:
+        if key is None:
+            _remote_state.clear()
+        else:
+            for k in [k for k in _remote_state if k[1] == key]:
+                del _remote_state[k]
+
+
+def resync():
+    """Send every cached setting to the plugin again."""
+    with _remote_state_lock:
+        items = sorted(_remote_state.items())
+
+    log.debug("Resynchronizing {:d} settings.".format(len(items)))
+    connection = get_connection()
+
+    for (prefix, key), value in items:
         try:
-            s.connect(sa)
-        except socket.error as msg:
-            s.close()
-            s = None
-            continue
-        break
-    if s is None:
-        print('Could not send command: {:s}'.format(command))
-        return "ERROR"
+            message = connection.send(protocol.SETTINGS[prefix](key, value))
+        except socket.error:
+            message = "ERROR"
+        if not protocol.is_done(message):
+            invalidate_remote_state(key)
+
 
-    s.sendall(command)
-    message = s.recv(1024)
-    s.close()
+def acknowledge(prefix, key, value, message):
+    """
+    Update the remote state cache with the reply to a setting.
+
+    Parameters
+    ----------
+    prefix (string) : "dhe set" or "dhe dbs set".
+    key (string) : the property name or header keyword.
+    value (string) : the value as it was sent.
+    message (string) : the reply from the plugin.
+    """
+    with _remote_state_lock:
+        if protocol.is_done(message):
+            _remote_state[(prefix, key)] = value
+        else:
+            _remote_state.pop((prefix, key), None)
+
+
+def is_acknowledged(prefix, key, value):
+    """
+    Returns
+    -------
+    acknowledged (bool) : True if the plugin already acknowledged this value.
+    """
+    with _remote_state_lock:
+        return _remote_state.get((prefix, key)) == value
+
+
+def _send_cached(prefix, key, value):
+
+    if is_acknowledged(prefix, key, value):
+        log.debug("{:s} {:s} {:s} - unchanged".format(prefix, key, value))
+        return "DONE"
+
+    current_batch = getattr(_local, 'batch', None)
+    if current_batch is not None:
+        current_batch.add(protocol.SETTINGS[prefix](key, value),
+                          setting=(prefix, key, value))
+        return QUEUED
+
+    message = send_command(protocol.SETTINGS[prefix](key, value))
+    acknowledge(prefix, key, value, message)
 
-    log.debug("{command:s} - {message:s}".format(**locals()))
     return message
 
 
@@ -160,7 +694,7 @@ def set_comment(comment):
     -------
     message (string) : DONE if successful.
     """
-    message = send_command('dhe set image.comment {:s}'.format(comment))
+    message = set_dhe('image.comment', '{:s}'.format(comment))
     return message
 
 
@@ -183,9 +717,9 @@ def set_binning(bin_size):
     biny = bin_size
 
     if isinstance(bin_size, int):
-        message = send_command('dhe set binning {:d} {:d}'.format(binx, biny))
+        message = set_dhe('binning', '{:d} {:d}'.format(binx, biny))
     elif isinstance(bin_size, str):
-        message = send_command('dhe set binning {:s} {:s}'.format(binx, biny))
+        message = set_dhe('binning', '{:s} {:s}'.format(binx, biny))
     else:
         raise TypeError('bin_size counld not be understood (not an int nor str')
     return message
@@ -203,7 +737,7 @@ def set_image_basename(basename):
     -------
     message (string) : DONE if successful.
     """
-    message = send_command('dhe set image.basename {:s}'.format(basename))
+    message = set_dhe('image.basename', '{:s}'.format(basename))
     return message
 
 
@@ -219,7 +753,7 @@ def set_image_exposure_time(exp_time):
     -------
     message (string) : DONE if successful.
     """
-    message = send_command("dhe set obs.exptime {:f}".format(exp_time))
+    message = set_dhe('obs.exptime', '{:f}'.format(exp_time))
     return message
 
 
@@ -236,7 +770,7 @@ def set_image_path(path):
     message (string) : DONE if successful.
     """
     # TODO - Check if remote path exists
-    message = send_command('dhe set image.dir {:s}'.format(path))
+    message = set_dhe('image.dir', '{:s}'.format(path))
     return message
 
 
@@ -253,7 +787,7 @@ def set_image_nframes(nimages=1):
     -------
     message (string) : DONE if successful.
     """
-    message = send_command('dhe set obs.nimages {:d}'.format(nimages))
+    message = set_dhe('obs.nimages', '{:d}'.format(nimages))
     return message
 
 
@@ -276,9 +810,9 @@ def set_image_type(image_type):
     if image_type.upper() not in options:
         error_msg = "Image type {} ".format(image_type) + \
                     "not found within the available options"
-        raise (ValueError, error_msg)
+        raise ValueError(error_msg)
 
-    message = send_command('dhe set image.type {:s}'.format(image_type))
+    message = set_dhe('image.type', '{:s}'.format(image_type))
     return message
 
 
@@ -296,11 +830,39 @@ def set_target_name(target_name):
     -------
     message (string) : DONE if successful.
     """
-    target_name = target_name.replace(" ", "_")
-    message = send_command('dhe set image.title {:s}'.format(target_name))
+    message = set_dhe('image.title', header_title(target_name))
     return message
 
 
+def header_title(target_name):
+    """The target name as it is written to the OBJECT keyword."""
+    return '{:s}'.format(target_name).replace(" ", "_")
+
+
+def make_scan_id():
+    """
+    Returns
+    -------
+    _id (string) : a scan ID built from the time "now" using the
+        SCAN_%Y%m%d_UTC%H%M%S timestamp. If that ID was already given in
+        the same second, or already has a journal, "_2", "_3", etc. is
+        appended, so every scan has its own FAPERSID and journal.
+    """
+    from datetime import datetime
+    from .journal import ScanJournal
+
+    base = datetime.utcnow().strftime("SCAN_%Y%m%d_UTC%H%M%S")
+
+    with _scan_ids_lock:
+        _id, n = base, 1
+        while _id in _scan_ids or os.path.exists(ScanJournal(_id).path):
+            n += 1
+            _id = "{:s}_{:d}".format(base, n)
+        _scan_ids.add(_id)
+
+    return _id
+
+
 def set_scan_id(_id=None, key="FAPERSID"):
     """
     Set the scan id to be used when assembling data-cubes in the future.
@@ -318,12 +880,9 @@ def set_scan_id(_id=None, key="FAPERSID"):
     message (string) : DONE if successful.
         """
     if _id is None:
-        from datetime import datetime
-        now = datetime.utcnow()
-        _id = now.strftime("SCAN_%Y%m%d_UTC%H%M%S")
+        _id = make_scan_id()
 
-    message = send_command(
-        'dhe dbs set {key:s} {_id:s}'.format(**locals()))
+    message = set_dbs(key, '{:s}'.format(_id))
     return message
 
 
@@ -341,9 +900,8 @@ def set_scan_nchannels(nchannels=0, key="FPNCHAN"):
     -------
     message (string) : DONE if successful.
     """
-    s = "dhe dbs set {key:s} {nchannels:d}".format(**locals())
-    message = send_command(s)
-    return s
+    message = set_dbs(key, '{:d}'.format(nchannels))
+    return message
 
 
 def set_scan_start(zstart=0, key="FPZINIT"):
@@ -362,8 +920,7 @@ def set_scan_start(zstart=0, key="FPZINIT"):
     message (string) : DONE if successful.
     """
     zstart = int(zstart)
-    s = "dhe dbs set {key:s} {zstart:f}".format(**locals())
-    message = send_command(s)
+    message = set_dbs(key, '{:f}'.format(zstart))
     return message
 
 
@@ -381,7 +938,7 @@ def set_scan_current_sweep(sweep=0, key="FAPERSWP"):
     message (string) : DONE if successful.
     """
     sweep = int(sweep)
-    message = send_command('dhe dbs set {key:s} {sweep:d}'.format(**locals()))
+    message = set_dbs(key, '{:d}'.format(sweep))
     return message
 
 
@@ -398,7 +955,7 @@ def set_scan_current_z(z=0, key="FAPERSST"):
     -------
     message (string) : DONE if successful.
     """
-    message = send_command('dhe dbs set {key:s} {z:d}'.format(**locals()))
+    message = set_dbs(key, '{:d}'.format(z))
     log.debug(message)
     return message
 
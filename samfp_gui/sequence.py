@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+    Scan sequence of the FP, ported from scripts/fp_sami: interference order,
+    free spectral range, Queensgate constant, number of channels and the BCV
+    positions of every channel, including the intermediate moves the CS100
+    needs when it jumps more than a few BCV at once.
+
+    Every function accepts scalars or arrays and broadcasts them, so a whole
+    grid of configurations is computed at once.
+"""
+
+from __future__ import print_function, division
+
+import logging
+
+import numpy as np
+
+log = logging.getLogger("samfp.sequence")
+
+# km / s
+SPEED_OF_LIGHT = 299792.458
+
+# Angstrom
+H_ALPHA = 6562.78
+NEON = 6598.9529
+
+BCV_MIN = 0
+BCV_MAX = 4095
+
+# The CS100 does not respect the order of the plates when asked to jump over
+# a large BCV range at once, so larger jumps are split in moves of at most
+# MAX_JUMP BCV followed by a pause of JUMP_PAUSE seconds.
+MAX_JUMP = 3
+JUMP_PAUSE = 1.
+
+# Below this many BCV per channel the CS100 cannot resolve the steps
+MIN_STEP = 2
+
+MOVE_DTYPE = np.dtype([('step', int), ('z', int), ('final', bool)])
+
+
+def redshifted(wavelength, velocity):
+    """
+    Parameters
+    ----------
+    wavelength (float or array) : the wavelength at rest in Angstrom.
+    velocity (float or array) : the radial velocity in km / s.
+
+    Returns
+    -------
+    wavelength (float or array) : the observed wavelength in Angstrom.
+    """
+    return (np.asarray(velocity) / SPEED_OF_LIGHT + 1) * wavelength
+
+
+def interference_order(wavelength, gap):
+    """
+    Parameters
+    ----------
+    wavelength (float or array) : in Angstrom.
+    gap (float or array) : the distance between the plates in microns.
+
+    Returns
+    -------
+    order (float or array)
+    """
+    return 2. * np.asarray(gap) * 1e4 / wavelength
+
+
+def fsr_wavelength(wavelength, order):
+    """
+    Returns
+    -------
+    fsr (float or array) : the free spectral range in Angstrom.
+    """
+    order = np.asarray(order, dtype=float)
+    return wavelength / order * (1 + 1 / (order * order))
+
+
+def fsr_velocity(wavelength, order):
+    """
+    Returns
+    -------
+    fsr (float or array) : the free spectral range in km / s.
+    """
+    return SPEED_OF_LIGHT * fsr_wavelength(wavelength, order) / wavelength
+
+
+def queensgate_constant(wavelength, fsr_bcv):
+    """
+    Parameters
+    ----------
+    wavelength (float or array) : the reference wavelength in Angstrom.
+    fsr_bcv (float or array) : the free spectral range measured at this
+        wavelength in BCV.
+
+    Returns
+    -------
+    qgc (float or array) : the Queensgate constant in Angstrom per BCV.
+    """
+    return np.asarray(wavelength, dtype=float) / fsr_bcv
+
+
+def fsr_bcv(wavelength, qgc):
+    """
+    Returns
+    -------
+    fsr (float or array) : the free spectral range in BCV at `wavelength`.
+    """
+    return np.asarray(wavelength, dtype=float) / qgc
+
+
+def n_channels(finesse, sampling=2., overscan=1.):
+    """
+    The number of channels needed to sample `overscan` free spectral ranges
+    `sampling` times per resolution element, plus one to avoid
+    undersampling.
+
+    Returns
+    -------
+    n_channels (int or array)
+    """
+    n = np.floor(np.asarray(finesse) * sampling * overscan).astype(int) + 1
+    return n if n.ndim else int(n)
+
+
+def bcv_step(fsr, finesse, sampling=2.):
+    """
+    Returns
+    -------
+    step (float or array) : the FP step between channels in BCV.
+    """
+    return np.asarray(fsr, dtype=float) / (np.asarray(finesse) * sampling)
+
+
+def round_bcv(z):
+    """Round to the nearest BCV, halves away from zero as fp_sami does."""
+    z = np.asarray(z, dtype=float)
+    return (np.sign(z) * np.floor(np.abs(z) + 0.5)).astype(int)
+
+
+def channel_positions(z_start, z_step, n):
+    """
+    Returns
+    -------
+    z (array) : the BCV position of each of the `n` channels.
+    """
+    return round_bcv(z_start + np.arange(n) * z_step)
+
+
+def substeps(z, max_jump=MAX_JUMP, z0=None):
+    """
+    Split every move between consecutive positions into moves of at most
+    `max_jump` BCV.
+
+    Parameters
+    ----------
+    z (array) : the BCV positions to visit, in order.
+    max_jump (int) : the largest move allowed at once. None or 0 disables
+        the sub-steps.
+    z0 (int) : optional. The position before the first one. If None, the
+        first move is never split, as its origin is unknown.
+
+    Returns
+    -------
+    moves (array) : one MOVE_DTYPE row per move, with the index in `z` of
+        the position it leads to in `step`. Only the last move to each
+        position is `final`.
+    """
+    z = np.asarray(z, dtype=int)
+    if z.size == 0:
+        return np.empty(0, dtype=MOVE_DTYPE)
+
+    origin = np.empty_like(z)
+    origin[1:] = z[:-1]
+    origin[0] = z[0] if z0 is None else z0
+    jump = z - origin
+
+    max_jump = max_jump or 0
+    if max_jump:
+        n_moves = np.maximum(-(-np.abs(jump) // max_jump), 1)
+    else:
+        n_moves = np.ones_like(z)
+
+    step = np.repeat(np.arange(z.size), n_moves)
+
+    # 1, 2, ... within the moves towards each position
+    first = np.cumsum(n_moves) - n_moves
+    k = np.arange(step.size) - np.repeat(first, n_moves) + 1
+
+    final = k == n_moves[step]
+    moves = np.empty(step.size, dtype=MOVE_DTYPE)
+    moves['step'] = step
+    moves['z'] = np.where(
+        final, z[step], origin[step] + np.sign(jump[step]) * k * max_jump)
+    moves['final'] = final
+
+    return moves
+
+
+class ScanSequence(object):
+
+    def __init__(self, wavelength, gap, qgc, finesse, z_start, sampling=2.,
+                 overscan=1., velocity=0., max_jump=MAX_JUMP):
+        """
+        Everything fp_sami computes for one scan. The channels go from
+        `z_start` towards lower BCV, which shrinks the rings.
+
+        Parameters
+        ----------
+        wavelength (float) : the wavelength at rest in Angstrom.
+        gap (float) : the distance between the plates in microns.
+        qgc (float) : the Queensgate constant in Angstrom per BCV.
+        finesse (float) : the effective finesse.
+        z_start (int) : the BCV position of the first channel.
+        sampling (float) : channels per resolution element.
+        overscan (float) : the number of free spectral ranges to scan.
+        velocity (float) : the radial velocity in km / s.
+        max_jump (int) : the largest move the CS100 makes at once.
+
+        Raises
+        ------
+        ValueError : if the step is below MIN_STEP BCV or if the scan does
+            not fit in the BCV range.
+        """
+        self.wavelength = wavelength
+        self.gap = gap
+        self.qgc = qgc
+        self.finesse = finesse
+        self.z_start = z_start
+        self.sampling = sampling
+        self.overscan = overscan
+        self.velocity = velocity
+        self.max_jump = max_jump
+
+        self.observed_wavelength = float(redshifted(wavelength, velocity))
+        self.order = float(interference_order(self.observed_wavelength, gap))
+        self.fsr_wavelength = float(
+            fsr_wavelength(self.observed_wavelength, self.order))
+        self.fsr_velocity = float(
+            fsr_velocity(self.observed_wavelength, self.order))
+        self.fsr_bcv = float(fsr_bcv(self.observed_wavelength, qgc))
+        self.z_step = -float(bcv_step(self.fsr_bcv, finesse, sampling))
+        self.n_channels = n_channels(finesse, sampling, overscan)
+
+        if abs(self.z_step) < MIN_STEP:
+            raise ValueError(
+                "A step of {:.2f} BCV is below {:d} BCV. Reduce the finesse "
+                "or the sampling.".format(abs(self.z_step), MIN_STEP))
+        if self.fsr_bcv * overscan > BCV_MAX:
+            raise ValueError(
+                "Scanning {:g} FSR of {:.1f} BCV exceeds {:d} BCV.".format(
+                    overscan, self.fsr_bcv, BCV_MAX))
+
+        self.z = channel_positions(z_start, self.z_step, self.n_channels)
+        self.moves = substeps(self.z, max_jump)
+
+    def __repr__(self):
+        return "ScanSequence(wavelength={0.wavelength}, gap={0.gap}, " \
+               "qgc={0.qgc}, finesse={0.finesse}, z_start={0.z_start})" \
+               "".format(self)
+
+    @property
+    def resolution(self):
+        """The spectral resolution at the observed wavelength."""
+        return self.observed_wavelength * self.finesse / self.fsr_wavelength
+
+    def plan(self, n_sweeps=1, clip=False):
+        """
+        Returns
+        -------
+        plan (ScanPlan) : the plan visiting the channels of this sequence.
+        """
+        from .plan import ScanPlan
+        return ScanPlan(self.z_start, self.z_step, self.n_channels, n_sweeps,
+                        clip=clip, max_jump=self.max_jump)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+    FP settle time model: how long to wait after a move before exposing.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from . import protocol, scan
+
+log = logging.getLogger("samfp.settle")
+
+SETTLE_FILE = os.path.join(os.path.expanduser("~"), '.samfp_settle.json')
+
+
+class SettleModel(object):
+
+    def __init__(self, base=0.05, per_bcv=0.002, maximum=2.0):
+        """
+        Linear settle time model: a move of `jump` BCV needs
+        `base + per_bcv * |jump|` seconds to settle, never more than
+        `maximum` seconds.
+
+        Parameters
+        ----------
+        base (float) : settle time of a null move in seconds.
+        per_bcv (float) : extra settle time per BCV in seconds.
+        maximum (float) : upper limit in seconds. It is also used when the
+            size of the jump is unknown (e.g. the first move of a scan).
+        """
+        self.base = base
+        self.per_bcv = per_bcv
+        self.maximum = maximum
+
+    def __call__(self, jump=None):
+        """
+        Parameters
+        ----------
+        jump (int or array) : the size of the FP move(s) in BCV or None if
+            unknown.
+
+        Returns
+        -------
+        delay (float or array) : the settle time in seconds.
+        """
+        if jump is None:
+            return self.maximum
+        delay = self.base + self.per_bcv * np.abs(jump)
+        return np.minimum(delay, self.maximum)
+
+    def __repr__(self):
+        return "SettleModel(base={0.base:g}, per_bcv={0.per_bcv:g}, " \
+               "maximum={0.maximum:g})".format(self)
+
+    @classmethod
+    def fit(cls, jumps, delays, maximum=None):
+        """
+        Fit the model to measured settle times.
+
+        Parameters
+        ----------
+        jumps (array) : the size of each measured move in BCV.
+        delays (array) : the measured settle time of each move in seconds.
+        maximum (float) : optional. The upper limit of the model. The largest
+            measured delay is used if not given.
+
+        Returns
+        -------
+        model (SettleModel)
+        """
+        jumps = np.abs(np.asarray(jumps, dtype=float))
+        delays = np.asarray(delays, dtype=float)
+
+        if np.unique(jumps).size < 2:
+            raise ValueError("At least two different jump sizes are needed.")
+
+        per_bcv, base = np.polyfit(jumps, delays, 1)
+        if maximum is None:
+            maximum = delays.max()
+
+        return cls(max(base, 0.), max(per_bcv, 0.), maximum)
+
+    @classmethod
+    def load(cls, filename=SETTLE_FILE):
+        """Read a model saved with `save`, or the default one if missing."""
+        if not os.path.exists(filename):
+            return cls()
+        with open(filename) as f:
+            return cls(**json.load(f))
+
+    def save(self, filename=SETTLE_FILE):
+        with open(filename, 'w') as f:
+            json.dump(dict(base=self.base, per_bcv=self.per_bcv,
+                           maximum=self.maximum), f, indent=2)
+        log.debug("Saved settle model to {:s}".format(filename))
+
+
+def poll_result(message, t_end, timeout):
+    """
+    Tell what to do with one reply to the FP status while waiting for the FP
+    to settle. Shared by every `wait_until_stable`.
+
+    Parameters
+    ----------
+    message (string) : the reply to the FP status.
+    t_end (float) : the time.monotonic() value when to give up.
+    timeout (float) : the whole wait in seconds, for the warning.
+
+    Returns
+    -------
+    stable (bool) : True if the FP reported it is stable, False if it timed
+        out or if the plugin does not report the FP status, None to poll
+        again.
+    """
+    reply = protocol.parse_reply(message)
+
+    if reply.status == "STABLE":
+        return True
+    if reply.status == "ERROR":
+        return False
+    if time.monotonic() > t_end:
+        log.warning("FP not stable after {:.2f} s.".format(timeout))
+        return False
+
+    return None
+
+
+def wait_until_stable(timeout, interval=0.01, cancel=None):
+    """
+    Poll the FP status until it reports it is stable.
+
+    Parameters
+    ----------
+    timeout (float) : give up after this many seconds.
+    interval (float) : seconds between two polls.
+    cancel (CancelToken) : optional. Stops polling when it is cancelled.
+
+    Returns
+    -------
+    stable (bool) : True if the FP reported it is stable, False if it timed
+        out or if the plugin does not report the FP status.
+    """
+    t_end = time.monotonic() + timeout
+
+    while True:
+        stable = poll_result(scan.fp_status(cancel=cancel), t_end, timeout)
+        if stable is not None:
+            return stable
+
+        if cancel is not None:
+            cancel.sleep(interval)
+        else:
+            time.sleep(interval)
+
+
+def calibrate(z_start, jumps, repeat=3, interval=0.005, timeout=5.):
+    """
+    Measure how long the FP takes to settle after each move is acknowledged,
+    for moves of different sizes, and fit a settle model. Requires a plugin
+    that reports the FP status.
+
+    Parameters
+    ----------
+    z_start (int) : the FP position every move starts from in BCV.
+    jumps (list) : the move sizes in BCV.
+    repeat (int) : how many times each move is measured.
+    interval (float) : seconds between two status polls.
+    timeout (float) : longest time to wait for a single move to settle.
+
+    Returns
+    -------
+    model (SettleModel) : the fitted model.
+    """
+    measured_jumps = []
+    delays = []
+
+    for jump in jumps:
+        for i in range(repeat):
+            scan.fp_moveabs(int(z_start))
+            wait_until_stable(timeout, interval)
+
+            scan.fp_moveabs(int(z_start + jump))
+            t0 = time.monotonic()
+            if not wait_until_stable(timeout, interval):
+                raise RuntimeError(
+                    "Could not measure the settle time of a {:d} BCV "
+                    "jump.".format(int(jump)))
+
+            measured_jumps.append(jump)
+            delays.append(time.monotonic() - t0)
+
+    model = SettleModel.fit(measured_jumps, delays)
+    log.info("Fitted {}".format(model))
+
+    return model
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Measure the FP settle time and save the fitted model.")
+    parser.add_argument('--z-start', type=int, default=2048,
+                        help="FP position every move starts from [bcv]")
+    parser.add_argument('--jumps', type=int, nargs='+',
+                        default=[1, 3, 10, 30, 100, 400],
+                        help="move sizes to measure [bcv]")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default=SETTLE_FILE)
+    args = parser.parse_args()
+
+    model = calibrate(args.z_start, args.jumps, repeat=args.repeat)
+    model.save(args.output)
+    print(model)
+
+
+if __name__ == "__main__":
+    main()
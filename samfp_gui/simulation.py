@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    Simulated instrument on a virtual clock. The scan runs with the real
+    ScanEngine against the mock plugin, but every wait, on both sides of the
+    connection, only advances a clock shared by all the threads, so hours of
+    observation run in seconds and still take the time the instrument would.
+"""
+
+from __future__ import print_function, division
+
+import logging
+import threading
+
+from . import runner, scan
+from .engine import ScanEngine
+from .instrument import Recorder
+from .mock_server import MockPlugin, PluginState
+from .settle import SettleModel
+
+log = logging.getLogger("samfp.simulation")
+
+# Instrument timing used unless told otherwise, in seconds
+READOUT_TIME = 5.
+MOVE_TIME = 0.05
+
+# Virtual seconds between two checks for an abort while exposing
+POLL_INTERVAL = 10.
+
+
+class VirtualClock(object):
+
+    def __init__(self, start=0., idle=0.001):
+        """
+        A clock shared by several threads that only moves when all of them
+        wait. `sleep` blocks its thread until the virtual time reaches its
+        deadline. Once no thread has used the clock for `idle` real seconds,
+        the time jumps to the earliest deadline. A thread blocked on anything
+        else, e.g. a socket waiting for a reply from another thread, counts
+        as waiting.
+
+        Parameters
+        ----------
+        start (float) : the initial time in seconds.
+        idle (float) : real seconds without activity before the time jumps.
+        """
+        self.idle = idle
+        self.n_jumps = 0
+        self._now = start
+        self._deadlines = []
+        self._activity = 0
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return "VirtualClock({:.3f})".format(self._now)
+
+    def monotonic(self):
+        """The current virtual time in seconds."""
+        with self._condition:
+            self._activity += 1
+            return self._now
+
+    def sleep(self, seconds):
+        """Block until the virtual time advanced by `seconds`."""
+        with self._condition:
+            deadline = self._now + max(float(seconds), 0.)
+            self._deadlines.append(deadline)
+            self._activity += 1
+            self._condition.notify_all()
+            try:
+                while self._now < deadline:
+                    seen = self._activity
+                    self._condition.wait(self.idle)
+                    if self._activity == seen and self._now < deadline:
+                        # Every thread waits: jump to the first deadline
+                        self._now = min(self._deadlines)
+                        self.n_jumps += 1
+                        self._activity += 1
+                        self._condition.notify_all()
+            finally:
+                self._deadlines.remove(deadline)
+
+
+class Simulator(object):
+
+    def __init__(self, settle=None, readout_time=READOUT_TIME,
+                 move_time=MOVE_TIME, move_time_per_bcv=0., idle=0.001):
+        """
+        A mock plugin on a virtual clock. Inside the `with` block every
+        command of the scan module goes to it instead of the instrument,
+        and `prepare` builds an engine that waits on the same clock.
+
+            with Simulator() as simulator:
+                engine = simulator.prepare(config)
+                engine.run()
+            simulator.elapsed  # seconds the scan would take
+
+        The exposures take the exposure time they are given, followed by
+        the readout of every frame; FP moves take `move_time` plus
+        `move_time_per_bcv` per BCV; the engine waits for the settle time
+        of its model and for the pause after the intermediate moves.
+
+        Parameters
+        ----------
+        settle (SettleModel or float) : optional. Defaults to the saved model.
+        readout_time (float) : seconds to read out each frame.
+        move_time (float) : seconds spent on every FP move.
+        move_time_per_bcv (float) : extra seconds per BCV of the FP jump.
+        idle (float) : see VirtualClock.
+        """
+        self.clock = VirtualClock(idle=idle)
+        self.settle = settle if settle is not None else SettleModel.load()
+        self.readout_time = readout_time
+        self.state = PluginState(move_delay=move_time,
+                                 move_delay_per_bcv=move_time_per_bcv,
+                                 readout_delay=readout_time,
+                                 sleep=self.clock.sleep,
+                                 clock=self.clock.monotonic,
+                                 poll_interval=POLL_INTERVAL)
+        self.engine = None
+        self._plugin = None
+        self._address = None
+        self._t0 = None
+
+    def __enter__(self):
+        self._plugin = MockPlugin(host="localhost", port=0, state=self.state)
+        self._plugin.start()
+        self._address = scan.HOST, scan.PORT
+        scan.HOST, scan.PORT = self._plugin.host, self._plugin.port
+        self._t0 = self.clock.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        scan.close_lanes()
+        scan.close_connection()
+        scan.HOST, scan.PORT = self._address
+        # Nothing the simulation set is known by the instrument
+        scan.invalidate_remote_state()
+        self._plugin.stop()
+        self._plugin = None
+
+    @property
+    def elapsed(self):
+        """Virtual seconds since the simulation started."""
+        return self.clock.monotonic() - self._t0
+
+    def prepare(self, config, cancel=None):
+        """
+        Send the settings of a scan to the simulated plugin and build the
+        engine that runs it. Nothing is written to the scan journal.
+
+        Parameters
+        ----------
+        config (ScanConfig) : the scan to simulate.
+        cancel (CancelToken) : optional. Cancelling it aborts the scan.
+
+        Returns
+        -------
+        engine (ScanEngine) : ready to `run` inside the `with` block.
+        """
+        runner.send_settings(config)
+        self.engine = ScanEngine(config.plan, config.exptime, config.nframes,
+                                 settle=self.settle,
+                                 pipelined=config.pipelined,
+                                 readout_time=self.readout_time,
+                                 recorder=Recorder(), cancel=cancel,
+                                 clock=self.clock.monotonic,
+                                 sleep=self.clock.sleep)
+        return self.engine
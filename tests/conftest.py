@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+    Fixtures shared by the tests: a mock plugin the scan module talks to and
+    a journal directory that is not the observer's.
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_home = None
+
+
+def pytest_configure(config):
+    # The settle and overhead models, the queue and the GUI configuration
+    # live in ~, whose path the modules read when they are imported, so it
+    # is replaced before any test module imports them.
+    global _home
+    _home = tempfile.mkdtemp(prefix='samfp_home_')
+    os.environ['HOME'] = _home
+
+
+def pytest_unconfigure(config):
+    if _home is not None:
+        shutil.rmtree(_home, ignore_errors=True)
+
+
+@pytest.fixture
+def plugin():
+    """A MockPlugin on a free port, used by every scan.* command."""
+    from samfp_gui import scan
+    from samfp_gui.mock_server import MockPlugin, PluginState
+
+    server = MockPlugin(host='localhost', port=0, state=PluginState())
+    server.start()
+    address = scan.HOST, scan.PORT
+    scan.HOST, scan.PORT = server.host, server.port
+    scan.invalidate_remote_state()
+    try:
+        yield server
+    finally:
+        scan.close_lanes()
+        scan.close_connection()
+        scan.invalidate_remote_state()
+        scan.HOST, scan.PORT = address
+        server.stop()
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    """Keep the scan journals in a temporary directory."""
+    from samfp_gui import journal
+
+    directory = str(tmp_path / 'journal')
+    monkeypatch.setattr(journal, 'JOURNAL_DIR', directory)
+    return directory
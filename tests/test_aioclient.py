@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import asyncio
+import time
+
+import pytest
+
+from samfp_gui.aioclient import AsyncClient, AsyncScanRunner
+from samfp_gui.journal import ScanJournal
+from samfp_gui.plan import ScanPlan
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10.))
+
+
+def test_batch_sends_settings_in_one_write(plugin):
+
+    async def main():
+        async with AsyncClient(timeout=5.) as client:
+            async with client.batch() as b:
+                assert await client.set_scan_current_sweep(1) == "QUEUED"
+                assert await client.set_scan_current_z(20) == "QUEUED"
+            # Unchanged values are not sent again
+            n_commands = plugin.state.n_commands
+            assert await client.set_scan_current_z(20) == "DONE"
+            assert plugin.state.n_commands == n_commands
+            return b.replies
+
+    assert run(main()) == ["DONE", "DONE"]
+    assert plugin.state.dbs['FAPERSWP'] == '1'
+    assert plugin.state.dbs['FAPERSST'] == '20'
+
+
+def test_exposure_is_not_written_into_a_stream_closed_while_idle(plugin):
+    plugin.idle_timeout = 0.05
+
+    async def main():
+        async with AsyncClient(timeout=5.) as client:
+            await client.fp_moveabs(10)
+            await asyncio.sleep(0.2)
+            assert client.is_stale
+            assert await client.expose() == "DONE"
+            assert not client.is_stale
+
+    run(main())
+    assert plugin.state.n_exposures == 1
+
+
+def test_idempotent_command_is_resent_on_a_dead_stream(plugin):
+    plugin.idle_timeout = 0.05
+
+    async def main():
+        async with AsyncClient(timeout=5.) as client:
+            await client.fp_moveabs(10)
+            # Closed by the plugin while the loop was busy, so the client
+            # only finds out once it writes to it
+            time.sleep(0.2)
+            assert not client.is_stale
+            return await client.fp_moveabs(20)
+
+    assert run(main()) == "DONE"
+    assert plugin.state.z == 20
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_runner_exposes_every_channel(plugin, journal_dir, pipelined):
+    plan = ScanPlan(2000, -10, 3, n_sweeps=2)
+    journal = ScanJournal('SCAN_1')
+    journal.write_start(plan, 0.01, 1)
+    runner = AsyncScanRunner(plan, 0.01, settle=0, pipelined=pipelined,
+                             journal=journal, timeout=5.)
+    steps = []
+    runner.on_step = lambda step, sweep, channel, z: steps.append(z)
+
+    assert run(runner.run()) == 6
+    assert plugin.state.n_exposures == 6
+    assert steps == [2000, 1990, 1980] * 2
+    assert journal.entries[-1]['status'] == 'done'
+
+
+def test_cancel_aborts_the_exposure(plugin, journal_dir):
+    plugin.state.exposure_delay = 10.
+    journal = ScanJournal('SCAN_1')
+    journal.write_start(ScanPlan(2000, -10, 3), 10., 1)
+    runner = AsyncScanRunner(ScanPlan(2000, -10, 3), 10., settle=0,
+                             journal=journal, timeout=5.)
+
+    async def main():
+        asyncio.get_running_loop().call_later(0.2, runner.abort)
+        await runner.run()
+
+    t0 = time.monotonic()
+    with pytest.raises(asyncio.CancelledError):
+        run(main())
+    assert time.monotonic() - t0 < 2.
+    assert runner.abort_latency < 1.
+    assert plugin.state.n_aborts == 1
+    assert journal.entries[-1]['status'] == 'aborted'
+
+
+def test_cancel_is_not_masked_by_a_failed_abort(plugin, journal_dir,
+                                                monkeypatch):
+    plugin.state.exposure_delay = 10.
+
+    async def abort_exposure(self, timeout=None):
+        raise ConnectionRefusedError("The plugin is gone.")
+
+    monkeypatch.setattr(AsyncClient, 'abort_exposure', abort_exposure)
+    journal = ScanJournal('SCAN_1')
+    journal.write_start(ScanPlan(2000, -10, 3), 10., 1)
+    runner = AsyncScanRunner(ScanPlan(2000, -10, 3), 10., settle=0,
+                             journal=journal, timeout=5.)
+
+    async def main():
+        asyncio.get_running_loop().call_later(0.2, runner.abort)
+        await runner.run()
+
+    with pytest.raises(asyncio.CancelledError):
+        run(main())
+    assert journal.entries[-1]['status'] == 'aborted'
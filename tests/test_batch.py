@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import time
+
+import pytest
+
+from samfp_gui import protocol, scan
+from samfp_gui.connection import Connection
+
+
+@pytest.fixture
+def no_single_sends(monkeypatch):
+    """Fail if a command is sent on its own instead of pipelined."""
+    def send(self, command, cancel=None, timeout=None):
+        raise AssertionError("{!r} was not batched".format(command))
+
+    monkeypatch.setattr(Connection, 'send', send)
+
+
+def test_settings_are_sent_in_one_write(plugin, no_single_sends):
+    with scan.batch() as b:
+        assert scan.set_scan_current_sweep(2) == scan.QUEUED
+        assert scan.set_scan_current_z(10) == scan.QUEUED
+        assert scan.set_image_basename('fp') == scan.QUEUED
+        assert plugin.state.n_commands == 0
+
+    assert b.replies == ["DONE"] * 3
+    assert b.ok
+    assert plugin.state.dbs == {'FAPERSWP': '2', 'FAPERSST': '10'}
+    assert plugin.state.dhe == {'image.basename': 'fp'}
+    assert ['dhe dbs set', 'FAPERSST', '10'] in scan.get_remote_state()
+
+
+def test_a_setting_queued_twice_is_sent_once(plugin, no_single_sends):
+    with scan.batch() as b:
+        scan.set_scan_current_z(10)
+        scan.set_image_basename('fp')
+        scan.set_scan_current_z(20)
+
+    assert len(b) == 2
+    assert plugin.state.n_commands == 2
+    assert plugin.state.dbs['FAPERSST'] == '20'
+
+
+def test_nested_batches_join_the_outer_one(plugin, no_single_sends):
+    with scan.batch() as outer:
+        scan.set_scan_current_sweep(1)
+        with scan.batch() as inner:
+            scan.set_scan_current_z(10)
+        assert inner is outer
+        assert plugin.state.n_commands == 0
+
+    assert outer.replies == ["DONE", "DONE"]
+
+
+def test_nothing_is_sent_if_the_block_raises(plugin):
+    with pytest.raises(RuntimeError):
+        with scan.batch():
+            scan.set_scan_current_z(10)
+            raise RuntimeError()
+
+    assert plugin.state.n_commands == 0
+    # Not taken for acknowledged either
+    assert scan.set_scan_current_z(10) == "DONE"
+    assert plugin.state.dbs['FAPERSST'] == '10'
+
+
+def test_rejected_settings_are_not_cached(plugin):
+    handle = plugin.state.handle
+    plugin.state.handle = lambda command: \
+        "ERROR: read only" if "FAPERSWP" in command else handle(command)
+
+    with scan.batch() as b:
+        scan.set_scan_current_sweep(1)
+        scan.set_scan_current_z(10)
+
+    assert not b.ok
+    assert protocol.is_error(b.replies[0])
+    assert scan.get_remote_state() == [['dhe dbs set', 'FAPERSST', '10']]
+
+
+def test_commands_go_one_by_one_once_a_pipelined_write_times_out(
+        plugin, monkeypatch):
+    monkeypatch.setattr(scan, 'BATCH_TIMEOUT', 0.1)
+    monkeypatch.setattr(scan, '_pipeline_failed', False)
+    handle = plugin.state.handle
+
+    def slow(command):
+        time.sleep(0.3)
+        return handle(command)
+
+    plugin.state.handle = slow
+    with scan.batch() as b:
+        scan.set_scan_current_sweep(1)
+        scan.set_scan_current_z(10)
+    assert scan._pipeline_failed
+    assert b.replies == ["DONE", "DONE"]
+    assert plugin.state.dbs == {'FAPERSWP': '1', 'FAPERSST': '10'}
+
+    plugin.state.handle = handle
+    sent = []
+    send = Connection.send
+    monkeypatch.setattr(Connection, 'send', lambda self, command, **kw: (
+        sent.append(command), send(self, command, **kw))[1])
+    with scan.batch() as b:
+        scan.set_scan_current_sweep(2)
+        scan.set_scan_current_z(20)
+    assert len(sent) == 2
+    assert b.ok
+
+
+def test_commands_go_one_by_one_if_the_plugin_closes_a_pipelined_write(
+        plugin, monkeypatch):
+    monkeypatch.setattr(scan, '_pipeline_failed', False)
+    plugin.one_shot = True
+
+    with scan.batch() as b:
+        scan.set_scan_current_sweep(1)
+        scan.set_scan_current_z(10)
+    assert b.replies == ["DONE", "DONE"]
+    assert plugin.state.dbs == {'FAPERSWP': '1', 'FAPERSST': '10'}
+    # Only this write failed
+    assert not scan._pipeline_failed
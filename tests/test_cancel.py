@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import threading
+import time
+
+import pytest
+
+from samfp_gui import scan
+from samfp_gui.cancel import Cancelled, CancelToken
+from samfp_gui.engine import ScanEngine
+from samfp_gui.journal import ScanJournal
+from samfp_gui.plan import ScanPlan
+
+
+def cancel_later(token, seconds):
+    timer = threading.Timer(seconds, token.cancel)
+    timer.start()
+    return timer
+
+
+def test_sleep_wakes_up_when_cancelled():
+    token = CancelToken()
+    cancel_later(token, 0.05)
+
+    t0 = time.monotonic()
+    with pytest.raises(Cancelled):
+        token.sleep(10.)
+    assert time.monotonic() - t0 < 1.
+    assert token.is_cancelled
+    assert token.latency >= 0
+
+
+def test_check():
+    token = CancelToken()
+    token.check()
+    token.cancel()
+    token.cancel()
+    with pytest.raises(Cancelled):
+        token.check()
+
+
+def test_command_gives_up_waiting_for_its_reply(plugin):
+    plugin.state.exposure_delay = 10.
+    token = CancelToken(interval=0.01)
+    cancel_later(token, 0.1)
+
+    t0 = time.monotonic()
+    with pytest.raises(Cancelled):
+        scan.expose(cancel=token)
+    assert time.monotonic() - t0 < 1.
+    # The late reply is not read as the reply of the next command
+    plugin.state.abort()
+    assert scan.fp_status() == "STABLE 0"
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_abort_interrupts_the_exposure(plugin, journal_dir, pipelined):
+    plugin.state.exposure_delay = 10.
+    journal = ScanJournal('SCAN_1')
+    journal.write_start(ScanPlan(2000, -10, 3), 10., 1)
+    engine = ScanEngine(ScanPlan(2000, -10, 3), 10., settle=0,
+                        pipelined=pipelined, journal=journal)
+    threading.Timer(0.2, engine.abort).start()
+
+    t0 = time.monotonic()
+    assert engine.run() == 0
+    assert time.monotonic() - t0 < 2.
+    assert engine.abort_latency < 1.
+    assert plugin.state.n_aborts == 1
+    assert plugin.state.n_exposures == 0
+    assert journal.entries[-1]['status'] == 'aborted'
+
+
+def test_stop_lets_the_channel_finish(plugin, journal_dir):
+    engine = ScanEngine(ScanPlan(2000, -10, 3), 0.01, settle=0)
+    engine.on_step = lambda step, sweep, channel, z: engine.stop()
+
+    assert engine.run() == 1
+    assert plugin.state.n_exposures == 1
+    assert plugin.state.n_aborts == 0
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import threading
+import time
+
+import pytest
+
+from samfp_gui import protocol, scan
+
+
+@pytest.fixture
+def slow_plugin(plugin):
+    """Every command takes 0.2 s."""
+    handle = plugin.state.handle
+
+    def slow(command):
+        time.sleep(0.2)
+        return handle(command)
+
+    plugin.state.handle = slow
+    return plugin
+
+
+def test_subsystem():
+    assert protocol.subsystem(protocol.FP_MOVEABS(10)) == 'fp'
+    assert protocol.subsystem("DHE dbs set FAPERSST 10") == 'dhe'
+
+
+def test_fp_and_dhe_commands_are_sent_at_the_same_time(slow_plugin,
+                                                       monkeypatch):
+    monkeypatch.setattr(scan, 'CONCURRENT', True)
+
+    t0 = time.monotonic()
+    with scan.batch() as b:
+        scan.fp_moveabs(10)
+        scan.set_scan_current_z(10)
+    assert time.monotonic() - t0 < 0.35
+    assert b.replies == ["DONE", "DONE"]
+    assert slow_plugin.state.z == 10
+    assert slow_plugin.state.dbs['FAPERSST'] == '10'
+
+    # The FP lane keeps its connection for the next batch
+    lane = scan._lane('fp')
+    assert lane.submit(lambda: scan.get_connection().n_connects).result() \
+        == 1
+    assert lane.submit(threading.current_thread).result() is not \
+        threading.current_thread()
+
+
+def test_replies_keep_the_order_of_the_commands(plugin):
+    handle = plugin.state.handle
+    plugin.state.handle = lambda command: \
+        "ERROR: read only" if "FAPERSWP" in command else handle(command)
+
+    with scan.batch() as b:
+        scan.fp_moveabs(10)
+        scan.set_scan_current_sweep(1)
+        scan.set_scan_current_z(10)
+    assert b.replies[0] == "DONE"
+    assert protocol.is_error(b.replies[1])
+    assert b.replies[2] == "DONE"
+
+
+def test_concurrent_dispatch_can_be_turned_off(slow_plugin, monkeypatch):
+    monkeypatch.setattr(scan, 'CONCURRENT', False)
+
+    t0 = time.monotonic()
+    with scan.batch():
+        scan.fp_moveabs(10)
+        scan.set_scan_current_z(10)
+    assert time.monotonic() - t0 >= 0.4
+    assert scan._lanes == {}
+
+
+def test_close_lanes(plugin):
+    with scan.batch():
+        scan.fp_moveabs(10)
+        scan.set_scan_current_z(10)
+    assert 'fp' in scan._lanes
+
+    scan.close_lanes()
+    assert scan._lanes == {}
+    with scan.batch() as b:
+        scan.fp_moveabs(20)
+        scan.set_scan_current_z(20)
+    assert b.ok
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import configparser
+import json
+import os
+
+import pytest
+
+from samfp_gui import sequence
+from samfp_gui.config import ScanConfig
+from samfp_gui.plan import ScanPlan
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, 'examples',
+                       'example01.cfg')
+
+PLAN_FILE = """
+[image]
+basename = fp
+dir = /data
+binning = 2
+comment = Ha
+title = NGC 1068
+type = object
+
+[obs]
+exptime = 30
+nframes = 2
+
+[scan]
+zstart = 2000
+zstep = -10
+nchannels = 30
+nsweeps = 2
+pipelined = yes
+"""
+
+
+def test_settings_are_validated():
+    plan = ScanPlan(2000, -10, 3)
+    config = ScanConfig(plan, '2.5', nframes='3', binning='2',
+                        image_type='dark')
+    assert config.exptime == 2.5
+    assert config.nframes == 3
+    assert config.binning == 2
+    assert config.image_type == 'DARK'
+    assert config.n_steps == 3
+
+    for kwargs in [dict(exptime=-1), dict(exptime=1, nframes=0),
+                   dict(exptime=1, binning=3),
+                   dict(exptime=1, image_type='BIAS')]:
+        with pytest.raises(ValueError):
+            ScanConfig(plan, **kwargs)
+    with pytest.raises(TypeError):
+        ScanConfig(plan.to_dict(), 1.)
+
+
+def test_config_is_immutable():
+    config = ScanConfig(ScanPlan(2000, -10, 3), 1.)
+    with pytest.raises(AttributeError):
+        config.exptime = 2.
+    assert config._replace(exptime=2.).exptime == 2.
+    assert config.exptime == 1.
+
+
+def test_dict_round_trip():
+    config = ScanConfig(ScanPlan(2000, -10, 3, 2, max_jump=5), 1.,
+                        title='NGC 1068', pipelined=True)
+    d = json.loads(json.dumps(config.to_dict()))
+    assert ScanConfig.from_dict(d).to_dict() == config.to_dict()
+
+    with pytest.raises(KeyError):
+        ScanConfig.from_dict(dict(exptime=1.))
+
+
+def test_from_gui_file():
+    cfg = configparser.RawConfigParser()
+    assert cfg.read(EXAMPLE)
+
+    config = ScanConfig.from_config(cfg)
+    assert config.plan.n_channels == 37
+    assert config.plan.max_jump == sequence.MAX_JUMP
+    assert config.basename == 'dummy'
+    assert config.binning == 4
+    assert not config.pipelined
+
+    calib = ScanConfig.from_config(cfg, 'calib')
+    assert (calib.plan.n_channels, calib.plan.n_sweeps) == (5, 5)
+
+    cfg.set('gui', 'active_page', '1')
+    assert ScanConfig.from_config(cfg).to_dict() == calib.to_dict()
+
+
+def test_from_plan_file():
+    cfg = configparser.RawConfigParser()
+    cfg.read_string(PLAN_FILE)
+
+    config = ScanConfig.from_config(cfg)
+    assert config.plan.to_dict() == ScanPlan(
+        2000, -10, 30, 2, max_jump=sequence.MAX_JUMP).to_dict()
+    assert (config.exptime, config.nframes) == (30., 2)
+    assert (config.path, config.binning) == ('/data', 2)
+    assert config.image_type == 'OBJECT'
+    assert config.pipelined
+
+    cfg.remove_option('obs', 'exptime')
+    with pytest.raises(configparser.Error):
+        ScanConfig.from_config(cfg)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import socket
+import time
+
+import pytest
+
+from samfp_gui import protocol, scan
+from samfp_gui.connection import Connection
+from samfp_gui.mock_server import MockPlugin
+
+
+def test_one_socket_for_every_command():
+    with MockPlugin(host='localhost', port=0) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        for z in range(10):
+            assert connection.send(protocol.FP_MOVEABS(z)) == "DONE"
+        assert connection.n_connects == 1
+        assert server.state.z == 9
+        assert len(connection.history) == 10
+
+
+def test_idempotent_command_is_resent_on_a_stale_socket():
+    with MockPlugin(host='localhost', port=0, idle_timeout=0.05) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        assert connection.send(protocol.FP_MOVEABS(10)) == "DONE"
+        time.sleep(0.2)
+        assert connection.send(protocol.FP_MOVEABS(20)) == "DONE"
+        assert connection.n_connects == 2
+        assert server.state.z == 20
+
+
+def test_exposure_is_not_written_into_a_socket_closed_while_idle():
+    with MockPlugin(host='localhost', port=0, idle_timeout=0.05) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        assert connection.send(protocol.FP_MOVEABS(10)) == "DONE"
+        time.sleep(0.2)
+        assert connection.send(protocol.EXPOSE) == "DONE"
+        assert connection.n_connects == 2
+        assert server.state.n_exposures == 1
+
+
+def test_close_if_stale_keeps_a_live_socket():
+    with MockPlugin(host='localhost', port=0) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        assert not connection.close_if_stale()
+        connection.send(protocol.FP_STATUS)
+        assert not connection.close_if_stale()
+        assert connection.is_connected
+
+
+def test_refused_connection_is_retried_then_raised():
+    with MockPlugin(host='localhost', port=0) as server:
+        host, port = server.host, server.port
+
+    connection = Connection(host, port, timeout=1., retries=2,
+                            retry_delay=0.01)
+    t0 = time.monotonic()
+    with pytest.raises(socket.error):
+        connection.send(protocol.FP_STATUS)
+    # Waited 0.01 then 0.02 s between the three attempts
+    assert time.monotonic() - t0 >= 0.03
+    assert not connection.is_connected
+
+
+def test_reply_timeout_closes_the_socket():
+    with MockPlugin(host='localhost', port=0, exposure_delay=1.) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        with pytest.raises(socket.timeout):
+            connection.send(protocol.EXPOSE, timeout=0.1)
+        assert not connection.is_connected
+        # The late reply is not read as the reply of the next command
+        assert connection.send(protocol.FP_STATUS) == "STABLE 0"
+
+
+def test_scan_connection_has_a_finite_timeout(plugin):
+    assert scan.get_connection().timeout == scan.REPLY_TIMEOUT
+    assert scan.exposure_timeout() == scan.EXPOSE_TIMEOUT
+
+    with scan.batch():
+        scan.set_image_exposure_time(30.)
+        scan.set_image_nframes(2)
+    assert scan.exposure_timeout() == 2 * (30. + scan.REPLY_TIMEOUT)
+
+
+def test_settings_are_sent_again_before_an_exposure(plugin):
+    plugin.idle_timeout = 0.05
+    scan.set_target_name('NGC 1068')
+    assert plugin.state.dhe['image.title'] == 'NGC_1068'
+
+    # The plugin was restarted while the connection was idle
+    time.sleep(0.2)
+    plugin.state.dhe.clear()
+
+    assert scan.expose() == "DONE"
+    assert plugin.state.n_exposures == 1
+    assert plugin.state.dhe['image.title'] == 'NGC_1068'
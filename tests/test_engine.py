@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import time
+
+import pytest
+
+from samfp_gui.engine import ScanEngine
+from samfp_gui.plan import ScanPlan
+
+EXPTIME = 0.1
+READOUT = 0.3
+
+
+@pytest.fixture
+def timeline(plugin):
+    """The (command, received, answered) times of every command."""
+    plugin.state.exposure_delay = EXPTIME
+    plugin.state.readout_delay = READOUT
+    handle = plugin.state.handle
+    entries = []
+
+    def logged(command):
+        t0 = time.monotonic()
+        message = handle(command)
+        entries.append((command, t0, time.monotonic()))
+        return message
+
+    plugin.state.handle = logged
+    return entries
+
+
+def find(timeline, command):
+    matches = [(t0, t1) for c, t0, t1 in timeline if c == command]
+    assert len(matches) == 1, command
+    return matches[0]
+
+
+def exposures(timeline):
+    return [(t0, t1) for c, t0, t1 in timeline if c == "dhe expose"]
+
+
+def test_pipelined_moves_during_the_readout(plugin, timeline):
+    engine = ScanEngine(ScanPlan(2000, -10, 3), EXPTIME, settle=0,
+                        pipelined=True, shutter_margin=0.05)
+    assert engine.run() == 3
+
+    exposed = exposures(timeline)
+    assert len(exposed) == 3
+    for (t_open, t_read), z in zip(exposed, [1990, 1980]):
+        t_move, _ = find(timeline, "fp moveabs {:d}".format(z))
+        # After the shutter closed, before the readout is over
+        assert t_move >= t_open + EXPTIME
+        assert t_move < t_read
+
+
+def test_pipelined_headers_wait_for_the_readout(plugin, timeline):
+    engine = ScanEngine(ScanPlan(2000, -10, 3), EXPTIME, settle=0,
+                        pipelined=True, shutter_margin=0.05)
+    engine.run()
+
+    exposed = exposures(timeline)
+    for i, z in enumerate([1990, 1980]):
+        t_header, _ = find(timeline, "dhe dbs set FAPERSST {:d}".format(z))
+        _, t_moved = find(timeline, "fp moveabs {:d}".format(z))
+        assert t_header >= exposed[i][1]
+        # Interlock: the shutter opens once the FP is in place
+        assert exposed[i + 1][0] >= t_moved
+
+
+def test_serial_moves_after_the_readout(plugin, timeline):
+    engine = ScanEngine(ScanPlan(2000, -10, 3), EXPTIME, settle=0)
+    assert engine.run() == 3
+
+    exposed = exposures(timeline)
+    for (t_open, t_read), z in zip(exposed, [1990, 1980]):
+        t_move, _ = find(timeline, "fp moveabs {:d}".format(z))
+        assert t_move >= t_read
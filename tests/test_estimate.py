@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import json
+
+import pytest
+
+from samfp_gui import estimate
+from samfp_gui.journal import ScanJournal
+from samfp_gui.plan import ScanPlan
+
+MODEL = estimate.OverheadModel(base=0.4, per_bcv=0.01, first=3.,
+                               readout={4: 2.})
+
+
+def write_journal(directory, scan_id, plan, exptime, nframes, model,
+                  binning=4):
+    """Write the journal of a serial scan timed exactly as the model says."""
+    readout = model.readout_time(binning)
+    exposure = nframes * (exptime + readout)
+    t = 1000.
+    entries = [dict(type='start', scan_id=scan_id, plan=plan.to_dict(),
+                    exptime=exptime, nframes=nframes, time=t,
+                    settings=[['dhe set', 'binning',
+                               '{0:d} {0:d}'.format(binning)]])]
+    previous = None
+    for sweep, channel, z in plan:
+        jump = float('nan') if previous is None else z - previous
+        t += float(model.setup(jump)) + exposure
+        entries.append(dict(type='step', sweep=sweep, channel=channel, z=z,
+                            exposure=exposure, time=t))
+        previous = z
+    entries.append(dict(type='end', status='done', time=t))
+
+    with open(str(directory / (scan_id + '.jsonl')), 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    return ScanJournal(scan_id, str(directory))
+
+
+def test_serial_duration():
+    plan = ScanPlan(2000, -10, 5)
+    e = estimate.estimate(plan, 10., nframes=2, model=MODEL)
+
+    setup = MODEL.first + 4 * (MODEL.base + 10 * MODEL.per_bcv)
+    assert e.duration == pytest.approx(setup + 5 * (2 * 10. + 2 * 2.))
+    assert e.exposure == 5 * 2 * 10.
+    assert e.overhead == pytest.approx(e.duration - e.exposure)
+    assert e.efficiency == pytest.approx(e.exposure / e.duration)
+    assert e.uncertainty == 0
+
+
+def test_pipelined_hides_the_setup_in_the_readout():
+    plan = ScanPlan(2000, -10, 5, n_sweeps=2)
+    serial = estimate.estimate(plan, 10., model=MODEL)
+    pipelined = estimate.estimate(plan, 10., pipelined=True, model=MODEL)
+
+    assert pipelined.duration < serial.duration
+    assert pipelined.exposure == serial.exposure
+    # Every setup, the flyback too, is shorter than the readout minus the
+    # shutter margin, so all but the first are hidden
+    hidden = 8 * (MODEL.base + 10 * MODEL.per_bcv) + \
+        MODEL.base + 40 * MODEL.per_bcv
+    assert serial.duration - pipelined.duration == pytest.approx(hidden)
+
+
+def test_pipelined_waits_for_a_long_setup():
+    model = estimate.OverheadModel(base=0.4, per_bcv=0.01, first=3.,
+                                   readout={4: 1.})
+    plan = ScanPlan(2000, -100, 2)
+    e = estimate.estimate(plan, 10., pipelined=True, model=model)
+
+    # The second exposure starts after the margin and its setup, which last
+    # longer than the readout of the first
+    setup = 0.4 + 100 * 0.01
+    exposure = 10. + 1.
+    assert e.duration == pytest.approx(
+        3. + (10. + estimate.SHUTTER_MARGIN + setup) + exposure)
+
+
+def test_unmeasured_binning_uses_the_default_readout():
+    plan = ScanPlan(2000, -10, 3)
+    e = estimate.estimate(plan, 1., binning=2, model=MODEL)
+    assert e.duration == pytest.approx(
+        MODEL.first + 2 * (MODEL.base + 10 * MODEL.per_bcv) +
+        3 * (1. + estimate.READOUT_TIME))
+
+
+def test_fit_recovers_the_model(tmp_path):
+    journals = [
+        write_journal(tmp_path, 'SCAN_1', ScanPlan(2000, -5, 6, 2), 10., 1,
+                      MODEL),
+        write_journal(tmp_path, 'SCAN_2', ScanPlan(2000, -20, 4, 2), 5., 2,
+                      MODEL),
+    ]
+    model = estimate.OverheadModel.fit(journals)
+
+    assert model.readout == {4: pytest.approx(2.)}
+    assert model.first == pytest.approx(MODEL.first)
+    assert model.base == pytest.approx(MODEL.base)
+    assert model.per_bcv == pytest.approx(MODEL.per_bcv)
+    assert model.scatter == pytest.approx(0, abs=1e-6)
+    assert model.n_samples == 2 * (6 + 4) - 2
+
+
+def test_fit_needs_an_exposure(tmp_path):
+    journal = ScanJournal('SCAN_1', str(tmp_path))
+    with pytest.raises(ValueError):
+        estimate.OverheadModel.fit([journal])
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'overhead.json')
+    MODEL.save(filename)
+    model = estimate.OverheadModel.load(filename)
+    assert repr(model) == repr(MODEL)
+    assert model.readout_time(4) == 2.
+
+    default = estimate.OverheadModel.load(str(tmp_path / 'missing.json'))
+    assert repr(default) == repr(estimate.OverheadModel())
+
+
+def test_format_duration():
+    assert estimate.format_duration(3725.4) == "1:02:05"
+    assert estimate.format_duration(59.6) == "0:01:00"
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import pytest
+
+from samfp_gui import export
+from samfp_gui.plan import ScanPlan
+
+
+def test_scan_settings():
+    settings = export.scan_settings(2., 3, basename='fp', binning=4,
+                                    scan_id='SCAN_1', title='NGC 1068',
+                                    **{'image.comment': 'Ha'})
+    assert settings == [
+        ('dhe dbs set', 'FAPERSID', 'SCAN_1'),
+        ('dhe set', 'binning', '4 4'),
+        ('dhe set', 'obs.nimages', '3'),
+        ('dhe set', 'obs.exptime', '2.000000'),
+        ('dhe set', 'image.basename', 'fp'),
+        ('dhe set', 'image.comment', 'Ha'),
+        ('dhe set', 'image.title', 'NGC_1068'),
+    ]
+
+
+def test_commands():
+    assert export.commands(ScanPlan(100, -5, 2), settle=0.5) == [
+        "fp moveabs 100",
+        "dhe dbs set FPZINIT 100.000000",
+        "dhe dbs set FAPERSWP 1",
+        "dhe dbs set FAPERSST 100",
+        "sleep 0.5",
+        "dhe expose",
+        "fp moveabs 95",
+        "dhe dbs set FAPERSST 95",
+        "sleep 0.5",
+        "dhe expose",
+    ]
+
+
+def test_commands_pause_after_intermediate_moves():
+    plan = ScanPlan(100, -5, 2, n_sweeps=2, max_jump=3)
+    lines = export.commands(plan)
+
+    moves = [line for line in lines if line.startswith("fp moveabs")]
+    assert moves == ["fp moveabs {:d}".format(z)
+                     for z in [100, 97, 95, 98, 100, 97, 95]]
+    assert lines.count("sleep {:g}".format(plan.jump_pause)) == 3
+    assert lines.count("dhe expose") == 4
+    assert lines.count("dhe dbs set FAPERSWP 2") == 1
+    # The header of the second sweep is set once the flyback is over
+    i = lines.index("dhe dbs set FAPERSWP 2")
+    assert lines[i - 2:i] == ["fp moveabs 100",
+                              "dhe dbs set FPZINIT 100.000000"]
+
+
+def test_write_stream(tmp_path):
+    plan = ScanPlan(100, -5, 2)
+    filename = str(tmp_path / 'scan.txt')
+    export.write_stream(plan, filename, export.scan_settings(1.5))
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "# {!r}".format(plan)
+    assert lines[1:3] == ["dhe set obs.nimages 1",
+                          "dhe set obs.exptime 1.500000"]
+    assert lines[3:] == export.commands(plan)
+
+
+def test_csh_script_size_does_not_depend_on_the_channels(tmp_path):
+    def n_commands(n_channels):
+        filename = str(tmp_path / 'scan.csh')
+        plan = ScanPlan(2000, -1, n_channels)
+        export.write_csh(plan, filename, export.scan_settings(1.), settle=1)
+        with open(filename) as f:
+            text = f.read()
+        assert text.startswith("#!/bin/csh -f\n")
+        assert text.count("sami dhe expose") == 1
+        assert "set zs = (" in text
+        return text.count("sami ")
+
+    assert n_commands(3) == n_commands(300)
+
+
+def test_play(plugin, tmp_path):
+    plan = ScanPlan(100, -5, 3, n_sweeps=2)
+    filename = str(tmp_path / 'scan.txt')
+    export.write_stream(plan, filename,
+                        export.scan_settings(0.01, title='NGC 1068'))
+
+    n_settings = 3
+    assert export.play(filename) == \
+        n_settings + len(export.commands(plan))
+    assert plugin.state.n_exposures == 6
+    assert plugin.state.z == 90
+    assert plugin.state.dhe['image.title'] == 'NGC_1068'
+    assert plugin.state.dbs['FAPERSWP'] == '2'
+
+
+def test_play_stops_on_an_error(plugin, tmp_path):
+    filename = str(tmp_path / 'scan.txt')
+    with open(filename, 'w') as f:
+        f.write("fp moveabs 5000\ndhe expose\n")
+
+    with pytest.raises(IOError):
+        export.play(filename)
+    assert plugin.state.n_exposures == 0
+
+
+def test_csh_values_are_quoted(tmp_path):
+    filename = str(tmp_path / 'scan.csh')
+    settings = [('dhe set', 'binning', '4 4'),
+                ('dhe set', 'image.comment', "Don't stop!"),
+                ('dhe set', 'image.title', "$HOME `ls`")]
+    export.write_csh(ScanPlan(100, -5, 2), filename, settings)
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert "sami dhe set binning 4 4" in lines
+    assert "sami dhe set image.comment 'Don'\\''t stop\\!'" in lines
+    assert "sami dhe set image.title '$HOME `ls`'" in lines
+
+
+def test_csh_rejects_line_breaks(tmp_path):
+    filename = tmp_path / 'scan.csh'
+    with pytest.raises(ValueError):
+        export.write_csh(ScanPlan(100, -5, 2), str(filename),
+                         [('dhe set', 'image.comment', "Ha\nNII")])
+    assert not filename.exists()
+
+
+def test_csh_script_gets_a_new_scan_id_when_it_runs(tmp_path):
+    filename = str(tmp_path / 'scan.csh')
+    export.write_csh(ScanPlan(100, -5, 2), filename, export.scan_settings(
+        1., scan_id=export.NEW_SCAN_ID))
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert "set scan_id = SCAN_`date -u +%Y%m%d_UTC%H%M%S`" in lines
+    assert "sami dhe dbs set FAPERSID $scan_id" in lines
+
+
+def test_stream_gets_a_new_scan_id_when_played(plugin, journal_dir,
+                                               tmp_path):
+    filename = str(tmp_path / 'scan.txt')
+    export.write_stream(ScanPlan(100, -5, 2), filename, export.scan_settings(
+        0.01, scan_id=export.NEW_SCAN_ID))
+
+    export.play(filename)
+    first = plugin.state.dbs['FAPERSID']
+    assert first.startswith('SCAN_')
+
+    export.play(filename)
+    assert plugin.state.dbs['FAPERSID'] != first
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import math
+
+import pytest
+
+from samfp_gui.graph import Graph
+
+
+@pytest.fixture
+def graph():
+    """b = 2 a, c = b + 1, d = a + x"""
+    g = Graph()
+    g.input('a', 1)
+    g.input('x', 10)
+    g.derived('b', ['a'], lambda a: 2 * a)
+
+    @g.derived('c', ['b'])
+    def c(b):
+        return b + 1
+
+    g.derived('d', ['a', 'x'], lambda a, x: a + x)
+    return g
+
+
+def test_values_are_computed_once_when_read(graph):
+    assert graph.is_stale('c')
+    assert graph['c'] == 3
+    assert graph.n_evaluations == 2
+    assert graph['c'] == 3
+    assert graph.n_evaluations == 2
+    assert not graph.is_stale('b')
+
+
+def test_only_the_downstream_nodes_are_recomputed(graph):
+    graph['c'], graph['d']
+    n = graph.n_evaluations
+
+    assert graph.update(x=20) == ['x']
+    assert graph.is_stale('d')
+    assert not graph.is_stale('c')
+    assert graph['c'] == 3
+    assert graph['d'] == 21
+    assert graph.n_evaluations == n + 1
+
+    graph.set('a', 2)
+    assert graph['c'] == 5
+    assert graph.n_evaluations == n + 3
+
+
+def test_setting_the_same_value_changes_nothing(graph):
+    graph['c']
+    assert not graph.set('a', 1)
+    assert not graph.is_stale('c')
+
+    graph.set('x', float('nan'))
+    graph['d']
+    assert graph.update(x=float('nan'), a=1) == []
+    assert not graph.is_stale('d')
+    assert math.isnan(graph['d'])
+
+
+def test_invalid_graphs_are_rejected(graph):
+    with pytest.raises(ValueError):
+        graph.input('a')
+    with pytest.raises(ValueError):
+        graph.derived('e', ['a', 'f'], max)
+    with pytest.raises(ValueError):
+        graph.set('b', 3)
+    assert 'e' not in graph
+
+
+def test_science_graph():
+    pytest.importorskip('PyQt5')
+    from samfp_gui.pages import science_graph
+
+    g = science_graph()
+    g.update(rest_wavelength=6562.8, mode="Observed wavelength [A]",
+             value=6583.4, qgc=10., finesse=15., sample=2.)
+    assert g['redshift'] == pytest.approx(20.6 / 6562.8)
+    assert g['observed_wavelength'] == pytest.approx(6583.4)
+    assert g['sci_fsr'] == pytest.approx(658.34)
+    assert g['n_channels'] == 31
+    assert g['z_step'] < 0
+
+    g.update(mode="Redshift", value=0.)
+    assert g['velocity'] == 0.
+    assert g['observed_wavelength'] == pytest.approx(6562.8)
+
+    g.set('qgc', 0.)
+    assert math.isnan(g['sci_fsr'])
+    assert g['n_channels'] == 31
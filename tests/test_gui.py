@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import configparser
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+
+from samfp_gui import gui, sequence  # noqa: E402
+from samfp_gui.config import ScanConfig  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def window(app, plugin, journal_dir, tmp_path, monkeypatch):
+    """The main window, with its pages built, talking to the mock plugin."""
+    monkeypatch.setattr(gui.MainWindow, 'temp_cfg_file',
+                        str(tmp_path / 'temp.cfg'))
+    w = gui.MainWindow()
+    w.finish_startup()
+    try:
+        yield w
+    finally:
+        wait_until(app, lambda: not w.centralWidget().worker_busy)
+        w.close()
+
+
+def wait_until(app, condition, timeout=10.):
+    """Run the Qt event loop until the condition is met."""
+    t_end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < t_end, "Timed out"
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def set_scan(central, n_channels, exptime):
+    central.page_scan.z_start(2000)
+    central.page_scan.z_step(-10)
+    central.page_scan.n_channels(n_channels)
+    central.page_scan.n_sweeps(1)
+    central.exp_time(exptime)
+    # Without the pauses of the intermediate moves
+    central.max_jump(0)
+
+
+def test_start_after_abort_never_waits_for_the_worker(app, window, plugin):
+    central = window.centralWidget()
+    set_scan(central, 3, 0.5)
+
+    central.scan_start()
+    assert central.worker_busy
+    assert not central.scan_button.isEnabled()
+    wait_until(app, lambda: plugin.state.n_commands > 10)
+
+    central.scan_abort()
+    t0 = time.monotonic()
+    central.scan_start()
+    central.scan_resume()
+    central.queue_run()
+    # The thread may still be unwinding the aborted scan
+    assert time.monotonic() - t0 < 0.1
+    assert not central.scan_button.isEnabled()
+    assert not central.resume_button.isEnabled()
+
+    wait_until(app, lambda: not central.worker_busy)
+    assert central.scan_button.isEnabled()
+    assert central.resume_button.isEnabled()
+    assert plugin.state.n_exposures < 3
+
+    n_exposures = plugin.state.n_exposures
+    set_scan(central, 2, 0.01)
+    central.scan_start()
+    wait_until(app, lambda: not central.worker_busy)
+    assert plugin.state.n_exposures == n_exposures + 2
+    assert central.scan_button.isEnabled()
+
+
+def test_scans_split_large_jumps_by_default(window, tmp_path):
+    central = window.centralWidget()
+    assert central.scan_config().plan.max_jump == sequence.MAX_JUMP
+
+    central.max_jump(5)
+    filename = str(tmp_path / 'scan.cfg')
+    window.save_config_file(filename)
+    central.max_jump(0)
+    assert central.scan_config().plan.max_jump is None
+
+    window.load_config_file(filename)
+    assert central.max_jump() == 5
+    cfg = configparser.RawConfigParser()
+    cfg.read(filename)
+    assert ScanConfig.from_config(cfg).plan.max_jump == 5
+
+    # Files saved before the option existed
+    cfg.remove_option('fp', 'maxjump')
+    assert ScanConfig.from_config(cfg).plan.max_jump == sequence.MAX_JUMP
+
+
+def test_estimate_follows_a_loaded_configuration(app, window, tmp_path):
+    central = window.centralWidget()
+    set_scan(central, 3, 1.)
+    wait_until(app, lambda: not central._estimate_pending)
+    short = central.estimate_label.text()
+
+    set_scan(central, 30, 100.)
+    filename = str(tmp_path / 'scan.cfg')
+    window.save_config_file(filename)
+    set_scan(central, 3, 1.)
+    wait_until(app, lambda: not central._estimate_pending)
+    assert central.estimate_label.text() == short
+
+    window.load_config_file(filename)
+    wait_until(app, lambda: not central._estimate_pending)
+    assert central.estimate_label.text() != short
+    assert central.estimate_label.text().startswith("Estimated duration: ")
+
+
+def test_exported_script_gets_its_scan_id_when_it_runs(window, tmp_path):
+    set_scan(window.centralWidget(), 3, 1.)
+    filename = str(tmp_path / 'scan.sh')
+    window.export_script(filename)
+
+    with open(filename) as f:
+        text = f.read()
+    assert "sami dhe dbs set FAPERSID $scan_id\n" in text
+
+
+def test_model_round_trip_through_the_widgets(window):
+    central = window.centralWidget()
+    m = window.model.read().copy()
+    m.values[('obs', 'exptime')] = 12.5
+    m.values[('scan', 'nchannels')] = 42
+    m.values[('obs', 'pipelined')] = True
+    m.values[('gui', 'active_page')] = 1
+
+    changes = []
+    central.exp_time.line_edit.textChanged.connect(changes.append)
+    window.model.values = dict(m.values)
+    window.model.apply()
+    assert changes == []
+
+    assert central.exp_time() == 12.5
+    assert central.page_scan.n_channels() == 42
+    assert central.notebook.currentIndex() == 1
+    assert window.model.read() == m
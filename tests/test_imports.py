@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import samfp_gui
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def imported_by(statement):
+    """The modules loaded by a statement in a new interpreter."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         statement + "; import sys; print(' '.join(sys.modules))"],
+        env=env)
+    return set(output.decode().split())
+
+
+def test_package_import_is_cheap():
+    modules = imported_by("import samfp_gui")
+    assert 'samfp_gui.scan' not in modules
+    assert 'numpy' not in modules
+    assert 'PyQt5' not in modules
+
+
+@pytest.mark.parametrize('module', ['runner', 'export', 'estimate',
+                                    'simulation', 'mock_server', 'obsqueue'])
+def test_command_line_tools_never_import_qt(module):
+    modules = imported_by("import samfp_gui.{:s}".format(module))
+    assert not [m for m in modules if m.startswith('PyQt')]
+
+
+def test_submodules_are_imported_when_used():
+    assert samfp_gui.sequence.MAX_JUMP > 0
+    assert 'sequence' in dir(samfp_gui)
+    with pytest.raises(AttributeError):
+        samfp_gui.no_such_module
+
+
+def test_gui_leaves_the_scan_machinery_to_the_handlers():
+    pytest.importorskip('PyQt5')
+    modules = imported_by("import samfp_gui.gui")
+    for module in ['pkg_resources', 'asyncio', 'samfp_gui.engine',
+                   'samfp_gui.journal', 'samfp_gui.simulation',
+                   'samfp_gui.obsqueue']:
+        assert module not in modules
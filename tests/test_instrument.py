@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import csv
+import json
+
+import pytest
+
+from samfp_gui.engine import ScanEngine
+from samfp_gui.instrument import Recorder, command_verb
+from samfp_gui.plan import ScanPlan
+
+
+def test_command_verb():
+    assert command_verb("dhe dbs set FAPERSST 10") == 'dbs set'
+    assert command_verb("DHE SET obs.exptime 1.0") == 'set'
+    assert command_verb("fp moveabs 10") == 'moveabs'
+    assert command_verb("fp status") == 'status'
+    assert command_verb("dhe expose") == 'expose'
+    assert command_verb("dhe abort") == 'dhe'
+
+
+def test_summary_and_histograms():
+    recorder = Recorder()
+    for i, duration in enumerate([0.001, 0.002, 0.003, 0.004]):
+        recorder.add_command("fp moveabs {:d}".format(i), 10., None, 10.,
+                             10., 10. + duration, "DONE")
+    recorder.add_command("dhe expose", 20., 19.5, 20., 30., 30., "DONE")
+
+    summary = recorder.summary()
+    assert summary['moveabs']['count'] == 4
+    assert summary['moveabs']['total'] == pytest.approx(0.01)
+    assert summary['moveabs']['max'] == pytest.approx(0.004)
+    assert summary['expose']['p50'] == pytest.approx(10.)
+
+    histograms = recorder.histograms(bins=4)
+    assert sum(histograms['moveabs']['counts']) == 4
+    assert len(histograms['moveabs']['edges']) == 5
+
+
+def test_channel_breakdown():
+    recorder = Recorder()
+    recorder.add_channel(1, 1, 100, 0., 10.)
+    recorder.add_channel(1, 2, 90, 9., 20.)
+    recorder.add_command("fp moveabs 100", 0., None, 0., 1., 1., "DONE")
+    recorder.add_command("dhe expose", 2., None, 2., 10., 10., "DONE")
+    # Pipelined: the next move starts during the readout
+    recorder.add_command("fp moveabs 90", 9., None, 9., 9.5, 9.5, "DONE")
+    recorder.add_command("dhe expose", 11., None, 11., 20., 20., "DONE")
+
+    first, second = recorder.channel_breakdown()
+    assert first['moveabs'] == 1.
+    assert first['expose'] == 8.
+    assert first['overhead'] == 2.
+    assert first['idle'] == 1.
+    assert second['moveabs'] == 0.5
+    assert second['wall'] == 11.
+
+
+def test_scan_is_recorded_and_exported(plugin, tmp_path):
+    recorder = Recorder()
+    engine = ScanEngine(ScanPlan(2000, -10, 3), 0.01, settle=0,
+                        recorder=recorder)
+    assert engine.run() == 3
+
+    assert [r.verb for r in recorder.commands].count('expose') == 3
+    assert [(c.channel, c.z) for c in recorder.channels] == \
+        [(1, 2000), (2, 1990), (3, 1980)]
+    assert recorder.commands[0].connected is not None
+    assert all(r.start <= r.sent <= r.done for r in recorder.commands)
+
+    filename = str(tmp_path / 'timings.json')
+    recorder.to_json(filename)
+    with open(filename) as f:
+        timings = json.load(f)
+    assert timings['summary']['expose']['count'] == 3
+    assert len(timings['channels']) == 3
+
+    filename = str(tmp_path / 'commands.csv')
+    recorder.to_csv(filename)
+    with open(filename) as f:
+        rows = list(csv.reader(f))
+    assert rows[0][:2] == ['command', 'verb']
+    assert len(rows) == len(recorder.commands) + 1
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import datetime
+import os
+
+from samfp_gui import runner, scan
+from samfp_gui.config import ScanConfig
+from samfp_gui.engine import ScanEngine
+from samfp_gui.journal import ScanJournal
+from samfp_gui.plan import ScanPlan
+
+
+def test_entries_of_the_last_run(journal_dir):
+    journal = ScanJournal('SCAN_1')
+    plan = ScanPlan(2000, -10, 3)
+
+    journal.write_start(plan, 1., 1)
+    journal.write_step(1, 1, 2000)
+    journal.write_end('aborted')
+    assert not journal.is_finished
+
+    # Starting again opens a new run
+    journal.write_start(plan, 1., 1)
+    journal.write_step(1, 2, 1990)
+    assert journal.completed() == {(1, 2)}
+    assert journal.plan().table.tolist() == plan.table.tolist()
+
+    journal.write_end('done')
+    assert journal.is_finished
+    assert journal.path == os.path.join(journal_dir, 'SCAN_1.jsonl')
+
+
+def test_truncated_line_is_ignored(journal_dir):
+    journal = ScanJournal('SCAN_1')
+    journal.write_start(ScanPlan(2000, -10, 3), 1., 1)
+    journal.write_step(1, 1, 2000)
+    with open(journal.path, 'a') as f:
+        f.write('{"type": "step", "swe')
+
+    assert journal.completed() == {(1, 1)}
+
+
+def test_latest_unfinished(journal_dir, tmp_path):
+    plan = ScanPlan(2000, -10, 3)
+    unfinished = ScanJournal('SCAN_1')
+    unfinished.write_start(plan, 1., 1)
+    finished = ScanJournal('SCAN_2')
+    finished.write_start(plan, 1., 1)
+    finished.write_end('done')
+
+    assert ScanJournal.latest_unfinished().scan_id == 'SCAN_1'
+    assert ScanJournal.latest_unfinished(str(tmp_path / 'empty')) is None
+
+
+def test_resume_exposes_the_missing_channels(plugin, journal_dir):
+    config = ScanConfig(ScanPlan(2000, -10, 3, 2), 0.01, title='NGC 1068')
+    journal = runner.start_journal(config)
+
+    engine = ScanEngine(config.plan, config.exptime, settle=0,
+                        journal=journal)
+    engine.on_step = \
+        lambda step, sweep, channel, z: step == 4 and engine.stop()
+    assert engine.run() == 4
+    assert journal.entries[-1]['status'] == 'aborted'
+
+    # The plugin forgot the settings, e.g. it was restarted
+    plugin.state.dhe.clear()
+    scan.invalidate_remote_state()
+
+    resumed = ScanJournal.latest_unfinished()
+    assert resumed.scan_id == journal.scan_id
+    entry = resumed.restore()
+    assert plugin.state.dhe['image.title'] == 'NGC_1068'
+
+    engine = ScanEngine(resumed.plan(), entry['exptime'], entry['nframes'],
+                        settle=0, journal=resumed)
+    assert engine.run() == 6
+    assert plugin.state.n_exposures == 6
+    assert resumed.completed() == set((s, c) for s, c, z in config.plan)
+    assert resumed.is_finished
+
+
+class FrozenDatetime(datetime.datetime):
+
+    @classmethod
+    def utcnow(cls):
+        return cls(2026, 10, 18, 3, 4, 5)
+
+
+def test_scan_ids_are_unique(journal_dir, monkeypatch):
+    monkeypatch.setattr(datetime, 'datetime', FrozenDatetime)
+    monkeypatch.setattr(scan, '_scan_ids', set())
+
+    first = scan.make_scan_id()
+    assert first == 'SCAN_20261018_UTC030405'
+    assert scan.make_scan_id() == first + '_2'
+
+    # Nor is a scan ID given again once its journal exists, e.g. by
+    # another process
+    monkeypatch.setattr(scan, '_scan_ids', set())
+    for scan_id in [first, first + '_2']:
+        ScanJournal(scan_id).write_start(ScanPlan(2000, -10, 3), 1., 1)
+    assert scan.make_scan_id() == first + '_3'
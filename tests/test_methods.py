@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import numpy as np
+import pytest
+
+from samfp_gui import methods
+
+
+def test_scalars_give_floats():
+    order = methods.calc_order(6562.8, 200.)
+    assert isinstance(order, float)
+    assert order == pytest.approx(2 * 200e4 / 6562.8)
+    assert methods.calc_finesse(20., 0.5) == pytest.approx(40.)
+    assert methods.calc_n_channels(10., 2., 1.) == 21
+    assert isinstance(methods.calc_n_channels(10.), int)
+
+
+def test_invalid_scalars_are_masked():
+    assert methods.calc_finesse(20., 0.) is np.ma.masked
+    assert methods.calc_order(-6562.8, 200.) is np.ma.masked
+    assert methods.calc_fsr_bcv(6562.8, np.nan) is np.ma.masked
+    assert methods.calc_n_channels(np.inf) is np.ma.masked
+
+
+def test_arrays_broadcast_and_mask_the_invalid_elements():
+    wavelength = np.array([6562.8, 0., 6583.4])
+    fsr = methods.calc_fsr_wavelength(wavelength, 200.)
+    assert np.ma.isMaskedArray(fsr)
+    assert fsr.mask.tolist() == [False, True, False]
+    assert fsr[0] == pytest.approx(methods.calc_fsr_wavelength(6562.8, 200.))
+
+    resolution = methods.calc_resolution(6562.8, np.array([[100.], [200.]]),
+                                         np.array([10., 20., -1.]))
+    assert resolution.shape == (2, 3)
+    assert resolution.mask[:, 2].all()
+    assert not resolution.mask[:, :2].any()
+
+
+def test_masked_inputs_stay_masked():
+    finesse = np.ma.masked_array([10., 20.], mask=[True, False])
+    n = methods.calc_n_channels(finesse)
+    assert n.mask.tolist() == [True, False]
+    assert n[1] == 41
+    assert n.dtype.kind == 'i'
+
+
+def test_quantities_agree():
+    wavelength, gap, finesse = 6562.8, 200., 15.
+    fsr = methods.calc_fsr_wavelength(wavelength, gap)
+    assert methods.calc_fsr_velocity(wavelength, gap) == \
+        pytest.approx(299792.458 * fsr / wavelength)
+    assert methods.calc_resolution(wavelength, gap, finesse) == \
+        pytest.approx(wavelength * finesse / fsr)
+
+    qgc = methods.calc_queensgate_constant(wavelength, 340.)
+    assert methods.calc_fsr_bcv(wavelength, qgc) == pytest.approx(340.)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import socket
+import threading
+
+from samfp_gui import protocol
+from samfp_gui.mock_server import MockPlugin, PluginState
+
+
+class VirtualClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0., seconds)
+
+
+def virtual_state(**kwargs):
+    clock = VirtualClock()
+    return PluginState(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_settings_are_remembered():
+    state, _ = virtual_state()
+    assert state.handle("dhe set image.title NGC 1068") == "DONE"
+    assert state.handle("DHE DBS SET FAPERSWP 2") == "DONE"
+    assert state.dhe == {'image.title': 'NGC 1068'}
+    assert state.dbs == {'FAPERSWP': '2'}
+    assert state.n_commands == 2
+
+
+def test_invalid_commands_are_answered_with_an_error():
+    state, _ = virtual_state()
+    for command in ["fp moveabs 5000", "fp moveabs -1", "fp moveabs up",
+                    "dhe explode"]:
+        assert protocol.is_error(state.handle(command))
+    assert state.z == 0
+
+
+def test_moves_take_time_and_settle():
+    state, clock = virtual_state(move_delay=0.1, move_delay_per_bcv=0.01,
+                                 settle_delay=0.5)
+    assert state.handle("fp moveabs 100") == "DONE"
+    assert clock.now == 0.1 + 100 * 0.01
+    assert state.handle("fp status") == "MOVING 100"
+    clock.sleep(0.5)
+    assert state.handle("fp status") == "STABLE 100"
+
+
+def test_exposure_lasts_every_frame_and_its_readout():
+    state, clock = virtual_state(readout_delay=3.)
+    state.handle("dhe set obs.exptime 10.000000")
+    state.handle("dhe set obs.nimages 2")
+    assert state.handle("dhe expose") == "DONE"
+    assert clock.now == 2 * (10. + 3.)
+    assert state.n_exposures == 1
+
+
+def test_abort_interrupts_the_exposure():
+    state = PluginState(exposure_delay=10.)
+    threading.Timer(0.05, state.abort).start()
+    assert protocol.is_error(state.handle("dhe expose"))
+    assert state.n_exposures == 0
+    assert state.n_aborts == 1
+
+
+def test_replies_split_in_two_segments():
+    with MockPlugin(host='localhost', port=0, split_replies=True) as server:
+        s = socket.create_connection((server.host, server.port), timeout=5.)
+        try:
+            s.sendall(protocol.encode(protocol.FP_MOVEABS(10)) +
+                      protocol.encode(protocol.FP_STATUS))
+            buffer = protocol.LineBuffer()
+            lines = []
+            while len(lines) < 2:
+                buffer.feed(s.recv(4096))
+                lines.extend(iter(buffer.next_line, None))
+        finally:
+            s.close()
+    assert lines == [b"DONE", b"STABLE 10"]
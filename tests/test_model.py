@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import configparser
+
+import pytest
+
+from samfp_gui import model, sequence
+from samfp_gui.config import ScanConfig
+from samfp_gui.model import ParameterModel
+
+
+def full_config():
+    """A configuration file with every option the model reads."""
+    samples = {str: 'OBJECT', int: '3', float: '2.5', bool: 'yes'}
+    cfg = configparser.RawConfigParser()
+    keys = [(s, o, k) for s, o, _, k in model.FIELDS] + model.GUI_FIELDS + \
+        [key + (float,) for key in (model.REDSHIFT, model.VELOCITY,
+                                    model.OBSERVED)]
+    for section, option, kind in keys:
+        if not cfg.has_section(section):
+            cfg.add_section(section)
+        cfg.set(section, option, samples[kind])
+    cfg.set('gui', 'active_page', '0')
+    cfg.set('obs', 'binning', '4')
+    return cfg
+
+
+def test_load_converts_every_value():
+    values = ParameterModel().load(full_config()).values
+    assert values[('obs', 'exptime')] == 2.5
+    assert values[('obs', 'nframes')] == 3
+    assert values[('obs', 'pipelined')] is True
+    assert values[('gui', 'async')] is True
+    assert values[('obs', 'type')] == 'OBJECT'
+    assert values[model.VELOCITY] == 2.5
+
+
+def test_integers_saved_as_floats():
+    cfg = full_config()
+    cfg.set('scan', 'nchannels', '37.0')
+    assert ParameterModel().load(cfg).values[('scan', 'nchannels')] == 37
+
+
+def test_a_missing_option_leaves_the_model_as_it_was():
+    m = ParameterModel().load(full_config())
+    cfg = full_config()
+    cfg.remove_option('obs', 'exptime')
+    cfg.set('scan', 'nchannels', '10')
+
+    with pytest.raises(configparser.Error):
+        m.load(cfg)
+    assert m == ParameterModel().load(full_config())
+
+
+def test_files_saved_by_older_versions():
+    cfg = full_config()
+    for section, option in model.DEFAULTS:
+        cfg.remove_option(section, option)
+
+    values = ParameterModel().load(cfg).values
+    assert values[('obs', 'pipelined')] is False
+    assert values[('gui', 'async')] is False
+    assert values[('fp', 'maxjump')] == sequence.MAX_JUMP
+
+
+def test_config_round_trip():
+    m = ParameterModel().load(full_config())
+    cfg = m.to_config()
+    assert ParameterModel().load(cfg) == m
+
+    config = ScanConfig.from_config(cfg)
+    assert config.pipelined
+    assert (config.plan.n_channels, config.exptime) == (3, 2.5)
+
+    other = m.copy()
+    other.values[('obs', 'exptime')] = 1.
+    assert other != m
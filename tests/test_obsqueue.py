@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import json
+import threading
+import time
+
+import pytest
+
+from samfp_gui.config import ScanConfig
+from samfp_gui.journal import ScanJournal
+from samfp_gui.obsqueue import ObservationQueue, QueueItem, QueueRunner
+from samfp_gui.plan import ScanPlan
+
+# Longer than the shutter margin of the engine
+READOUT = 0.8
+
+
+def config(z_start=2000, exptime=0.01, pipelined=False, n_channels=3,
+           **kwargs):
+    return ScanConfig(ScanPlan(z_start, -10, n_channels), exptime,
+                      pipelined=pipelined, **kwargs)
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    return str(tmp_path / 'queue.json')
+
+
+@pytest.fixture
+def timeline(plugin):
+    """The (command, received, answered) times of every command."""
+    handle = plugin.state.handle
+    entries = []
+
+    def logged(command):
+        t0 = time.monotonic()
+        message = handle(command)
+        entries.append((command, t0, time.monotonic()))
+        return message
+
+    plugin.state.handle = logged
+    return entries
+
+
+def test_queue_is_saved_after_every_change(queue_file):
+    queue = ObservationQueue(queue_file)
+    dark = queue.add(config(image_type='DARK'))
+    science = queue.add(config(1000, title='NGC 1068'), name='science')
+    queue.add(config(500))
+    assert dark.name == 'DARK'
+
+    queue.move(2, 0)
+    queue.remove(1)
+    queue.set_status(science, 'running', 'SCAN_1')
+
+    loaded = ObservationQueue.load(queue_file)
+    assert [i.config.plan.z_start for i in loaded] == [500, 1000]
+    assert loaded[1].name == 'science'
+    assert loaded[1].scan_id == 'SCAN_1'
+    # It did not finish before the restart
+    assert loaded[1].status == 'aborted'
+
+    loaded.reset(1)
+    assert (loaded[1].status, loaded[1].scan_id) == ('pending', None)
+
+
+def test_bad_items_are_skipped(queue_file):
+    queue = ObservationQueue(queue_file)
+    queue.add(config())
+    with open(queue_file) as f:
+        saved = json.load(f)
+    saved['items'].append(dict(config=dict(exptime=1.)))
+    with open(queue_file, 'w') as f:
+        json.dump(saved, f)
+
+    assert len(ObservationQueue.load(queue_file)) == 1
+    assert len(ObservationQueue.load(queue_file + '.missing')) == 0
+    with pytest.raises(ValueError):
+        QueueItem(config(), status='paused')
+
+
+def test_running_items_stay_where_they_are():
+    queue = ObservationQueue(None)
+    first, second, third = [queue.add(config(z)) for z in (1000, 2000, 3000)]
+    queue.set_status(first, 'running')
+
+    with pytest.raises(ValueError):
+        queue.remove(0)
+    with pytest.raises(ValueError):
+        queue.reset(0)
+    assert queue.next_pending() is second
+    assert queue.next_pending(after=second) is third
+    assert queue.next_pending(after=third) is None
+
+
+def test_scans_run_back_to_back(plugin, journal_dir):
+    queue = ObservationQueue(None)
+    for z in (2000, 1000, 500):
+        queue.add(config(z))
+    statuses = []
+    runner = QueueRunner(queue, settle=0.)
+    runner.on_item = lambda item: statuses.append(item.status)
+
+    assert runner.run() == 3
+    assert [i.status for i in queue] == ['done'] * 3
+    assert statuses == ['running', 'done'] * 3
+    assert len(set(i.scan_id for i in queue)) == 3
+    assert plugin.state.n_exposures == 9
+    assert ScanJournal.latest_unfinished() is None
+
+
+def test_next_scan_moves_during_the_last_readout(plugin, journal_dir,
+                                                  timeline):
+    plugin.state.readout_delay = READOUT
+    queue = ObservationQueue(None)
+    queue.add(config(2000, pipelined=True, n_channels=1))
+    queue.add(config(1000, n_channels=1))
+
+    assert QueueRunner(queue, settle=0.).run() == 2
+
+    expose = [(t0, t1) for c, t0, t1 in timeline if c == "dhe expose"]
+    move, = [t0 for c, t0, t1 in timeline if c == "fp moveabs 1000"]
+    assert len(expose) == 2
+    assert expose[0][0] < move < expose[0][1]
+    # The settings of the next scan wait for the readout
+    title, = [t0 for c, t0, t1 in timeline
+              if c.startswith("dhe set image.title") and t0 > expose[0][0]]
+    assert title > expose[0][1]
+    assert [i.status for i in queue] == ['done', 'done']
+
+
+def test_abort_stops_the_queue(plugin, journal_dir):
+    queue = ObservationQueue(None)
+    queue.add(config(2000, exptime=10.))
+    queue.add(config(1000))
+    runner = QueueRunner(queue, settle=0.)
+    threading.Timer(0.3, runner.abort).start()
+
+    t0 = time.monotonic()
+    assert runner.run() == 0
+    assert time.monotonic() - t0 < 5.
+    assert [i.status for i in queue] == ['aborted', 'pending']
+    assert plugin.state.n_aborts == 1
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import socket
+
+import pytest
+
+from samfp_gui import protocol
+from samfp_gui.connection import Connection
+from samfp_gui.mock_server import MockPlugin
+
+
+def test_template_encodes_arguments():
+    assert protocol.FP_MOVEABS(2048) == b"fp moveabs 2048\n"
+    assert protocol.DBS_SET('FAPERSST', '2000') == \
+        b"dhe dbs set FAPERSST 2000\n"
+
+
+def test_encode_adds_the_terminator_to_text_only():
+    assert protocol.encode("fp status") == b"fp status\n"
+    assert protocol.encode(protocol.EXPOSE) == protocol.EXPOSE
+
+
+def test_as_text_strips_the_terminator():
+    assert protocol.as_text(protocol.FP_MOVEABS(10)) == "fp moveabs 10"
+    assert protocol.as_text("dhe expose") == "dhe expose"
+
+
+def test_subsystem():
+    assert protocol.subsystem(protocol.FP_MOVEABS(10)) == 'fp'
+    assert protocol.subsystem("DHE set binning 4 4") == 'dhe'
+
+
+@pytest.mark.parametrize('command, idempotent', [
+    (protocol.FP_MOVEABS(10), True),
+    (protocol.DBS_SET('FAPERSST', '10'), True),
+    ("dhe  set  image.dir /tmp", True),
+    (protocol.FP_STATUS, True),
+    (protocol.EXPOSE, False),
+    ("fp moveabsolute 10", False),
+    ("reboot", False),
+])
+def test_is_idempotent(command, idempotent):
+    assert protocol.is_idempotent(command) is idempotent
+
+
+def test_line_buffer_joins_a_split_reply():
+    buffer = protocol.LineBuffer()
+    buffer.feed(b"DO")
+    assert buffer.next_line() is None
+    buffer.feed(b"NE\n")
+    assert buffer.next_line() == b"DONE"
+    assert len(buffer) == 0
+
+
+def test_line_buffer_splits_coalesced_replies():
+    buffer = protocol.LineBuffer()
+    buffer.feed(b"DONE\nSTABLE 2048\nERR")
+    assert buffer.next_line() == b"DONE"
+    assert buffer.next_line() == b"STABLE 2048"
+    assert buffer.next_line() is None
+    assert len(buffer) == 3
+
+
+def test_line_buffer_rejects_a_line_without_terminator():
+    buffer = protocol.LineBuffer()
+    with pytest.raises(protocol.ProtocolError):
+        buffer.feed(b"x" * (protocol.MAX_LINE + 1))
+    assert len(buffer) == 0
+
+
+def test_line_buffer_flush_returns_an_unterminated_line():
+    buffer = protocol.LineBuffer()
+    buffer.feed(b"DONE")
+    assert buffer.next_line() is None
+    assert buffer.flush() == b"DONE"
+    assert len(buffer) == 0
+
+
+def test_parse_reply():
+    assert protocol.parse_reply("STABLE 2048\n") == ('STABLE', '2048')
+    assert protocol.parse_reply("Error: unknown command") == \
+        ('ERROR', 'unknown command')
+    assert protocol.parse_reply("DONE") == ('DONE', '')
+
+
+def test_is_done_and_is_error():
+    assert protocol.is_done(" done \n")
+    assert not protocol.is_done("DONE 1")
+    assert protocol.is_error("ERROR: z must be between 0 and 4095")
+    assert not protocol.is_error("DONE")
+
+
+def test_connection_reads_split_and_pipelined_replies():
+    with MockPlugin(host='localhost', port=0, split_replies=True) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        assert connection.send(protocol.FP_MOVEABS(100)) == "DONE"
+        assert connection.send_many(
+            [protocol.FP_STATUS, "fp moveabs 5000"]) == \
+            ["STABLE 100", "ERROR: z must be between 0 and 4095"]
+        assert connection.n_connects == 1
+
+
+def test_connection_accepts_an_unterminated_reply_before_close():
+    with MockPlugin(host='localhost', port=0, one_shot=True) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        assert connection.send(protocol.FP_MOVEABS(100)) == "DONE"
+        assert not connection.is_connected
+        assert connection.send(protocol.EXPOSE) == "DONE"
+        assert connection.n_connects == 2
+        assert server.state.n_exposures == 1
+
+
+def test_pipeline_fails_when_the_plugin_closes_after_one_reply():
+    with MockPlugin(host='localhost', port=0, one_shot=True) as server, \
+            Connection(server.host, server.port, timeout=5.) as connection:
+        with pytest.raises(socket.error):
+            connection.send_many([protocol.FP_MOVEABS(100), protocol.EXPOSE])
+        assert server.state.n_exposures == 0
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+from samfp_gui import scan
+
+
+def test_unchanged_settings_are_not_sent_again(plugin):
+    assert scan.set_image_basename('fp') == "DONE"
+    assert scan.set_image_basename('fp') == "DONE"
+    assert scan.set_image_exposure_time(2.) == "DONE"
+    assert scan.set_image_exposure_time(2.) == "DONE"
+    assert plugin.state.n_commands == 2
+
+    scan.set_image_basename('sami')
+    assert plugin.state.n_commands == 3
+    assert plugin.state.dhe['image.basename'] == 'sami'
+    assert ['dhe set', 'image.basename', 'sami'] in scan.get_remote_state()
+
+
+def test_rejected_settings_are_sent_again(plugin):
+    plugin.state.handle = lambda command: "ERROR: busy"
+    assert scan.set_scan_current_z(10) == "ERROR: busy"
+    assert scan.get_remote_state() == []
+
+    del plugin.state.handle
+    assert scan.set_scan_current_z(10) == "DONE"
+    assert plugin.state.dbs['FAPERSST'] == '10'
+
+
+def test_invalidate(plugin):
+    scan.set_image_basename('fp')
+    scan.set_scan_current_z(10)
+    # Changed from SAMI's own GUI
+    plugin.state.handle("dhe set image.basename other")
+    plugin.state.handle("dhe dbs set FAPERSST 0")
+
+    scan.invalidate_remote_state('image.basename')
+    scan.set_image_basename('fp')
+    scan.set_scan_current_z(10)
+    assert plugin.state.dhe['image.basename'] == 'fp'
+    assert plugin.state.dbs['FAPERSST'] == '0'
+
+    scan.invalidate_remote_state()
+    scan.set_scan_current_z(10)
+    assert plugin.state.dbs['FAPERSST'] == '10'
+
+
+def test_resync_sends_every_setting_again(plugin):
+    scan.set_image_basename('fp')
+    scan.set_scan_current_sweep(2)
+    # The plugin was restarted
+    plugin.state.dhe.clear()
+    plugin.state.dbs.clear()
+
+    scan.resync()
+    assert plugin.state.dhe == {'image.basename': 'fp'}
+    assert plugin.state.dbs == {'FAPERSWP': '2'}
+
+
+def test_resync_forgets_rejected_settings(plugin):
+    scan.set_image_basename('fp')
+    scan.set_scan_current_sweep(2)
+    handle = plugin.state.handle
+    plugin.state.handle = lambda command: \
+        "ERROR: read only" if "FAPERSWP" in command else handle(command)
+
+    scan.resync()
+    assert scan.get_remote_state() == [['dhe set', 'image.basename', 'fp']]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import json
+import os
+import signal
+import threading
+
+import pytest
+
+from samfp_gui import runner, settle
+from samfp_gui.journal import ScanJournal
+
+PLAN_FILE = """
+[image]
+basename = fp
+dir = /data
+comment = Ha
+title = NGC 1068
+type = OBJECT
+
+[obs]
+exptime = {exptime}
+nframes = 1
+
+[scan]
+zstart = 2000
+zstep = -10
+nchannels = 3
+nsweeps = 2
+maxjump = 0
+"""
+
+
+@pytest.fixture
+def plan_file(tmp_path):
+    def write(exptime=0.01):
+        filename = str(tmp_path / 'plan.cfg')
+        with open(filename, 'w') as f:
+            f.write(PLAN_FILE.format(exptime=exptime))
+        return filename
+    return write
+
+
+@pytest.fixture
+def no_settle():
+    """Scans do not wait for the FP to settle."""
+    settle.SettleModel(0, 0, 0).save(settle.SETTLE_FILE)
+    yield
+    os.remove(settle.SETTLE_FILE)
+
+
+def events(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def address(plugin):
+    return ['--host', plugin.host, '--port', str(plugin.port)]
+
+
+def test_scan_reports_json_lines(plugin, journal_dir, no_settle, plan_file,
+                                 capsys):
+    assert runner.main([plan_file()] + address(plugin)) == 0
+
+    out = events(capsys)
+    assert [e['type'] for e in out] == ['start'] + ['step'] * 6 + ['end']
+    assert out[0]['n_steps'] == 6
+    assert out[0]['scan_id'].startswith('SCAN_')
+    assert [e['z'] for e in out[1:-1]] == [2000, 1990, 1980] * 2
+    assert out[-1]['status'] == 'done'
+    assert plugin.state.n_exposures == 6
+    assert plugin.state.dhe['image.title'] == 'NGC_1068'
+    assert ScanJournal.latest_unfinished() is None
+
+
+def test_sigint_aborts_the_scan(plugin, journal_dir, no_settle, plan_file,
+                                capsys):
+    filename = plan_file(exptime=10.)
+    threading.Timer(0.3, os.kill, [os.getpid(), signal.SIGINT]).start()
+
+    assert runner.main([filename] + address(plugin)) == 1
+    out = events(capsys)
+    assert out[-1]['status'] == 'aborted'
+    assert out[-1]['abort_latency'] < 1.
+    assert plugin.state.n_aborts == 1
+
+    # And continues where it stopped
+    plugin.state.exposure_delay = 0.01
+    assert runner.main(['--resume'] + address(plugin)) == 0
+    out = events(capsys)
+    assert out[0]['n_done'] == 0
+    assert out[-1]['status'] == 'done'
+    assert plugin.state.n_exposures == 6
+
+
+def test_estimate_sends_nothing(plugin, plan_file, capsys):
+    assert runner.main([plan_file(), '--estimate'] + address(plugin)) == 0
+    estimate, = events(capsys)
+    assert estimate['type'] == 'estimate'
+    assert estimate['n_steps'] == 6
+    assert estimate['duration'] > 6 * 0.01
+    assert plugin.state.n_commands == 0
+
+
+def test_errors_are_reported(plugin, journal_dir, tmp_path, capsys):
+    assert runner.main([str(tmp_path / 'missing.cfg')] +
+                       address(plugin)) == 1
+    assert events(capsys)[0]['type'] == 'error'
+
+    assert runner.main(['--resume'] + address(plugin)) == 1
+    error, = events(capsys)
+    assert 'no interrupted scan' in error['message']
+
+    with pytest.raises(SystemExit):
+        runner.main([])
+    assert plugin.state.n_commands == 0
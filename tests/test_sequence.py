@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import configparser
+
+import numpy as np
+import pytest
+
+from samfp_gui import sequence
+from samfp_gui.plan import ScanPlan
+
+
+def test_interference_order_and_free_spectral_range():
+    order = sequence.interference_order(sequence.H_ALPHA, 44.)
+    assert order == pytest.approx(2 * 44e4 / 6562.78)
+
+    fsr = sequence.fsr_wavelength(sequence.H_ALPHA, order)
+    assert fsr == pytest.approx(sequence.H_ALPHA / order, rel=1e-4)
+    assert sequence.fsr_velocity(sequence.H_ALPHA, order) == \
+        pytest.approx(sequence.SPEED_OF_LIGHT * fsr / sequence.H_ALPHA)
+
+
+def test_redshift():
+    assert sequence.redshifted(6000., 0.) == 6000.
+    assert sequence.redshifted(6000., sequence.SPEED_OF_LIGHT / 100) == \
+        pytest.approx(6060.)
+
+
+def test_queensgate_constant_round_trip():
+    qgc = sequence.queensgate_constant(sequence.NEON, 360.)
+    assert sequence.fsr_bcv(sequence.NEON, qgc) == pytest.approx(360.)
+
+
+def test_channels_and_step():
+    assert sequence.n_channels(12., 2.) == 25
+    assert sequence.n_channels(12., 2., overscan=2.) == 49
+    assert sequence.bcv_step(360., 12., 2.) == pytest.approx(15.)
+
+
+def test_functions_broadcast():
+    n = sequence.n_channels(np.array([10., 12.]), np.array([[2.], [3.]]))
+    assert n.tolist() == [[21, 25], [31, 37]]
+
+
+def test_round_bcv_rounds_halves_away_from_zero():
+    assert sequence.round_bcv([0.5, 1.5, 2.4, -0.5, -2.5]).tolist() == \
+        [1, 2, 2, -1, -3]
+
+
+def test_channel_positions():
+    assert sequence.channel_positions(2000, -7.5, 4).tolist() == \
+        [2000, 1993, 1985, 1978]
+
+
+def test_substeps_split_large_jumps():
+    moves = sequence.substeps([10, 20, 19], max_jump=3)
+    assert moves['z'].tolist() == [10, 13, 16, 19, 20, 19]
+    assert moves['step'].tolist() == [0, 1, 1, 1, 1, 2]
+    assert moves['final'].tolist() == [True, False, False, False, True, True]
+
+
+def test_substeps_from_a_known_position():
+    moves = sequence.substeps([4], max_jump=3, z0=10)
+    assert moves['z'].tolist() == [7, 4]
+    assert sequence.substeps([10, 20], max_jump=None)['z'].tolist() == \
+        [10, 20]
+
+
+def test_plan_flyback_goes_through_substeps():
+    plan = ScanPlan(100, -2, 3, n_sweeps=2, max_jump=3)
+    assert plan.z.tolist() == [100, 98, 96]
+    # Back from 96 to 100 between the sweeps
+    assert plan.substeps(2, 1) == [99]
+    assert plan.substeps(1, 2) == []
+
+
+def test_plan_from_config_splits_large_jumps_by_default():
+    cfg = configparser.RawConfigParser()
+    cfg.read_dict({'scan': dict(zstart=100, zstep=-5, nchannels=3,
+                                nsweeps=1)})
+    plan = ScanPlan.from_config(cfg, 'scan')
+    assert plan.max_jump == sequence.MAX_JUMP
+    assert plan.substeps(1, 2) == [97]
+
+    cfg.set('scan', 'maxjump', '0')
+    assert ScanPlan.from_config(cfg, 'scan').max_jump is None
+
+
+def test_scan_sequence():
+    s = sequence.ScanSequence(sequence.H_ALPHA, 44., 9.5, 12., 2000)
+    assert s.n_channels == 25
+    assert s.z_step == pytest.approx(-s.fsr_bcv / 24.)
+    assert s.z[0] == 2000 and (np.diff(s.z) < 0).all()
+    assert s.resolution == pytest.approx(s.order * 12., rel=1e-3)
+    assert len(s.plan(n_sweeps=2)) == 50
+
+
+def test_scan_sequence_rejects_unresolved_steps():
+    with pytest.raises(ValueError):
+        sequence.ScanSequence(sequence.H_ALPHA, 44., 9.5, 200., 2000)
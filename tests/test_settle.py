@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import numpy as np
+import pytest
+
+from samfp_gui import settle
+from samfp_gui.engine import ScanEngine
+from samfp_gui.plan import ScanPlan
+from samfp_gui.settle import SettleModel
+
+
+def test_settle_time_grows_with_the_jump():
+    model = SettleModel(base=0.05, per_bcv=0.01, maximum=1.)
+    assert model(0) == pytest.approx(0.05)
+    assert model(-10) == pytest.approx(0.15)
+    assert model(1000) == 1.
+    assert model() == 1.
+    np.testing.assert_allclose(model(np.array([0, 10, 1000])),
+                               [0.05, 0.15, 1.])
+
+
+def test_fit():
+    jumps = [1, 10, 100, -100]
+    model = SettleModel.fit(jumps, [0.02 + 0.003 * abs(j) for j in jumps])
+    assert model.base == pytest.approx(0.02)
+    assert model.per_bcv == pytest.approx(0.003)
+    assert model.maximum == pytest.approx(0.32)
+
+    with pytest.raises(ValueError):
+        SettleModel.fit([10, 10], [0.1, 0.2])
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'settle.json')
+    assert repr(SettleModel.load(filename)) == repr(SettleModel())
+
+    SettleModel(0.1, 0.001, 3.).save(filename)
+    assert repr(SettleModel.load(filename)) == \
+        "SettleModel(base=0.1, per_bcv=0.001, maximum=3)"
+
+
+def test_wait_until_stable(plugin):
+    plugin.state.settle_delay = 0.2
+    plugin.state.handle("fp moveabs 100")
+    assert plugin.state.status() == "MOVING 100"
+    assert settle.wait_until_stable(2.)
+    assert plugin.state.status() == "STABLE 100"
+
+    plugin.state.settle_delay = 10.
+    plugin.state.handle("fp moveabs 200")
+    assert not settle.wait_until_stable(0.1)
+
+
+def test_engine_waits_for_the_jump(plugin):
+    # Sleeps are recorded instead of slept
+    sleeps = []
+    model = SettleModel(base=0.01, per_bcv=0.01, maximum=5.)
+    engine = ScanEngine(ScanPlan(2000, -10, 3, n_sweeps=2), 0., settle=model,
+                        sleep=sleeps.append)
+    assert engine.run() == 6
+
+    # The first move, two steps, the flyback and two steps
+    settles = [s for s in sleeps if s > 0]
+    np.testing.assert_allclose(settles, [5., 0.11, 0.11, 0.21, 0.11, 0.11],
+                               atol=0.03)
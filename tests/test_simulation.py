@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from samfp_gui import runner, scan
+from samfp_gui.cancel import CancelToken
+from samfp_gui.config import ScanConfig
+from samfp_gui.plan import ScanPlan
+from samfp_gui.simulation import Simulator, VirtualClock
+
+PLAN_FILE = """
+[image]
+basename = fp
+dir = /data
+comment = Ha
+title = NGC 1068
+type = OBJECT
+
+[obs]
+exptime = 300
+nframes = 1
+
+[scan]
+zstart = 2000
+zstep = -10
+nchannels = 4
+nsweeps = 5
+maxjump = 0
+"""
+
+
+def test_clock_jumps_when_every_thread_waits():
+    clock = VirtualClock()
+    woken = []
+
+    def sleeper(seconds):
+        clock.sleep(seconds)
+        woken.append((seconds, clock.monotonic()))
+
+    threads = [threading.Thread(target=sleeper, args=(s,))
+               for s in (3600., 60.)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10.)
+
+    assert time.monotonic() - t0 < 2.
+    assert woken == [(60., 60.), (3600., 3600.)]
+    assert clock.n_jumps == 2
+
+
+def test_hours_of_scan_run_in_seconds():
+    config = ScanConfig(ScanPlan(2000, -10, 4, 5), 300.)
+    address = scan.HOST, scan.PORT
+
+    t0 = time.monotonic()
+    with Simulator(settle=0., readout_time=5.) as simulator:
+        engine = simulator.prepare(config)
+        assert engine.run() == 20
+        elapsed = simulator.elapsed
+        assert simulator.state.n_exposures == 20
+
+    assert time.monotonic() - t0 < 30.
+    # Every exposure and readout, and little else
+    assert elapsed == pytest.approx(20 * 305., rel=0.01)
+    assert (scan.HOST, scan.PORT) == address
+
+
+def test_simulated_scan_can_be_cancelled():
+    cancel = CancelToken()
+    config = ScanConfig(ScanPlan(2000, -10, 4, 5), 300.)
+
+    with Simulator(settle=0.) as simulator:
+        engine = simulator.prepare(config, cancel=cancel)
+        engine.on_step = lambda step, *args: step == 2 and cancel.cancel()
+        assert engine.run() == 2
+        assert simulator.state.n_exposures == 2
+
+
+def test_runner_reports_virtual_time(journal_dir, tmp_path, capsys):
+    filename = str(tmp_path / 'plan.cfg')
+    with open(filename, 'w') as f:
+        f.write(PLAN_FILE)
+
+    assert runner.main([filename, '--simulate']) == 0
+    events = [json.loads(line)
+              for line in capsys.readouterr().out.splitlines()]
+    assert [e['type'] for e in events] == ['start'] + ['step'] * 20 + ['end']
+    assert events[-1]['status'] == 'done'
+    assert events[-1]['elapsed'] > 20 * 300.
+    # Nothing to resume, nothing in the journal
+    assert not os.path.exists(journal_dir)
+
+    with pytest.raises(SystemExit):
+        runner.main([filename, '--simulate', '--resume'])